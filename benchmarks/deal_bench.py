@@ -0,0 +1,132 @@
+"""Benchmarks of the deal endpoints and the deal event handler
+
+They run on the same in-memory database, web client and message queue as
+the tests, so they measure the plugin rather than a database server. The
+event handler calls a stub webhook on localhost.
+
+$ py.test benchmarks/deal_bench.py
+
+The results are written as JSON to `benchmark-results.json`, or to
+`$HELLO_WORLD_BENCH_RESULTS`. `$HELLO_WORLD_BENCH_ITERATIONS` sets the
+number of requests or messages per benchmark. Use `manage.py test bench` to
+compare the results to an earlier run.
+"""
+import hello_world.settings
+import hello_world.webhooks.executor
+import http.client
+import json
+import lime_config
+import os
+import pytest
+import time
+from benchmarks import harness
+
+ITERATIONS = int(os.environ.get('HELLO_WORLD_BENCH_ITERATIONS', 500))
+RESULTS_PATH = os.environ.get('HELLO_WORLD_BENCH_RESULTS',
+                              'benchmark-results.json')
+WARMUP = 10
+
+
+@pytest.mark.parametrize('todos', ['inline', 'deferred'])
+def test_create_deal(todos, limeapp, webapp, acme_company, monkeypatch,
+                     results):
+    # With deferred todos, the endpoint only commits the deal and leaves
+    # the todo to the event handler, which isn't part of the timing.
+    monkeypatch.setitem(lime_config.config['plugins']['hello_world'],
+                        'todos', {'mode': todos})
+    hello_world.settings.load()
+    headers = {'Content-Type': 'application/json'}
+
+    def create_deal(i):
+        data = dict(name='Deal {}'.format(i),
+                    company=acme_company.id,
+                    coworker=limeapp.coworker.id)
+        res = webapp.post('/myapp/hello-world/deal/', data=json.dumps(data),
+                          headers=headers)
+        return res.status_code == http.client.CREATED
+
+    # The inline run keeps the name of earlier runs, to compare against
+    name = ('POST /deal/' if todos == 'inline'
+            else 'POST /deal/ ({} todos)'.format(todos))
+    results[name] = harness.measure(create_deal, ITERATIONS, warmup=WARMUP)
+
+
+def test_create_deals(limeapp, webapp, acme_company, results):
+    headers = {'Content-Type': 'application/json'}
+    deals_per_request = 100
+
+    def create_deals(i):
+        data = {'deals': [dict(name='Deal {}.{}'.format(i, n),
+                               company=acme_company.id,
+                               coworker=limeapp.coworker.id)
+                          for n in range(deals_per_request)]}
+        res = webapp.post('/myapp/hello-world/deals/', data=json.dumps(data),
+                          headers=headers)
+        return res.status_code == http.client.CREATED
+
+    summary = harness.measure(create_deals,
+                              max(ITERATIONS // deals_per_request, 1),
+                              warmup=1)
+    summary['deals_per_second'] = (summary['per_second'] *
+                                   deals_per_request)
+    results['POST /deals/'] = summary
+
+
+@pytest.mark.parametrize('delivery', ['sync', 'async', 'batch'])
+def test_deal_handler(delivery, limeapp_with_events, worker, webhook,
+                      monkeypatch, results):
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.delivery', delivery)
+    hello_world.settings.load()
+
+    messages = WARMUP + ITERATIONS
+    for i in range(messages):
+        limeapp_with_events.publish(identifier='hello-world.deal.created',
+                                    message={'deal': {'id': i}})
+
+    # The time per message is how long the worker is held up by it. The
+    # throughput also counts waiting for async and batched deliveries to
+    # reach the webhook.
+    start = time.perf_counter()
+    summary = harness.measure(lambda i: worker.step(), ITERATIONS,
+                              warmup=WARMUP)
+    # Lingering batches are flushed, and async calls acked, by the steps of
+    # the worker, so it keeps stepping while the queue is idle
+    deadline = time.perf_counter() + 30
+    while not webhook.wait_for(messages, timeout=0.01):
+        assert time.perf_counter() < deadline
+        worker.step()
+    summary['seconds'] = time.perf_counter() - start
+    summary['per_second'] = messages / summary['seconds']
+    summary['requests'] = webhook.received
+
+    results['deal handler ({})'.format(delivery)] = summary
+
+
+@pytest.fixture(scope='module')
+def results():
+    """The results of all benchmarks, written to `RESULTS_PATH` when they
+    have been run
+    """
+    results = {}
+    yield results
+    harness.write_results(RESULTS_PATH, results)
+    for name, summary in sorted(results.items()):
+        print('\n{}: {:.1f}/s, p50 {:.2f} ms, p95 {:.2f} ms, '
+              'p99 {:.2f} ms, {} errors'.format(
+                  name, summary['per_second'], summary['p50_ms'],
+                  summary['p95_ms'], summary['p99_ms'], summary['errors']))
+
+
+@pytest.fixture
+def webhook(monkeypatch):
+    """A stub webhook on localhost that the event handler calls"""
+    with harness.StubWebhook() as webhook:
+        monkeypatch.setattr(
+            'lime_config.config.plugins.hello_world.events.call_api', True)
+        monkeypatch.setattr(
+            'lime_config.config.plugins.hello_world.events.api_url',
+            webhook.url)
+        hello_world.settings.load()
+        yield webhook
+        hello_world.webhooks.executor.get_executor().wait()
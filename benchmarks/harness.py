@@ -0,0 +1,190 @@
+"""Helpers for timing the plugin and keeping the results
+
+`measure` calls a function over and over and summarizes its latencies,
+`write_results` saves the summaries as JSON and `compare` tells how they
+differ from the results of an earlier run. `StubWebhook` is a local HTTP
+server for the event handler to call instead of a real webhook.
+"""
+import datetime
+import http.server
+import json
+import math
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(samples, p):
+    """Get the `p`th percentile of the sorted `samples`, by nearest rank"""
+    if not samples:
+        return None
+    rank = max(int(math.ceil(p / 100 * len(samples))), 1)
+    return samples[rank - 1]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Summarize `latencies` in seconds, of calls that took `elapsed`
+    seconds altogether, as a dict with latencies in milliseconds.
+    """
+    samples = sorted(latencies)
+    summary = {
+        'count': len(samples),
+        'errors': errors,
+        'seconds': elapsed,
+        'per_second': len(samples) / elapsed if elapsed else None,
+    }
+    for p in PERCENTILES:
+        value = percentile(samples, p)
+        summary['p{}_ms'.format(p)] = (None if value is None
+                                       else value * 1000)
+    return summary
+
+
+def measure(fn, iterations, warmup=10):
+    """Call `fn` `iterations` times, after `warmup` calls that aren't
+    timed, and summarize how long the calls took.
+
+    `fn` gets the number of the call. A call fails if it raises or returns
+    `False`.
+    """
+    for i in range(warmup):
+        fn(i)
+
+    latencies = []
+    errors = 0
+    start = time.perf_counter()
+    for i in range(warmup, warmup + iterations):
+        call_start = time.perf_counter()
+        try:
+            ok = fn(i) is not False
+        except Exception:
+            ok = False
+        latencies.append(time.perf_counter() - call_start)
+        errors += not ok
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def _revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, results):
+    """Write `results`, a dict of summaries keyed by benchmark, to the JSON
+    file at `path`, along with where and when they were measured.
+    """
+    document = {
+        'revision': _revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'time': datetime.datetime.utcnow().isoformat() + 'Z',
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+    return document
+
+
+def read_results(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def compare(baseline, results, threshold=0.1):
+    """Compare `results` to `baseline`, both dicts of summaries keyed by
+    benchmark.
+
+    Returns a list of (benchmark, key, before, after, change) for every
+    throughput or latency that got worse by more than `threshold`, e.g.
+    0.1 for 10%, and a list of report lines covering all of them.
+    """
+    regressions = []
+    lines = []
+    for name in sorted(results):
+        if name not in baseline:
+            lines.append('{}: new benchmark'.format(name))
+            continue
+        for key in ['per_second'] + ['p{}_ms'.format(p)
+                                     for p in PERCENTILES]:
+            before = baseline[name].get(key)
+            after = results[name].get(key)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            # Throughput is better when higher, latency when lower
+            worse = -change if key == 'per_second' else change
+            lines.append('{}: {} {:.2f} -> {:.2f} ({:+.1%})'.format(
+                name, key, before, after, change))
+            if worse > threshold:
+                regressions.append((name, key, before, after, change))
+    return regressions, lines
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.webhook._receive(body)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class StubWebhook:
+    """A webhook on localhost that accepts everything posted to it
+
+    Use it as a context manager. `url` is where it listens, `received`
+    the number of requests it has accepted and `events` the number of
+    events in them, counting every item of a posted JSON array.
+    """
+
+    def __init__(self):
+        self.received = 0
+        self.events = 0
+        self._lock = threading.Condition()
+        self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                       _Handler)
+        self._server.daemon_threads = True
+        self._server.webhook = self
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self._server.server_port)
+
+    def _receive(self, body):
+        try:
+            events = json.loads(body.decode('utf-8'))
+        except ValueError:
+            events = None
+        with self._lock:
+            self.received += 1
+            self.events += len(events) if isinstance(events, list) else 1
+            self._lock.notify_all()
+
+    def wait_for(self, events, timeout=30):
+        """Wait until `events` events have been received"""
+        with self._lock:
+            return self._lock.wait_for(lambda: self.events >= events,
+                                       timeout)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
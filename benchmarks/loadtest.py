@@ -0,0 +1,342 @@
+"""Sustained synthetic load on the deal endpoint
+
+`run` sends requests from `concurrency` threads, at most `rate` per second
+altogether, for `duration` seconds, and reports the throughput, latency
+percentiles, error rate and memory use of every `interval`. The requests
+are sent by a function that `in_process` or `remote` makes:
+
+* `in_process` creates synthetic companies and coworkers in an in-memory
+  database, like the tests do, and posts deals through the web client of
+  the tests, one client per thread. With `worker=True` the deal events go
+  through an event handler worker to a stub webhook as well.
+* `remote` posts deals to a running webserver, for companies and
+  coworkers that already exist in its database.
+
+Use it through `manage.py loadtest`.
+"""
+import collections
+import contextlib
+import itertools
+import json
+import random
+import resource
+import sys
+import threading
+import time
+from benchmarks import harness
+
+Interval = collections.namedtuple('Interval', [
+    'elapsed', 'requests', 'errors', 'per_second', 'p50_ms', 'p95_ms',
+    'p99_ms', 'memory_mb', 'events'])
+
+
+class Recorder:
+    """Collects the latencies of the requests of the current interval"""
+
+    def __init__(self):
+        self.errors = 0
+        self._latencies = []
+        self._errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            self._latencies.append(latency)
+            self._errors += not ok
+
+    def take(self):
+        """Get the latencies and errors recorded since the last call"""
+        with self._lock:
+            latencies, errors = self._latencies, self._errors
+            self._latencies, self._errors = [], 0
+        self.errors += errors
+        return latencies, errors
+
+
+def memory_mb():
+    """Get the resident memory of this process in MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 2 ** 20
+    except OSError:
+        # Not on Linux, so fall back to the peak, which is in bytes on
+        # macOS and in kB elsewhere.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** (20 if sys.platform == 'darwin' else 10)
+
+
+def run(make_send, concurrency=10, rate=0, duration=60, interval=5,
+        report=print, events=None):
+    """Send requests with `make_send` and report on every interval
+
+    `make_send` is called once per thread and returns a function that
+    sends request number `i` and returns whether it succeeded. A `rate` of
+    0 sends requests as fast as the threads manage. `report` is called with
+    an `Interval` for every `interval` seconds. `events`, if given, is a
+    function returning the number of events delivered so far.
+
+    Returns the list of intervals and a summary of the whole run.
+    """
+    recorder = Recorder()
+    counter = itertools.count()
+    stop = threading.Event()
+    start = time.perf_counter()
+    start_memory = memory_mb()
+    all_latencies = []
+
+    def send_requests():
+        send = make_send()
+        while not stop.is_set():
+            i = next(counter)
+            if rate:
+                # Every request has its own slot, so that a slow response
+                # doesn't make the threads fall behind for good.
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0 and stop.wait(delay):
+                    return
+            request_start = time.perf_counter()
+            try:
+                ok = send(i) is not False
+            except Exception:
+                ok = False
+            recorder.record(time.perf_counter() - request_start, ok)
+
+    threads = [threading.Thread(target=send_requests, daemon=True)
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    intervals = []
+    end = start + duration
+    window_start = start
+    try:
+        while window_start < end:
+            window_end = min(window_start + interval, end)
+            time.sleep(max(window_end - time.perf_counter(), 0))
+            latencies, errors = recorder.take()
+            all_latencies.extend(latencies)
+            intervals.append(Interval(
+                elapsed=window_end - start,
+                memory_mb=memory_mb(),
+                events=events() if events is not None else None,
+                **_percentiles(latencies, window_end - window_start,
+                               errors)))
+            report(intervals[-1])
+            window_start = window_end
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    # Count the requests that were still running when time was up
+    latencies, _ = recorder.take()
+    all_latencies.extend(latencies)
+    summary = harness.summarize(all_latencies,
+                                time.perf_counter() - start,
+                                recorder.errors)
+    summary['memory_mb'] = memory_mb()
+    summary['memory_growth_mb'] = summary['memory_mb'] - start_memory
+    if events is not None:
+        summary['events'] = events()
+    return intervals, summary
+
+
+def _percentiles(latencies, elapsed, errors):
+    summary = harness.summarize(latencies, elapsed, errors)
+    return {
+        'requests': summary['count'],
+        'errors': errors,
+        'per_second': summary['per_second'],
+        'p50_ms': summary['p50_ms'],
+        'p95_ms': summary['p95_ms'],
+        'p99_ms': summary['p99_ms'],
+    }
+
+
+def format_interval(interval):
+    line = ('{:7.1f}s {:6d} req {:8.1f}/s  p50 {} p95 {} p99 {}  '
+            '{:.1%} errors  {:.1f} MB'.format(
+                interval.elapsed, interval.requests, interval.per_second,
+                _ms(interval.p50_ms), _ms(interval.p95_ms),
+                _ms(interval.p99_ms),
+                interval.errors / interval.requests if interval.requests
+                else 0,
+                interval.memory_mb))
+    if interval.events is not None:
+        line += '  {} events delivered'.format(interval.events)
+    return line
+
+
+def _ms(value):
+    return '{:7.2f}ms'.format(value) if value is not None else '      -  '
+
+
+def deal(i, company_ids, coworker_ids, rand=random):
+    """Make the payload of synthetic deal number `i`"""
+    return {
+        'name': 'Load test deal {}'.format(i),
+        'company': rand.choice(company_ids),
+        'coworker': rand.choice(coworker_ids),
+        'value': rand.randrange(0, 1000000, 1000),
+        'probability': rand.choice([0.1, 0.25, 0.5, 0.75, 0.9]),
+    }
+
+
+def remote(url, company_ids, coworker_ids, headers=None, timeout=30):
+    """Make senders posting deals to the deal endpoint at `url`, e.g.
+    `http://localhost:5000/myapp/hello-world/deal/`
+    """
+    import requests
+
+    def make_send():
+        session = requests.Session()
+        session.headers.update(headers or {})
+
+        def send(i):
+            response = session.post(
+                url, json=deal(i, company_ids, coworker_ids),
+                timeout=timeout)
+            return response.ok
+
+        return send
+
+    return make_send
+
+
+@contextlib.contextmanager
+def in_process(companies=100, coworkers=10, worker=False):
+    """Set up an in-memory application with `companies` companies and
+    `coworkers` coworkers, and yield a function making senders posting
+    deals to it and a function returning the number of delivered events.
+
+    With `worker`, the deal events are consumed by an event handler worker
+    running in a thread, which calls a stub webhook on localhost.
+    """
+    import lime_config
+    import lime_test.app
+    import lime_test.core_db.dsl as dsl
+    import lime_test.db
+    import lime_test.web_app
+    import lime_type
+    import hello_world.settings
+    import pytest
+
+    monkeypatch = pytest.MonkeyPatch()
+    with contextlib.ExitStack() as stack:
+        stack.callback(monkeypatch.undo)
+        lime_config.load_config('loadtest', {})
+
+        def create_limetypes():
+            return lime_type.create_limetypes_from_dsl(dsl.dsl)
+
+        database = lime_test.db.create_database_with_limetypes(
+            monkeypatch, limetypes=create_limetypes(),
+            limename='myapp', sqlname='myapp')
+        app = lime_test.app.create_app(monkeypatch, database,
+                                       create_limetypes)
+        company_ids, coworker_ids = _populate(app, database, companies,
+                                              coworkers)
+
+        if worker:
+            webhook = stack.enter_context(harness.StubWebhook())
+            monkeypatch.setattr(
+                'lime_config.config.plugins.hello_world.events.call_api',
+                True)
+            monkeypatch.setattr(
+                'lime_config.config.plugins.hello_world.events.api_url',
+                webhook.url)
+            hello_world.settings.load()
+            stack.enter_context(_worker(app))
+
+            def delivered():
+                return webhook.events
+        else:
+            delivered = None
+
+        web_app = lime_test.web_app.create_web_app(database, monkeypatch)
+        lock = threading.Lock()
+
+        def make_send():
+            with lock:
+                client = lime_test.web_app.create_authenticated_web_client(
+                    web_app=web_app, app=app, username='loadtest',
+                    password='loadtest')
+
+            def send(i):
+                response = client.post(
+                    '/myapp/hello-world/deal/',
+                    data=json.dumps(deal(i, company_ids, coworker_ids)),
+                    headers={'Content-Type': 'application/json'})
+                return response.status_code < 400
+
+            return send
+
+        yield make_send, delivered
+
+
+def _populate(app, database, companies, coworkers):
+    import lime_test.db
+
+    user_ids = [
+        lime_test.db.create_and_add_user(
+            database=database,
+            fullname='Load Tester {}'.format(n),
+            username='loadtest' if n == 0 else 'loadtest{}'.format(n),
+            password='loadtest').id
+        for n in range(coworkers)]
+
+    uow = app.unit_of_work()
+    coworker_idxs = [
+        uow.add(app.limetypes.coworker(
+            firstname='Load', lastname='Tester {}'.format(n),
+            name='Load Tester {}'.format(n), username=user_id,
+            _from_row=True))
+        for n, user_id in enumerate(user_ids)]
+    company_idxs = [
+        uow.add(app.limetypes.company(name='Company {}'.format(n)))
+        for n in range(companies)]
+    res = uow.commit()
+
+    return ([res.get(idx).id for idx in company_idxs],
+            [res.get(idx).id for idx in coworker_idxs])
+
+
+@contextlib.contextmanager
+def _worker(app):
+    import kombu
+    import lime_config
+    import lime_event_handler.worker
+
+    # The memory transport keeps its queues per process, so the web client
+    # and the worker can use connections of their own.
+    exchange = kombu.Exchange('lime.{}'.format(app.identifier), type='topic')
+    producer = kombu.Producer(kombu.Connection('memory://'), exchange)
+    publish_lock = threading.Lock()
+
+    def publish(routing_key, body):
+        # Requests come in on many threads, but they share the producer
+        with publish_lock:
+            producer.publish(body, routing_key)
+
+    app._publisher = publish
+
+    worker = lime_event_handler.worker.Worker(
+        connection=kombu.Connection('memory://'),
+        applications=[app.identifier])
+    worker.load_plugins(config=lime_config.config)
+    # Declare the queues before any deals are created
+    worker.step()
+    stop = threading.Event()
+
+    def consume():
+        while not stop.is_set():
+            worker.step()
+
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    try:
+        yield worker
+    finally:
+        stop.set()
+        thread.join(timeout=10)
@@ -0,0 +1,205 @@
+"""Where the time and memory of the deal flows go
+
+`profile` runs a scenario under cProfile and then under tracemalloc, in
+separate passes so that tracing allocations doesn't skew the timings, and
+saves both profiles along with readable reports of the hotspots and the
+top allocations. `diff` compares two saved profiles per iteration.
+
+The scenarios are `deal`, creating deals through the deal endpoint of an
+in-memory application, and `handler`, calling the deal event handler with
+synchronous delivery to a stub webhook.
+
+Use it through `manage.py profile`.
+"""
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from benchmarks import harness
+from benchmarks import loadtest
+
+SCENARIOS = ('deal', 'handler')
+
+
+@contextlib.contextmanager
+def deal_flow():
+    """Yield a function creating deal number `i` through the deal endpoint"""
+    with loadtest.in_process() as (make_send, _):
+        yield make_send()
+
+
+class _Message:
+    """A deal event as the worker gets it from the broker, published as
+    JSON
+    """
+    delivery_info = {'exchange': 'lime.myapp'}
+    content_type = 'application/json'
+    headers = {}
+
+    def __init__(self, body):
+        self.body = json.dumps(body).encode('utf-8')
+
+    def ack(self):
+        pass
+
+    def requeue(self):
+        raise AssertionError('The stub webhook failed')
+
+
+@contextlib.contextmanager
+def handler_flow():
+    """Yield a function handling deal event number `i`"""
+    import hello_world.settings
+    from hello_world.event_handlers import deal
+
+    with harness.StubWebhook() as webhook:
+        hello_world.settings.load({'events': {'call_api': True,
+                                              'api_url': webhook.url}})
+
+        def handle(i):
+            body = {'deal': {'id': i}}
+            deal.deal(None, body, _Message(body))
+
+        yield handle
+
+
+FLOWS = {
+    'deal': deal_flow,
+    'handler': handler_flow,
+}
+
+
+def profile(scenario, iterations, directory, warmup=10, top=30,
+            frames=1):
+    """Profile `iterations` runs of `scenario` and save the results in
+    `directory`:
+
+    * `<scenario>.prof`, the cProfile statistics, for `pstats` or
+      snakeviz
+    * `<scenario>.heap`, the tracemalloc snapshot
+    * `<scenario>.json`, the number of iterations and the time they took
+    * `<scenario>-hotspots.txt` and `<scenario>-allocations.txt`, the `top`
+      functions by cumulative time and the `top` lines by allocated memory
+
+    Returns the paths of the reports.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, scenario)
+
+    with FLOWS[scenario]() as run_once:
+        for i in range(warmup):
+            run_once(i)
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+        for i in range(warmup, warmup + iterations):
+            run_once(i)
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start(frames)
+        try:
+            baseline = tracemalloc.take_snapshot()
+            for i in range(warmup + iterations,
+                           warmup + 2 * iterations):
+                run_once(i)
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    profiler.dump_stats(path + '.prof')
+    snapshot = _own(snapshot)
+    snapshot.dump(path + '.heap')
+    with open(path + '.json', 'w') as f:
+        json.dump({'scenario': scenario, 'iterations': iterations,
+                   'seconds': elapsed, 'traced_peak_bytes': peak},
+                  f, indent=2)
+
+    hotspots = path + '-hotspots.txt'
+    with open(hotspots, 'w') as f:
+        stats = pstats.Stats(path + '.prof', stream=f)
+        f.write('{} iterations of {} in {:.3f}s, {:.3f} ms each\n\n'.format(
+            iterations, scenario, elapsed, elapsed / iterations * 1000))
+        stats.sort_stats('cumulative').print_stats(top)
+        stats.sort_stats('tottime').print_stats(top)
+
+    allocations = path + '-allocations.txt'
+    with open(allocations, 'w') as f:
+        f.write('Memory allocated by {} iterations of {} and still held '
+                'at the end, peak {:.1f} KiB\n\n'.format(
+                    iterations, scenario, peak / 1024))
+        for stat in snapshot.compare_to(_own(baseline), 'lineno')[:top]:
+            f.write('{}\n'.format(stat))
+
+    return hotspots, allocations
+
+
+def _own(snapshot):
+    # Leave out the memory used by tracemalloc and the profiler themselves
+    return snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<unknown>'),
+    ])
+
+
+def _function_times(path, iterations):
+    stats = pstats.Stats(path)
+    return {pstats.func_std_string(func): (tt / iterations, ct / iterations,
+                                           nc / iterations)
+            for func, (cc, nc, tt, ct, callers) in stats.stats.items()}
+
+
+def diff(before, after, scenario, top=30):
+    """Compare the profiles of `scenario` saved in the directories `before`
+    and `after`, per iteration.
+
+    Returns the report as a string: the time per iteration, the functions
+    whose own time changed the most, and the lines whose allocations
+    changed the most.
+    """
+    meta = {}
+    for name, directory in (('before', before), ('after', after)):
+        with open(os.path.join(directory, scenario + '.json')) as f:
+            meta[name] = json.load(f)
+
+    out = io.StringIO()
+    ms = {name: m['seconds'] / m['iterations'] * 1000
+          for name, m in meta.items()}
+    out.write('{}: {:.3f} ms -> {:.3f} ms per iteration ({:+.1%})\n\n'.format(
+        scenario, ms['before'], ms['after'],
+        (ms['after'] - ms['before']) / ms['before']))
+
+    old = _function_times(os.path.join(before, scenario + '.prof'),
+                          meta['before']['iterations'])
+    new = _function_times(os.path.join(after, scenario + '.prof'),
+                          meta['after']['iterations'])
+    changes = []
+    for func in set(old) | set(new):
+        tt_old, ct_old, nc_old = old.get(func, (0, 0, 0))
+        tt_new, ct_new, nc_new = new.get(func, (0, 0, 0))
+        changes.append((tt_new - tt_old, ct_new - ct_old, nc_new - nc_old,
+                        func))
+    changes.sort(key=lambda change: abs(change[0]), reverse=True)
+
+    out.write('{:>12} {:>12} {:>10}  function\n'.format(
+        'own ms', 'cumul. ms', 'calls'))
+    for tt, ct, nc, func in changes[:top]:
+        out.write('{:>+12.4f} {:>+12.4f} {:>+10.2f}  {}\n'.format(
+            tt * 1000, ct * 1000, nc, func))
+
+    old_heap = tracemalloc.Snapshot.load(
+        os.path.join(before, scenario + '.heap'))
+    new_heap = tracemalloc.Snapshot.load(
+        os.path.join(after, scenario + '.heap'))
+    out.write('\nAllocations held at the end, after vs before\n')
+    for stat in new_heap.compare_to(old_heap, 'lineno')[:top]:
+        out.write('{}\n'.format(stat))
+
+    return out.getvalue()
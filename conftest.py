@@ -0,0 +1,167 @@
+"""Fixtures shared by the tests and the benchmarks
+
+Every test starts with the settings of the current configuration, and
+without any cached objects, messages waiting to be settled or pending
+batches left by other tests.
+
+Test modules that need something else, like the event handler tests, which
+pass the limetypes to the application as they are, override these with
+fixtures of their own.
+"""
+import hello_world.cache
+import hello_world.settings
+import hello_world.webhooks.batching
+import hello_world.webhooks.settling
+import kombu
+import lime_config
+import lime_event_handler.worker
+import lime_test.app
+import lime_test.core_db.dsl as dsl
+import lime_test.db
+import lime_test.web_app
+import lime_type
+import pytest
+
+
+class FakeClock:
+    """A clock for code that takes a `clock`, which only moves when told to,
+    with `sleep` or by setting `now`
+    """
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    """A `FakeClock` starting at 0"""
+    return FakeClock()
+
+
+@pytest.fixture(autouse=True)
+def settings():
+    """Start every test with settings from the current configuration"""
+    hello_world.settings.load()
+
+
+@pytest.fixture(autouse=True)
+def caches(monkeypatch):
+    """Start every test with empty caches"""
+    monkeypatch.setattr(hello_world.cache, '_caches', {})
+
+
+@pytest.fixture(autouse=True)
+def settler(monkeypatch):
+    """Start every test without messages waiting to be settled or batched"""
+    monkeypatch.setattr(hello_world.webhooks.settling, '_settlers', {})
+    monkeypatch.setattr(hello_world.webhooks.batching, '_batchers', {})
+
+
+@pytest.fixture
+def limetypes():
+    """The limetypes of the core database
+    You can change these, or create your own by twiddling with the YAML based
+    DSL format for limetypes.
+    """
+    def create_limetypes():
+        return lime_type.create_limetypes_from_dsl(dsl.dsl)
+
+    return create_limetypes
+
+
+@pytest.fixture
+def database(limetypes, monkeypatch):
+    """An in-memory empty Lime database with the core database limetypes"""
+    database = lime_test.db.create_database_with_limetypes(
+        monkeypatch,
+        limetypes=limetypes(),
+        limename='myapp',
+        sqlname='myapp')
+    return database
+
+
+@pytest.fixture
+def limeapp(database, limetypes, monkeypatch):
+    """A Lime application with a user/coworker defined"""
+    app = lime_test.app.create_app(monkeypatch, database, limetypes)
+    user = lime_test.db.create_and_add_user(database=database,
+                                            fullname='Kenny Starfighter',
+                                            username='kenny',
+                                            password='kenny')
+    app.unit_of_work()
+
+    # TODO: Make it possible to create a coworker with this hack
+    coworker = app.limetypes.coworker(
+        firstname='Kenny',
+        lastname='Starfighter',
+        name='Kenny Starfighter',
+        username=user.id,
+        _from_row=True
+    )
+
+    uow = app.unit_of_work()
+    idx = uow.add(coworker)
+    res = uow.commit()
+
+    app._coworker = res.get(idx)
+
+    return app
+
+
+@pytest.fixture
+def webapp(limeapp, database, monkeypatch):
+    """An in-memory web application where you're authenticated as a user"""
+    web_app = lime_test.web_app.create_web_app(database, monkeypatch)
+
+    return lime_test.web_app.create_authenticated_web_client(web_app=web_app,
+                                                             app=limeapp,
+                                                             username='kenny',
+                                                             password='kenny')
+
+
+@pytest.fixture
+def acme_company(limeapp):
+    """A company that gets added to `limeapp`"""
+    uow = limeapp.unit_of_work()
+    acme = limeapp.limetypes.company(name='Acme Inc.')
+    acme_idx = uow.add(acme)
+    res = uow.commit()
+    return res.get(acme_idx)
+
+
+@pytest.fixture
+def message_queue_connection():
+    """A connection to an in-memory message queue"""
+    return kombu.Connection('memory://')
+
+
+@pytest.fixture
+def limeapp_with_events(limeapp, message_queue_connection):
+    """A Lime application that will post events to the in-memory queue"""
+    exchange = kombu.Exchange(
+        'lime.{}'.format(limeapp.identifier), type='topic')
+    producer = kombu.Producer(message_queue_connection, exchange)
+
+    def publish(routing_key, body):
+        producer.publish(body, routing_key)
+
+    limeapp._publisher = publish
+    return limeapp
+
+
+@pytest.fixture
+def worker(limeapp, message_queue_connection):
+    """A event-handler-worker with plugins loaded, connected to the
+    in-memory queue"""
+    worker = lime_event_handler.worker.Worker(
+        connection=message_queue_connection,
+        applications=[limeapp.identifier])
+    worker.load_plugins(config=lime_config.config)
+    worker.step()
+    return worker
@@ -7,19 +7,85 @@ def default_config():
     return {
         'todo_note_text': ('Follow up {deal.properties.name.value} with '
                            '{company.properties.name.value}'),
+        'bulk': {
+            'batch_size': 100
+        },
+        'todos': {
+            'mode': 'inline',
+            'batch_size': 100,
+            'batch_linger_ms': 200,
+            'max_attempts': 5
+        },
+        'cache': {
+            'maxsize': 1024,
+            'ttl': 300
+        },
+        'metrics': {
+            'enabled': True
+        },
+        'publish': {
+            'mode': 'direct',
+            'encoding': 'json',
+            'outbox_path': 'hello-world-publish-outbox.sqlite3',
+            'batch_size': 100,
+            'interval_ms': 50
+        },
+        'idempotency': {
+            'maxsize': 10000,
+            'ttl': 86400,
+            'wait_timeout': 10,
+            'path': ''
+        },
         'events': {
             'call_api': False,
-            'api_url': 'https://example.com/foo'
+            'api_url': 'https://example.com/foo',
+            'targets': [],
+            'fan_out_workers': 10,
+            'rules': [],
+            'pool_size': 10,
+            'connect_timeout': 3.05,
+            'read_timeout': 10,
+            'compress': False,
+            'format': 'json',
+            'delivery': 'sync',
+            'max_workers': 10,
+            'max_in_flight': 100,
+            'prefetch_count': 0,
+            'batch_size': 100,
+            'batch_linger_ms': 200,
+            'outbox_path': 'hello-world-outbox.sqlite3',
+            'outbox_backoff_base': 1,
+            'outbox_backoff_max': 300,
+            'outbox_max_attempts': 10,
+            'circuit_failure_threshold': 5,
+            'circuit_reset_timeout': 30,
+            'circuit_defer_max': 1,
+            'rate_limit': 0,
+            'rate_burst': 10,
+            'dedup_window': 3600,
+            'dedup_capacity': 100000,
+            'dedup_error_rate': 0.000001,
+            'dedup_path': ''
         }
     }
 
 
-try:
-    from .endpoints import register_blueprint  # noqa
-except ImportError:
-    logger.info('hello_world doesn\'t implement any custom endpoints')
+def register_blueprint(app, config=None):
+    """Register the endpoints of the plugin with the webserver
 
-try:
-    from .event_handlers import register_event_handlers  # noqa
-except ImportError:
-    logger.info('hello_world doesn\'t implement any event handlers')
+    The endpoints are only imported here, so that processes that don't
+    serve them, like the event handler worker, never pay for importing
+    them.
+    """
+    from .endpoints import register_blueprint
+    return register_blueprint(app, config)
+
+
+def register_event_handlers(worker, config):
+    """Register the event handlers of the plugin with the worker
+
+    The event handlers are only imported here, so that processes that
+    don't run them, like the webserver, never pay for importing them.
+    """
+    from .event_handlers import register_event_handlers
+    return register_event_handlers(worker, config)
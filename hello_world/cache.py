@@ -0,0 +1,95 @@
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class LruCache:
+    """A thread safe cache holding at most `maxsize` entries, each of them
+    expiring `ttl` seconds after it was put in the cache.
+
+    When the cache is full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_cache(application, name, maxsize=1024, ttl=300):
+    """Get the cache called `name` for the application with identifier
+    `application`, creating it with `maxsize` and `ttl` if it doesn't exist.
+    """
+    key = (application, name)
+    try:
+        return _caches[key]
+    except KeyError:
+        with _caches_lock:
+            if key not in _caches:
+                logger.info('Creating cache {} for {}'.format(
+                    name, application))
+                _caches[key] = LruCache(maxsize=maxsize, ttl=ttl)
+            return _caches[key]
+
+
+def caches(name=None, application=None):
+    """Get all caches called `name` for `application`, as a dict keyed by
+    (application, name). Leave out `name` or `application` to match all.
+    """
+    return {key: cache for key, cache in list(_caches.items())
+            if name in (None, key[1]) and application in (None, key[0])}
+
+
+def stats():
+    """Get the statistics of all caches, keyed by 'application.name'"""
+    return {'{}.{}'.format(*key): cache.stats()
+            for key, cache in caches().items()}
@@ -0,0 +1,63 @@
+import hello_world.cache
+import pytest
+
+
+@pytest.fixture
+def cache(clock):
+    return hello_world.cache.LruCache(maxsize=2, ttl=10, clock=clock)
+
+
+def test_get_returns_value_put_in_cache(cache):
+    cache.put(1, 'Acme Inc.')
+
+    assert cache.get(1) == 'Acme Inc.'
+
+
+def test_get_returns_default_for_missing_key(cache):
+    assert cache.get(1, 'default') == 'default'
+
+
+def test_entries_expire_after_ttl(cache, clock):
+    cache.put(1, 'Acme Inc.')
+    clock.now = 10
+
+    assert cache.get(1) is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    cache.put(1, 'Acme Inc.')
+    cache.put(2, 'Lime Technologies')
+    cache.get(1)
+    cache.put(3, 'Globex')
+
+    assert cache.get(1) == 'Acme Inc.'
+    assert cache.get(2) is None
+    assert cache.get(3) == 'Globex'
+
+
+def test_invalidate_removes_entry(cache):
+    cache.put(1, 'Acme Inc.')
+    cache.invalidate(1)
+
+    assert cache.get(1) is None
+
+
+def test_counts_hits_and_misses(cache):
+    cache.put(1, 'Acme Inc.')
+    cache.get(1)
+    cache.get(1)
+    cache.get(2)
+
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'size': 1, 'maxsize': 2}
+
+
+def test_get_cache_returns_same_cache_per_application(monkeypatch):
+    monkeypatch.setattr(hello_world.cache, '_caches', {})
+
+    cache = hello_world.cache.get_cache('myapp', 'company')
+
+    assert hello_world.cache.get_cache('myapp', 'company') is cache
+    assert hello_world.cache.get_cache('otherapp', 'company') is not cache
+    assert hello_world.cache.caches(application='myapp') == {
+        ('myapp', 'company'): cache}
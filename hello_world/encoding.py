@@ -0,0 +1,105 @@
+"""Encoding of event payloads as JSON or msgpack
+
+msgpack is optional. Configuring it without the `msgpack` package installed
+is a configuration error.
+"""
+import json
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+FORMATS = ('json', 'msgpack')
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'msgpack': 'application/x-msgpack',
+}
+
+_FORMATS_BY_CONTENT_TYPE = {
+    'application/json': 'json',
+    'application/x-msgpack': 'msgpack',
+    'application/msgpack': 'msgpack',
+}
+
+
+class Encoded:
+    """A payload as it was received, `data` encoded in `format`, along with
+    its decoded `value`, so that it can be passed on without encoding it
+    again
+    """
+
+    __slots__ = ('data', 'format', 'value')
+
+    def __init__(self, data, format, value):
+        self.data = data
+        self.format = format
+        self.value = value
+
+
+def check(format, name):
+    """Raise `ValueError` if the setting `name` isn't a usable format"""
+    if format not in FORMATS:
+        raise ValueError('{} must be one of {}, not {!r}'.format(
+            name, ', '.join(FORMATS), format))
+    if format == 'msgpack' and msgpack is None:
+        raise ValueError('{} is msgpack, but msgpack is not '
+                         'installed'.format(name))
+
+
+def format_of(content_type):
+    """Get the format of `content_type`, or `None` if it's neither JSON nor
+    msgpack
+    """
+    if not content_type:
+        return None
+    return _FORMATS_BY_CONTENT_TYPE.get(
+        content_type.split(';')[0].strip().lower())
+
+
+def encode(value, format):
+    """Encode `value` as bytes in `format`
+
+    `value` may be `Encoded`, in which case its data is used as it is if it
+    already has the right format.
+    """
+    if isinstance(value, Encoded):
+        if value.format == format:
+            return value.data
+        value = value.value
+    if format == 'msgpack':
+        return msgpack.packb(value, use_bin_type=True)
+    return json.dumps(value).encode('utf-8')
+
+
+def decode(data, format):
+    if format == 'msgpack':
+        return msgpack.unpackb(data, raw=False)
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def decode_message(body, message, default):
+    """Get the event of `message` as a value, along with the payload to pass
+    on
+
+    `body` is the body as the broker decoded it. Bodies it didn't decode,
+    such as msgpack published as raw bytes, are decoded in the format of the
+    content type of `message`, or in `default` if it has none. The payload
+    is `Encoded`, keeping the body as it was published so that it can be
+    posted as it is to webhooks expecting the same format, unless the
+    format isn't known or the body was compressed.
+    """
+    format = format_of(message.content_type)
+    if isinstance(body, bytes):
+        format = format or default
+        body = decode(body, format)
+
+    data = message.body
+    if format is None or (message.headers or {}).get('compression'):
+        return body, body
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return body, Encoded(data, format, body)
@@ -0,0 +1,78 @@
+import hello_world.encoding as encoding
+import pytest
+import types
+
+
+def make_message(body, content_type, headers=None):
+    return types.SimpleNamespace(body=body, content_type=content_type,
+                                 headers=headers)
+
+
+def test_format_of_content_types():
+    assert encoding.format_of('application/json; charset=utf-8') == 'json'
+    assert encoding.format_of('application/x-msgpack') == 'msgpack'
+    assert encoding.format_of('application/data') is None
+    assert encoding.format_of(None) is None
+
+
+def test_check_rejects_unknown_formats():
+    with pytest.raises(ValueError):
+        encoding.check('xml', 'events.format')
+
+
+def test_encode_passes_encoded_data_through_in_same_format():
+    body = encoding.Encoded(b'{"a":1}', 'json', {'a': 1})
+
+    assert encoding.encode(body, 'json') == b'{"a":1}'
+
+
+def test_encode_json_round_trip():
+    data = encoding.encode({'deal': {'id': 1}}, 'json')
+
+    assert encoding.decode(data, 'json') == {'deal': {'id': 1}}
+
+
+def test_msgpack_round_trip_is_smaller_than_json():
+    pytest.importorskip('msgpack')
+    value = {'deal': {'id': 1, 'name': 'Big deal', 'value': 100}}
+
+    data = encoding.encode(value, 'msgpack')
+
+    assert encoding.decode(data, 'msgpack') == value
+    assert len(data) < len(encoding.encode(value, 'json'))
+
+
+def test_encode_reencodes_in_other_format():
+    pytest.importorskip('msgpack')
+    body = encoding.Encoded(b'{"a": 1}', 'json', {'a': 1})
+
+    assert encoding.decode(encoding.encode(body, 'msgpack'),
+                           'msgpack') == {'a': 1}
+
+
+def test_decode_message_keeps_json_body_as_published():
+    message = make_message(b'{"a": 1}', 'application/json')
+
+    body, payload = encoding.decode_message({'a': 1}, message, 'msgpack')
+
+    assert body == {'a': 1}
+    assert (payload.data, payload.format) == (b'{"a": 1}', 'json')
+
+
+def test_decode_message_decodes_raw_bytes_in_default_format():
+    pytest.importorskip('msgpack')
+    data = encoding.encode({'a': 1}, 'msgpack')
+    message = make_message(data, 'application/data')
+
+    body, payload = encoding.decode_message(data, message, 'msgpack')
+
+    assert body == {'a': 1}
+    assert (payload.data, payload.format) == (data, 'msgpack')
+
+
+def test_decode_message_passes_on_compressed_body_decoded():
+    message = make_message(b'compressed', 'application/json',
+                           {'compression': 'application/x-gzip'})
+
+    assert encoding.decode_message({'a': 1}, message, 'json') == \
+        ({'a': 1}, {'a': 1})
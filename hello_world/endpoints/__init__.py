@@ -1,10 +1,15 @@
 import flask_marshmallow
 import flask_restful
+import functools
 import importlib
 import lime_endpoints
 import lime_endpoints.endpoints
 import logging
-import pkgutil
+from webargs.flaskparser import parser
+from .. import manifest
+from .. import metrics
+from .. import publisher
+from .. import settings
 
 URL_PREFIX = '/hello-world'
 
@@ -18,13 +23,36 @@ api = flask_restful.Api(bp)
 ma = flask_marshmallow.Marshmallow(bp)
 
 
+def use_timed_args(argmap, metric):
+    """Like webargs' `use_args`, but also time the parsing of the arguments
+    as the stage 'validation' and the whole call as the stage 'total' of the
+    histogram `metric`.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with metrics.timer(metric, stage='total'):
+                with metrics.timer(metric, stage='validation'):
+                    parsed_args = parser.parse(argmap)
+                return func(self, parsed_args, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
 def register_blueprint(app, config=None):
-    for loader, module_name, is_pkg in pkgutil.walk_packages(__path__):
-        if module_name.endswith('_test'):
-            continue
+    # Resolve the configuration, compiling the todo note template, up
+    # front, so that a broken configuration stops the webserver from
+    # starting instead of failing every request.
+    settings.load()
+
+    for module_name in manifest.ENDPOINTS:
         module_fullname = '{}.{}'.format(__name__, module_name)
         logger.info('Loading {}'.format(module_fullname))
         importlib.import_module(module_fullname)
 
+    # Publish what's left in the outbox, e.g. from before a restart, right
+    # away rather than when the next deal is created
+    publisher.start()
+
     app.register_blueprint(bp)
     return bp
@@ -1,94 +1,397 @@
 import http.client
-import lime_config
+import types
+import uuid
+import flask
+import lime_errors
+import lime_query
 import lime_webserver.webserver as webserver
 import logging
 import webargs.fields as fields
-from webargs.flaskparser import use_args
 from ..endpoints import api
+from ..endpoints import ma
+from ..endpoints import use_timed_args
+from .. import cache
+from .. import idempotency
+from .. import metrics
+from .. import publisher
+from .. import settings
 
 
 logger = logging.getLogger(__name__)
 
+DEAL_POST = 'hello_world_deal_post_seconds'
+DEALS_POST = 'hello_world_deals_post_seconds'
+metrics.describe(DEAL_POST, 'Time spent in each stage of POST /deal/')
+metrics.describe(DEALS_POST, 'Time spent in each stage of POST /deals/')
+metrics.describe('hello_world_deals_created_total', 'Created deals')
+
+IDEMPOTENCY_KEY = 'Idempotency-Key'
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+
 # This describes the schema for the payload when posting a new deal
 # See https://webargs.readthedocs.io/en/latest/ for more info.
-args = {
-    "name": fields.String(required=True),
-    "company": fields.Integer(required=True),
-    "coworker": fields.Integer(required=True),
-    "value": fields.Integer(missing=0),
-    "probability": fields.Decimal(missing=0.0),
-}
+class DealSchema(ma.Schema):
+    name = fields.String(required=True)
+    company = fields.Integer(required=True)
+    coworker = fields.Integer(required=True)
+    value = fields.Integer(missing=0)
+    probability = fields.Decimal(missing=0.0)
+
+
+# The payload when posting many deals at once is simply a list of the
+# payloads above. All of them are validated before anything is created.
+class BulkDealSchema(ma.Schema):
+    deals = fields.List(fields.Nested(DealSchema), required=True)
+
+
+# Given a dict, webargs builds a new schema class from it on every request,
+# so the schemas are built once, when the endpoints are imported.
+args = DealSchema()
+bulk_args = BulkDealSchema()
 
 
 class Deal(webserver.LimeResource):
     """Resource for creating deals together with todos"""
 
-    @use_args(args)
+    @use_timed_args(args, DEAL_POST)
     def post(self, args):
         """Create a new deal, connect it to a company and a coworker
         and create a todo to follow up
+
+        Clients that retry can send an `Idempotency-Key` header. Retries
+        with the same key get the response of the first request, and only
+        one deal is created.
         """
+        key = flask.request.headers.get(IDEMPOTENCY_KEY)
+        if key is None:
+            return self._create(args)
+
+        if len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return {'error': '{} is longer than {} characters'.format(
+                IDEMPOTENCY_KEY, MAX_IDEMPOTENCY_KEY_LENGTH)
+            }, http.client.BAD_REQUEST
+
+        try:
+            (body, status), replayed = idempotency.get_idempotency().execute(
+                (self.application.identifier, key),
+                idempotency.fingerprint(args),
+                lambda: self._create(args))
+        except idempotency.KeyReusedError as e:
+            return {'error': str(e)}, http.client.UNPROCESSABLE_ENTITY
+        except idempotency.InProgressError as e:
+            return {'error': str(e)}, http.client.CONFLICT
 
+        return body, status, {'Idempotent-Replayed': str(replayed).lower()}
+
+    def _create(self, args):
         # Create a unit of work that will handle creating, updating, and
         # connecting objects within a database transaction.
         uow = self.application.unit_of_work()
 
-        # Create a new limeobject of type 'deal' and give it the name
-        # passed in the request.
-        deal = self.application.limetypes.deal(name=args.get('name'))
+        # Get the company from the id supplied in the request. We need its
+        # name for the todo and the event. The coworker is only needed for
+        # the relation, so we only make sure that it exists.
+        with metrics.timer(DEAL_POST, stage='lookup'):
+            company = lookup_company(self.application, args.get('company'))
+            lookup_coworker(self.application, args.get('coworker'))
 
-        # Add the deal object to our unit of work so that it will be part
-        # of the transaction later on.
+        # Add the deal, its relations and its todo to our unit of work.
         # We save the index the deal gets within the unit of work so that we
         # can retrieve the updated object later on.
-        deal_idx = uow.add(deal)
-
-        # Get the company from the id supplied in the request
-        company = self.application.limetypes.company.get(args.get('company'))
-
-        # Attach the company to the deal
-        deal.properties.company.attach(company)
-
-        # Add the company to our unit of work so that the relation between
-        # our new deal and that company can be saved in the transaction later.
-        uow.add(company)
-
-        # I think you get it by now...
-        coworker = self.application.limetypes.coworker.get(
-            args.get('coworker'))
-        deal.properties.coworker.attach(coworker)
-        uow.add(coworker)
-
-        todo = self.application.limetypes.todo()
-        note = lime_config.config['plugins']['hello_world']['todo_note_text']
-        todo.properties.note.value = note.format(deal=deal, company=company)
-        todo.properties.deal.attach(deal)
-        uow.add(todo)
+        with metrics.timer(DEAL_POST, stage='build'):
+            deal_idx = add_deal(self.application, uow, args, company)
 
         # Commit all the changes we've added to our unit of work
-        res = uow.commit()
+        with metrics.timer(DEAL_POST, stage='commit'):
+            res = uow.commit()
 
         # Retrieve the updated deal so we can get its ID.
         deal = res.get(deal_idx)
 
         # Send a custom event, notifying the world about this deal
-        self.application.publish(identifier='hello-world.deal.created',
-                                 message={
-                                     'deal': {
-                                         'id': deal.id,
-                                         'name': deal.properties.name.value,
-                                         'value': deal.properties.value.value
-                                     },
-                                     'company': {
-                                         'id': company.id,
-                                         'name': company.properties.name.value
-                                     }
-                                 })
+        with metrics.timer(DEAL_POST, stage='publish'):
+            publish_deal_created(self.application, deal, company)
+        metrics.count('hello_world_deals_created_total')
 
         # Return a json response with the id of our new deal and a HTTP code
         # indicating that the objects were created successfully.
         return {'id': deal.id}, http.client.CREATED
 
 
+class Deals(webserver.LimeResource):
+    """Resource for creating many deals, with todos, in batches"""
+
+    @use_timed_args(bulk_args, DEALS_POST)
+    def post(self, args):
+        """Create a list of deals, each one connected to a company and a
+        coworker and with a todo to follow up.
+
+        The deals are committed in units of work of `bulk.batch_size` deals
+        each. The response holds one result per posted deal, in the same
+        order, with either the id of the new deal or an error.
+        """
+        items = args['deals']
+        batch_size = settings.current.bulk.batch_size
+
+        # Every distinct company and coworker is only looked up once for
+        # the whole request, no matter how many deals refer to it.
+        with metrics.timer(DEALS_POST, stage='lookup'):
+            companies = resolve_companies(
+                self.application, [item['company'] for item in items])
+            coworkers = resolve_coworkers(
+                self.application, [item['coworker'] for item in items])
+
+        results = [None] * len(items)
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            create_batch(self.application, list(enumerate(batch, start)),
+                         companies, coworkers, results)
+
+        status = (http.client.CREATED
+                  if all('id' in result for result in results)
+                  else http.client.MULTI_STATUS)
+        return {'results': results}, status
+
+
+def create_batch(application, items, companies, coworkers, results,
+                 metric=DEALS_POST):
+    """Create the deals in `items`, a list of (position, args) pairs, in one
+    unit of work.
+
+    `companies` maps company ids to snapshots, as returned by
+    `resolve_companies`, and `coworkers` is the set of coworker ids that
+    exist, as returned by `resolve_coworkers`. Deals referring to other
+    companies or coworkers aren't created. The result of each deal, either
+    its id or an error, is put at its position in `results`. The stages are
+    timed into the histogram `metric`.
+    """
+    uow = application.unit_of_work()
+    pending = []
+
+    with metrics.timer(metric, stage='build'):
+        for pos, item in items:
+            company = companies.get(item['company'])
+            if company is None:
+                results[pos] = {'error': 'Company {} not found'.format(
+                    item['company'])}
+                continue
+            if item['coworker'] not in coworkers:
+                results[pos] = {'error': 'Coworker {} not found'.format(
+                    item['coworker'])}
+                continue
+
+            deal_idx = add_deal(application, uow, item, company)
+            pending.append((pos, deal_idx, company))
+
+    if not pending:
+        return
+
+    try:
+        with metrics.timer(metric, stage='commit'):
+            res = uow.commit()
+    except Exception as e:
+        logger.exception('Failed to commit a batch of {} deals'.format(
+            len(pending)))
+        for pos, _, _ in pending:
+            results[pos] = {'error': str(e)}
+        return
+
+    with metrics.timer(metric, stage='publish'):
+        for pos, deal_idx, company in pending:
+            deal = res.get(deal_idx)
+            publish_deal_created(application, deal, company)
+            results[pos] = {'id': deal.id}
+    metrics.count('hello_world_deals_created_total', len(pending))
+
+
+def lookup_company(application, id_):
+    """Get a snapshot of the company with id `id_`
+
+    Snapshots are kept in a per-application cache, configured by `cache`,
+    so that popular companies aren't fetched from the database for every
+    deal. Nothing invalidates the cache, so a renamed company keeps its old
+    name in new todos and events for at most `cache.ttl` seconds.
+    """
+    config = settings.current
+    companies = cache.get_cache(application.identifier, 'company',
+                                maxsize=config.cache.maxsize,
+                                ttl=config.cache.ttl)
+
+    # The snapshot holds the properties the todo note needs, so snapshots
+    # made for an older template may lack some of them.
+    fields = config.todo_template.fields['company'] | {'name'}
+    cached = companies.get(id_)
+    if cached is not None and fields <= cached[0]:
+        return cached[1]
+
+    company = _snapshot(application.limetypes.company.get(id_), fields)
+    companies.put(id_, (fields, company))
+    return company
+
+
+def resolve_companies(application, ids):
+    """Look up each distinct company in `ids` once
+
+    Returns a dict mapping ids to company snapshots. Ids that don't exist
+    are left out.
+    """
+    companies = {}
+    for id_ in set(ids):
+        try:
+            companies[id_] = lookup_company(application, id_)
+        except lime_errors.NotFoundError:
+            logger.info('Company {} not found'.format(id_))
+    return companies
+
+
+def lookup_coworker(application, id_):
+    """Make sure that the coworker with id `id_` exists
+
+    Raises `lime_errors.NotFoundError` if there's no such coworker.
+    """
+    if id_ not in resolve_coworkers(application, [id_]):
+        raise lime_errors.NotFoundError(
+            'Coworker {} not found'.format(id_))
+
+
+def resolve_coworkers(application, ids):
+    """Check which of the coworkers in `ids` exist
+
+    Coworkers are attached to deals by id, so they're never loaded, but an
+    unknown id would only fail the commit. The ids that aren't in the
+    per-application cache, configured by `cache`, are checked with a single
+    query that only reads ids.
+
+    Returns the set of ids that exist.
+    """
+    config = settings.current
+    known = cache.get_cache(application.identifier, 'coworker',
+                            maxsize=config.cache.maxsize,
+                            ttl=config.cache.ttl)
+    ids = set(ids)
+    coworkers = {id_ for id_ in ids if known.get(id_) is not None}
+    unknown = ids - coworkers
+    if unknown:
+        for id_ in existing_ids(application, 'coworker', unknown):
+            known.put(id_, True)
+            coworkers.add(id_)
+        for id_ in unknown - coworkers:
+            logger.info('Coworker {} not found'.format(id_))
+    return coworkers
+
+
+def existing_ids(application, limetype_name, ids):
+    """Get the ids among `ids` of the objects of type `limetype_name` that
+    exist, reading nothing but their ids
+    """
+    response = lime_query.execute_query(
+        objecttype=limetype_name,
+        responseFormat={'object': {'_id': None}},
+        filter={'key': '_id', 'op': 'IN', 'exp': sorted(ids)},
+        limit=len(ids),
+        offset=0,
+        orderBy=[],
+        database=application.database,
+        acl=application.acl,
+        user=application.user)
+    return {obj['_id'] for obj in response['objects']}
+
+
+def _snapshot(company, fields):
+    # Keep the shape of a lime object, so that the snapshot can be used
+    # just like the company itself in todo notes and events, but don't
+    # hold on to anything bound to the database or the request.
+    return types.SimpleNamespace(
+        id=company.id,
+        properties=types.SimpleNamespace(**{
+            field: types.SimpleNamespace(
+                value=getattr(company.properties, field).value)
+            for field in fields}))
+
+
+def _resize_caches(config):
+    for cached in cache.caches().values():
+        cached.maxsize = config.cache.maxsize
+        cached.ttl = config.cache.ttl
+
+
+settings.subscribe(_resize_caches)
+
+
+def add_deal(application, uow, args, company):
+    """Add a new deal, related to its company and coworker, and a todo to
+    follow it up to `uow`.
+
+    The company and the coworker are related by the ids in `args`, which
+    must exist, so neither of them is loaded or becomes part of `uow`.
+    `company` is a company snapshot, only used to render the todo note.
+
+    Returns the index of the deal within `uow`.
+    """
+    limetypes = application.limetypes
+
+    # Create a new limeobject of type 'deal' and give it the name passed in
+    # the request. Its company and coworker are set by id, just like when
+    # posting a deal to the REST API of Lime.
+    deal = limetypes.deal(name=args.get('name'),
+                          company=args.get('company'),
+                          coworker=args.get('coworker'))
+
+    # Add the deal object to our unit of work so that it will be part
+    # of the transaction later on.
+    deal_idx = uow.add(deal)
+
+    # When todos are deferred, the `todo` event handler creates the todo
+    # from the deal created event instead, off the request path.
+    if settings.current.todos.mode == 'inline':
+        todo = limetypes.todo()
+        todo.properties.note.value = settings.current.todo_template.render(
+            deal=deal, company=company)
+        todo.properties.deal.attach(deal)
+        uow.add(todo)
+
+    return deal_idx
+
+
+def describe_deal(deal, company):
+    """Describe `deal` and its company, as in the deal created event
+
+    `company` is `None` for deals without a company.
+    """
+    return {
+        'deal': {
+            'id': deal.id,
+            'name': deal.properties.name.value,
+            'value': deal.properties.value.value
+        },
+        'company': {
+            'id': company.id,
+            'name': company.properties.name.value
+        } if company is not None else None
+    }
+
+
+def publish_deal_created(application, deal, company):
+    """Send a custom event, notifying the world about a new deal
+
+    The event is published right away, or through the outbox, depending on
+    `publish.mode`. When todos are deferred, the event carries the note of
+    the todo to create as well.
+    """
+    message = describe_deal(deal, company)
+    # Redeliveries of the event carry the same id, which lets the deal event
+    # handler tell them apart from new deals
+    message['event_id'] = uuid.uuid4().hex
+    if settings.current.todos.mode == 'deferred':
+        message['todo'] = {
+            'note': settings.current.todo_template.render(
+                deal=deal, company=company)
+        }
+    publisher.publish(application, 'hello-world.deal.created', message)
+
+
 api.add_resource(Deal,
                  '/deal/')
+api.add_resource(Deals,
+                 '/deals/')
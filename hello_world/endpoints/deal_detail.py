@@ -0,0 +1,85 @@
+import flask
+import hashlib
+import http.client
+import json
+import lime_errors
+import lime_webserver.webserver as webserver
+import logging
+from ..endpoints import api
+from ..endpoints import deal
+from .. import metrics
+
+logger = logging.getLogger(__name__)
+
+DEAL_GET = 'hello_world_deal_get_seconds'
+metrics.describe(DEAL_GET, 'Time spent in each stage of GET /deal/<id>/')
+metrics.describe('hello_world_deal_get_total', 'Deal reads by outcome')
+
+
+class DealDetail(webserver.LimeResource):
+    """Resource for reading a deal together with its company"""
+
+    def get(self, id_):
+        """Get the deal with id `id_` and its company, in the same shape as
+        the deal created event
+
+        The deal and its company are loaded on every request, as the user
+        making it, so the response is subject to their access rights and
+        never stale. The response carries an ETag, and a client that sends
+        the ETag of its copy in `If-None-Match` gets a 304 without a body
+        if the deal hasn't changed.
+
+        Nothing is cached. Telling whether a cached response is current
+        takes loading the deal and its company, and after that only
+        serializing them is left, which is cheap.
+        """
+        with metrics.timer(DEAL_GET, stage='total'):
+            try:
+                etag, described = load_deal(self.application, id_)
+            except lime_errors.NotFoundError:
+                metrics.count('hello_world_deal_get_total',
+                              outcome='not_found')
+                return {'error': 'Deal {} not found'.format(id_)
+                        }, http.client.NOT_FOUND
+
+            if flask.request.if_none_match.contains_weak(etag):
+                outcome = 'not_modified'
+                response = flask.Response(status=http.client.NOT_MODIFIED)
+            else:
+                outcome = 'ok'
+                with metrics.timer(DEAL_GET, stage='serialize'):
+                    data = json.dumps(described, sort_keys=True)
+                response = flask.Response(data, mimetype='application/json')
+            response.set_etag(etag)
+            metrics.count('hello_world_deal_get_total', outcome=outcome)
+            return response
+
+
+def load_deal(application, id_):
+    """Load the deal with id `id_` and its company, and get the ETag of the
+    response along with its contents
+
+    The ETag is a digest of the values in the response, so that it changes
+    when the deal or its company does.
+
+    Raises `lime_errors.NotFoundError` if there's no such deal.
+    """
+    with metrics.timer(DEAL_GET, stage='lookup'):
+        found = application.limetypes.deal.get(id_)
+        company_id = found.properties.company.id
+        company = None
+        if company_id is not None:
+            try:
+                company = application.limetypes.company.get(company_id)
+            except lime_errors.NotFoundError:
+                pass
+
+    described = deal.describe_deal(found, company)
+    # The description is built in the same order every time, so its repr is
+    # as stable as JSON with sorted keys, and cheaper to get
+    etag = hashlib.sha1(repr(described).encode('utf-8')).hexdigest()
+    return etag, described
+
+
+api.add_resource(DealDetail,
+                 '/deal/<int:id_>/')
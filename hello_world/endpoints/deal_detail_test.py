@@ -0,0 +1,80 @@
+import http.client
+import json
+import pytest
+
+
+def test_get_deal_returns_deal_and_company(webapp, good_deal, acme_company):
+    res = webapp.get('/myapp/hello-world/deal/{}/'.format(good_deal))
+
+    assert res.status_code == http.client.OK
+    assert json.loads(res.data.decode('utf-8')) == {
+        'deal': {'id': good_deal, 'name': 'A good deal', 'value': 100},
+        'company': {'id': acme_company.id, 'name': 'Acme Inc.'},
+    }
+    assert res.headers['ETag']
+
+
+def test_get_deal_returns_304_for_current_etag(webapp, good_deal):
+    url = '/myapp/hello-world/deal/{}/'.format(good_deal)
+    etag = webapp.get(url).headers['ETag']
+
+    res = webapp.get(url, headers={'If-None-Match': etag})
+
+    assert res.status_code == http.client.NOT_MODIFIED
+    assert res.data == b''
+    assert res.headers['ETag'] == etag
+
+
+def test_get_deal_returns_404_if_deal_does_not_exist(webapp):
+    res = webapp.get('/myapp/hello-world/deal/404404/')
+
+    assert res.status_code == http.client.NOT_FOUND
+
+
+def test_get_deal_returns_changed_deal(limeapp, webapp, good_deal):
+    url = '/myapp/hello-world/deal/{}/'.format(good_deal)
+    etag = webapp.get(url).headers['ETag']
+
+    deal = limeapp.limetypes.deal.get(good_deal)
+    deal.properties.name.value = 'A better deal'
+    uow = limeapp.unit_of_work()
+    uow.add(deal)
+    uow.commit()
+
+    res = webapp.get(url, headers={'If-None-Match': etag})
+
+    assert res.status_code == http.client.OK
+    assert res.headers['ETag'] != etag
+    assert json.loads(res.data.decode('utf-8'))['deal']['name'] == \
+        'A better deal'
+
+
+def test_get_deal_returns_404_for_deleted_deal(
+        limeapp, webapp, good_deal):
+    url = '/myapp/hello-world/deal/{}/'.format(good_deal)
+    etag = webapp.get(url).headers['ETag']
+
+    deal = limeapp.limetypes.deal.get(good_deal)
+    deal.delete()
+    uow = limeapp.unit_of_work()
+    uow.add(deal)
+    uow.commit()
+
+    res = webapp.get(url, headers={'If-None-Match': etag})
+
+    assert res.status_code == http.client.NOT_FOUND
+
+
+@pytest.fixture
+def good_deal(limeapp, webapp, acme_company):
+    """The id of a deal with `acme_company`, created through the API"""
+    data = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id,
+        value=100)
+
+    headers = {'Content-Type': 'application/json'}
+    res = webapp.post('/myapp/hello-world/deal/', data=json.dumps(data),
+                      headers=headers)
+    return json.loads(res.data.decode('utf-8'))['id']
@@ -0,0 +1,136 @@
+import flask
+import json
+import lime_webserver.webserver as webserver
+import logging
+import marshmallow
+import webargs.fields as fields
+from ..endpoints import api
+from ..endpoints import deal
+from .. import metrics
+from .. import settings
+
+logger = logging.getLogger(__name__)
+
+DEAL_IMPORT = 'hello_world_deal_import_seconds'
+metrics.describe(DEAL_IMPORT, 'Time spent in each stage of importing a '
+                 'chunk of deals')
+
+# Lines longer than this are reported as errors without being read into
+# memory as a whole
+MAX_LINE_BYTES = 64 * 1024
+
+# Every line is validated against the same schema as a single deal
+line_schema = fields.Nested(deal.args)
+
+
+class DealImport(webserver.LimeResource):
+    """Resource for importing any number of deals, streamed as
+    newline-delimited JSON
+    """
+
+    def post(self):
+        """Create a deal, with a todo, for every line of the body
+
+        The body is read a chunk of `bulk.batch_size` lines at a time, and
+        every chunk is committed in a unit of work of its own. The result of
+        each line is streamed back as soon as its chunk has been committed,
+        as a line of JSON with either the id of the new deal or an error,
+        followed by a summary line. Since a chunk is all that's ever held
+        in memory, there's no limit on the size of the body.
+        """
+        application = self.application
+        stream = flask.request.stream
+        batch_size = settings.current.bulk.batch_size
+
+        def generate():
+            created = failed = 0
+            for chunk in _chunks(_lines(stream), batch_size):
+                for result in import_chunk(application, chunk):
+                    if 'id' in result:
+                        created += 1
+                    else:
+                        failed += 1
+                    yield json.dumps(result) + '\n'
+            yield json.dumps({'created': created, 'failed': failed}) + '\n'
+
+        return flask.Response(flask.stream_with_context(generate()),
+                              mimetype='application/x-ndjson')
+
+
+def _lines(stream):
+    # Yield (line number, line) for every line that isn't blank. A line
+    # that is too long is yielded as `None` and the rest of it skipped.
+    number = 0
+    while True:
+        line = stream.readline(MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > MAX_LINE_BYTES:
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(MAX_LINE_BYTES)
+            yield number, None
+        elif line.strip():
+            yield number, line
+
+
+def _chunks(lines, size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_line(line):
+    """Parse and validate a line of the import
+
+    Returns the arguments of the deal, or raises `ValueError` with a
+    description of what's wrong.
+    """
+    if line is None:
+        raise ValueError('Line is longer than {} bytes'.format(
+            MAX_LINE_BYTES))
+    try:
+        value = json.loads(line.decode('utf-8'))
+    except ValueError as e:
+        raise ValueError('Invalid JSON: {}'.format(e))
+    try:
+        return line_schema.deserialize(value)
+    except marshmallow.ValidationError as e:
+        raise ValueError('Invalid deal: {}'.format(
+            json.dumps(e.messages, sort_keys=True)))
+
+
+def import_chunk(application, chunk):
+    """Create the deals on the lines of `chunk`, a list of (line number,
+    line) pairs, in one unit of work.
+
+    Returns a list of results in the same order, each with the line number
+    and either the id of the new deal or an error.
+    """
+    results = [None] * len(chunk)
+    items = []
+    for pos, (_, line) in enumerate(chunk):
+        try:
+            items.append((pos, parse_line(line)))
+        except ValueError as e:
+            results[pos] = {'error': str(e)}
+
+    with metrics.timer(DEAL_IMPORT, stage='lookup'):
+        companies = deal.resolve_companies(
+            application, [item['company'] for _, item in items])
+        coworkers = deal.resolve_coworkers(
+            application, [item['coworker'] for _, item in items])
+    deal.create_batch(application, items, companies, coworkers, results,
+                      metric=DEAL_IMPORT)
+
+    return [dict(result, line=number)
+            for (number, _), result in zip(chunk, results)]
+
+
+api.add_resource(DealImport,
+                 '/deals/import/')
@@ -0,0 +1,111 @@
+import hello_world.endpoints.deal
+import hello_world.endpoints.deal_import
+import hello_world.settings
+import http.client
+import json
+import lime_config
+
+
+def ndjson(*lines):
+    return ''.join(line + '\n' for line in lines)
+
+
+def read_ndjson(res):
+    return [json.loads(line)
+            for line in res.data.decode('utf-8').splitlines()]
+
+
+def test_import_deals_returns_result_per_line(limeapp, webapp, acme_company):
+    deal = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
+
+    body = ndjson(
+        json.dumps(deal),
+        '{"name": "Broken',
+        '',
+        json.dumps(dict(deal, name=None)),
+        json.dumps(dict(deal, company=404404)),
+        json.dumps(deal))
+    res = webapp.post('/myapp/hello-world/deals/import/', data=body,
+                      headers={'Content-Type': 'application/x-ndjson'})
+
+    assert res.status_code == http.client.OK
+
+    results = read_ndjson(res)
+
+    assert results[0] == {'line': 1, 'id': 1}
+    assert results[1]['line'] == 2
+    assert results[1]['error'].startswith('Invalid JSON')
+    assert results[2]['line'] == 4
+    assert results[2]['error'].startswith('Invalid deal')
+    assert results[3] == {'line': 5, 'error': 'Company 404404 not found'}
+    assert results[4] == {'line': 6, 'id': 2}
+    assert results[5] == {'created': 2, 'failed': 3}
+
+
+def test_import_deals_creates_deals_with_todos(
+        limeapp, webapp, acme_company):
+    deal = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
+
+    res = webapp.post('/myapp/hello-world/deals/import/',
+                      data=ndjson(json.dumps(deal)),
+                      headers={'Content-Type': 'application/x-ndjson'})
+    deal = limeapp.limetypes.deal.get(read_ndjson(res)[0]['id'])
+    todos = list(deal.properties.todo.fetch())
+
+    assert deal.properties.company.id == acme_company.id
+    assert todos[0].properties.note.value == \
+        'Follow up A good deal with Acme Inc.'
+
+
+def test_import_deals_commits_in_chunks(
+        limeapp, webapp, acme_company, monkeypatch):
+    monkeypatch.setitem(
+        lime_config.config['plugins']['hello_world']['bulk'],
+        'batch_size', 2)
+    hello_world.settings.load()
+    commits = []
+    create_batch = hello_world.endpoints.deal.create_batch
+
+    def counting_create_batch(application, items, *args, **kwargs):
+        commits.append(len(items))
+        return create_batch(application, items, *args, **kwargs)
+
+    monkeypatch.setattr(hello_world.endpoints.deal, 'create_batch',
+                        counting_create_batch)
+
+    deal = json.dumps(dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id))
+    res = webapp.post('/myapp/hello-world/deals/import/',
+                      data=ndjson(*[deal] * 5),
+                      headers={'Content-Type': 'application/x-ndjson'})
+
+    assert read_ndjson(res)[-1] == {'created': 5, 'failed': 0}
+    assert commits == [2, 2, 1]
+
+
+def test_import_deals_rejects_too_long_lines(
+        limeapp, webapp, acme_company, monkeypatch):
+    monkeypatch.setattr(hello_world.endpoints.deal_import, 'MAX_LINE_BYTES',
+                        100)
+    deal = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
+
+    res = webapp.post('/myapp/hello-world/deals/import/',
+                      data=ndjson(json.dumps(dict(deal, name='x' * 500)),
+                                  json.dumps(deal)),
+                      headers={'Content-Type': 'application/x-ndjson'})
+    results = read_ndjson(res)
+
+    assert results[0] == {'line': 1,
+                          'error': 'Line is longer than 100 bytes'}
+    assert results[1] == {'line': 2, 'id': 1}
@@ -1,10 +1,13 @@
+import hello_world.cache
+import hello_world.idempotency
+import hello_world.metrics
+import hello_world.settings
+import hello_world.warmup
 import http.client
 import json
-import lime_test.core_db.dsl as dsl
-import lime_test.app
-import lime_test.db
-import lime_test.web_app
-import lime_type
+import lime_config
+import lime_errors
+import lime_query
 import pytest
 
 
@@ -86,6 +89,34 @@ def test_create_deal_creates_todo(limeapp, webapp, acme_company):
         'Follow up A good deal with Acme Inc.'
 
 
+def test_create_deal_leaves_todo_to_event_handler_when_deferred(
+        limeapp, webapp, acme_company, monkeypatch):
+    monkeypatch.setitem(lime_config.config['plugins']['hello_world'],
+                        'todos', {'mode': 'deferred'})
+    hello_world.settings.load()
+    published = []
+    monkeypatch.setattr(limeapp, 'publish',
+                        lambda identifier, message: published.append(
+                            message))
+
+    data = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
+
+    headers = {'Content-Type': 'application/json'}
+    res = webapp.post('/myapp/hello-world/deal/', data=json.dumps(data),
+                      headers=headers)
+
+    json_response = json.loads(res.data.decode('utf-8'))
+
+    deal = limeapp.limetypes.deal.get(json_response['id'])
+
+    assert list(deal.properties.todo.fetch()) == []
+    assert published[0]['todo'] == {
+        'note': 'Follow up A good deal with Acme Inc.'}
+
+
 def test_create_deal_returns_404_if_invalid_company(limeapp, webapp):
     data = dict(
         name='A good deal',
@@ -99,73 +130,320 @@ def test_create_deal_returns_404_if_invalid_company(limeapp, webapp):
     assert res.status_code == 404
 
 
+def test_create_deal_returns_404_if_invalid_coworker(
+        limeapp, webapp, acme_company):
+    data = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=404404)
+
+    headers = {'Content-Type': 'application/json'}
+    res = webapp.post('/myapp/hello-world/deal/', data=json.dumps(data),
+                      headers=headers)
+
+    assert res.status_code == 404
+
+
 @pytest.fixture
-def limetypes():
-    """The limetypes of the core database
-    You can change these, or create your own by twiddling with the YAML based
-    DSL format for limetypes.
+def queries(limeapp, monkeypatch):
+    """The queries the endpoints make to look up companies and coworkers
+
+    Full loads are recorded as ('get', limetype, id) and id-only queries as
+    ('ids', limetype, ids).
     """
-    def create_limetypes():
-        return lime_type.create_limetypes_from_dsl(dsl.dsl)
+    limetype_class = type(limeapp.limetypes.company)
+    get = limetype_class.get
+    execute_query = lime_query.execute_query
+    made = []
 
-    return create_limetypes
+    def counting_get(self, id_, *args, **kwargs):
+        made.append(('get', self.name, id_))
+        return get(self, id_, *args, **kwargs)
 
+    def counting_execute_query(*args, **kwargs):
+        made.append(('ids', kwargs['objecttype'], kwargs['filter']['exp']))
+        return execute_query(*args, **kwargs)
 
-@pytest.fixture
-def database(limetypes, monkeypatch):
-    """An in-memory empty Lime database with the core database limetypes"""
-    database = lime_test.db.create_database_with_limetypes(
-        monkeypatch,
-        limetypes=limetypes(),
-        limename='myapp',
-        sqlname='myapp')
-    return database
+    monkeypatch.setattr(limetype_class, 'get', counting_get)
+    monkeypatch.setattr(lime_query, 'execute_query', counting_execute_query)
+    return made
 
 
-@pytest.fixture
-def limeapp(database, limetypes, monkeypatch):
-    """A Lime application with a user/coworker defined"""
-    app = lime_test.app.create_app(monkeypatch, database, limetypes)
-    user = lime_test.db.create_and_add_user(database=database,
-                                            fullname='Kenny Starfighter',
-                                            username='kenny',
-                                            password='kenny')
-    app.unit_of_work()
+def test_create_deal_loads_company_and_only_checks_coworker_id(
+        limeapp, webapp, acme_company, queries):
+    data = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
+
+    headers = {'Content-Type': 'application/json'}
+    res = webapp.post('/myapp/hello-world/deal/', data=json.dumps(data),
+                      headers=headers)
+
+    assert res.status_code == http.client.CREATED
+    assert queries == [('get', 'company', acme_company.id),
+                       ('ids', 'coworker', [limeapp.coworker.id])]
+
 
-    # TODO: Make it possible to create a coworker with this hack
-    coworker = app.limetypes.coworker(
-        firstname='Kenny',
-        lastname='Starfighter',
-        name='Kenny Starfighter',
-        username=user.id,
-        _from_row=True
-    )
+def test_create_deal_relates_deal_by_id(limeapp, webapp, acme_company):
+    data = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
 
-    uow = app.unit_of_work()
-    idx = uow.add(coworker)
-    res = uow.commit()
+    headers = {'Content-Type': 'application/json'}
+    res = webapp.post('/myapp/hello-world/deal/', data=json.dumps(data),
+                      headers=headers)
 
-    app._coworker = res.get(idx)
+    deal = limeapp.limetypes.deal.get(json.loads(res.data)['id'])
 
-    return app
+    assert deal.properties.company.id == acme_company.id
+    assert deal.properties.coworker.id == limeapp.coworker.id
 
 
-@pytest.fixture
-def webapp(limeapp, database, monkeypatch):
-    """An in-memory web application where you're authenticated as a user"""
-    web_app = lime_test.web_app.create_web_app(database, monkeypatch)
+def test_create_deal_caches_the_company_and_coworker(
+        limeapp, webapp, acme_company, queries):
+    data = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
 
-    return lime_test.web_app.create_authenticated_web_client(web_app=web_app,
-                                                             app=limeapp,
-                                                             username='kenny',
-                                                             password='kenny')
+    headers = {'Content-Type': 'application/json'}
+    for _ in range(3):
+        webapp.post('/myapp/hello-world/deal/', data=json.dumps(data),
+                    headers=headers)
 
+    companies = hello_world.cache.get_cache('myapp', 'company')
 
-@pytest.fixture
-def acme_company(limeapp):
-    """A company that gets added to `limeapp`"""
-    uow = limeapp.unit_of_work()
-    acme = limeapp.limetypes.company(name='Acme Inc.')
-    acme_idx = uow.add(acme)
-    res = uow.commit()
-    return res.get(acme_idx)
+    assert queries == [('get', 'company', acme_company.id),
+                       ('ids', 'coworker', [limeapp.coworker.id])]
+    assert companies.stats()['hits'] == 2
+    assert companies.stats()['misses'] == 1
+
+
+def test_create_deals_checks_all_coworkers_in_one_query(
+        limeapp, webapp, acme_company, queries):
+    deal = dict(
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
+    data = dict(deals=[dict(deal, name='A good deal'),
+                       dict(deal, name='A bad deal', coworker=404404)])
+
+    headers = {'Content-Type': 'application/json'}
+    res = webapp.post('/myapp/hello-world/deals/', data=json.dumps(data),
+                      headers=headers)
+
+    assert res.status_code == http.client.MULTI_STATUS
+    assert queries == [
+        ('get', 'company', acme_company.id),
+        ('ids', 'coworker', sorted([limeapp.coworker.id, 404404]))]
+
+
+def test_create_deals_returns_deal_ids(limeapp, webapp, acme_company):
+    deal = dict(
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
+    data = dict(deals=[dict(deal, name='A good deal'),
+                       dict(deal, name='A better deal')])
+
+    headers = {'Content-Type': 'application/json'}
+    res = webapp.post('/myapp/hello-world/deals/', data=json.dumps(data),
+                      headers=headers)
+
+    assert res.status_code == http.client.CREATED
+
+    json_response = json.loads(res.data.decode('utf-8'))
+
+    assert json_response == {'results': [{'id': 1}, {'id': 2}]}
+
+
+def test_create_deals_creates_deals_with_todos(limeapp, webapp, acme_company):
+    deal = dict(
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
+    data = dict(deals=[dict(deal, name='A good deal'),
+                       dict(deal, name='A better deal')])
+
+    headers = {'Content-Type': 'application/json'}
+    res = webapp.post('/myapp/hello-world/deals/', data=json.dumps(data),
+                      headers=headers)
+
+    json_response = json.loads(res.data.decode('utf-8'))
+
+    for result, name in zip(json_response['results'],
+                            ['A good deal', 'A better deal']):
+        deal = limeapp.limetypes.deal.get(result['id'])
+        todos = list(deal.properties.todo.fetch())
+
+        assert deal.properties.name.value == name
+        assert deal.properties.company.id == acme_company.id
+        assert todos[0].properties.note.value == \
+            'Follow up {} with Acme Inc.'.format(name)
+
+
+def test_create_deals_commits_in_batches(
+        limeapp, webapp, acme_company, monkeypatch):
+    monkeypatch.setitem(
+        lime_config.config['plugins']['hello_world']['bulk'],
+        'batch_size', 2)
+    hello_world.settings.load()
+
+    deal = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
+    data = dict(deals=[deal] * 5)
+
+    headers = {'Content-Type': 'application/json'}
+    res = webapp.post('/myapp/hello-world/deals/', data=json.dumps(data),
+                      headers=headers)
+
+    assert res.status_code == http.client.CREATED
+
+    json_response = json.loads(res.data.decode('utf-8'))
+
+    assert json_response == {'results': [{'id': i} for i in range(1, 6)]}
+
+
+def test_create_deals_reports_errors_per_deal(limeapp, webapp, acme_company):
+    data = dict(deals=[
+        dict(name='A good deal',
+             company=acme_company.id,
+             coworker=limeapp.coworker.id),
+        dict(name='A bad deal',
+             company=404404,
+             coworker=limeapp.coworker.id),
+    ])
+
+    headers = {'Content-Type': 'application/json'}
+    res = webapp.post('/myapp/hello-world/deals/', data=json.dumps(data),
+                      headers=headers)
+
+    assert res.status_code == http.client.MULTI_STATUS
+
+    json_response = json.loads(res.data.decode('utf-8'))
+
+    assert json_response == {'results': [
+        {'id': 1},
+        {'error': 'Company 404404 not found'}]}
+
+
+def test_create_deals_reports_unknown_coworkers_per_deal(
+        limeapp, webapp, acme_company):
+    data = dict(deals=[
+        dict(name='A good deal',
+             company=acme_company.id,
+             coworker=limeapp.coworker.id),
+        dict(name='A bad deal',
+             company=acme_company.id,
+             coworker=404404),
+    ])
+
+    headers = {'Content-Type': 'application/json'}
+    res = webapp.post('/myapp/hello-world/deals/', data=json.dumps(data),
+                      headers=headers)
+
+    assert res.status_code == http.client.MULTI_STATUS
+
+    json_response = json.loads(res.data.decode('utf-8'))
+
+    assert json_response == {'results': [
+        {'id': 1},
+        {'error': 'Coworker 404404 not found'}]}
+
+
+def test_create_deals_validates_all_deals_first(
+        limeapp, webapp, acme_company):
+    data = dict(deals=[
+        dict(name='A good deal',
+             company=acme_company.id,
+             coworker=limeapp.coworker.id),
+        dict(company=acme_company.id,
+             coworker=limeapp.coworker.id),
+    ])
+
+    headers = {'Content-Type': 'application/json'}
+    res = webapp.post('/myapp/hello-world/deals/', data=json.dumps(data),
+                      headers=headers)
+
+    assert res.status_code == http.client.UNPROCESSABLE_ENTITY
+
+    res = webapp.post('/myapp/hello-world/deal/',
+                      data=json.dumps(data['deals'][0]),
+                      headers=headers)
+    json_response = json.loads(res.data.decode('utf-8'))
+
+    assert json_response == {'id': 1}
+
+
+def test_create_deal_with_same_idempotency_key_creates_one_deal(
+        limeapp, webapp, acme_company):
+    data = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
+
+    headers = {'Content-Type': 'application/json',
+               'Idempotency-Key': 'abc123'}
+    first = webapp.post('/myapp/hello-world/deal/', data=json.dumps(data),
+                        headers=headers)
+    retry = webapp.post('/myapp/hello-world/deal/', data=json.dumps(data),
+                        headers=headers)
+
+    assert first.status_code == retry.status_code == http.client.CREATED
+    assert json.loads(first.data.decode('utf-8')) == {'id': 1}
+    assert json.loads(retry.data.decode('utf-8')) == {'id': 1}
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    with pytest.raises(lime_errors.NotFoundError):
+        limeapp.limetypes.deal.get(2)
+
+
+def test_create_deal_refuses_idempotency_key_reused_for_other_deal(
+        limeapp, webapp, acme_company):
+    data = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
+
+    headers = {'Content-Type': 'application/json',
+               'Idempotency-Key': 'abc123'}
+    webapp.post('/myapp/hello-world/deal/', data=json.dumps(data),
+                headers=headers)
+    data['name'] = 'Another deal'
+    res = webapp.post('/myapp/hello-world/deal/', data=json.dumps(data),
+                      headers=headers)
+
+    assert res.status_code == http.client.UNPROCESSABLE_ENTITY
+
+
+def test_metrics_times_deal_creation(limeapp, webapp, acme_company):
+    hello_world.metrics.reset()
+    data = dict(
+        name='A good deal',
+        company=acme_company.id,
+        coworker=limeapp.coworker.id)
+
+    headers = {'Content-Type': 'application/json'}
+    webapp.post('/myapp/hello-world/deal/', data=json.dumps(data),
+                headers=headers)
+    res = webapp.get('/myapp/hello-world/metrics/')
+
+    assert res.status_code == http.client.OK
+    text = res.data.decode('utf-8')
+    for stage in ('validation', 'lookup', 'build', 'commit', 'publish',
+                  'total'):
+        assert ('hello_world_deal_post_seconds_count{{stage="{}"}} 1'
+                .format(stage)) in text
+    assert 'hello_world_deals_created_total 1' in text
+
+
+def test_warm_up_prepares_endpoints(limeapp):
+    timings = hello_world.warmup.warm_up(limeapp, event_handlers=False)
+
+    assert list(timings) == ['settings', 'endpoints', 'limetypes']
+
+
+@pytest.fixture(autouse=True)
+def idempotency_keys(monkeypatch):
+    """Start every test without any used idempotency keys"""
+    monkeypatch.setattr(hello_world.idempotency, '_idempotency', None)
@@ -0,0 +1,19 @@
+import flask
+import lime_webserver.webserver as webserver
+from ..endpoints import api
+from .. import metrics
+
+
+class Metrics(webserver.LimeResource):
+    """Resource exposing the metrics of the plugin to Prometheus"""
+
+    def get(self):
+        """Get the counters and latency histograms of this process in the
+        Prometheus text format
+        """
+        return flask.Response(metrics.render_prometheus(),
+                              mimetype='text/plain; version=0.0.4')
+
+
+api.add_resource(Metrics,
+                 '/metrics/')
@@ -1,17 +1,21 @@
 import logging
-import pkgutil
 import importlib
+from .. import manifest
 
 logger = logging.getLogger(__name__)
 
 
+def application_identifier(message):
+    """Get the identifier of the application that published `message`"""
+    # Events are published on the exchange 'lime.<application>'
+    exchange = message.delivery_info.get('exchange') or ''
+    if exchange.startswith('lime.'):
+        return exchange[len('lime.'):]
+
+
 def register_event_handlers(worker, config):
-    for loader, module_name, is_pkg in pkgutil.walk_packages(__path__):
-        if module_name.endswith('_test'):
-            continue
+    for module_name in manifest.EVENT_HANDLERS:
         module_fullname = '{}.{}'.format(__name__, module_name)
         logger.info('Loading {}'.format(module_fullname))
         module = importlib.import_module(module_fullname)
-
-        if hasattr(module, 'register_event_handlers'):
-            module.register_event_handlers(worker, config)
+        module.register_event_handlers(worker, config)
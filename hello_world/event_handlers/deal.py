@@ -1,24 +1,238 @@
 import logging
-import requests
-import lime_config
+import time
+from .. import encoding
+from .. import metrics
+from .. import outbox
+from .. import settings
+from ..webhooks import batching
+from ..webhooks import dedup
+from ..webhooks import drainer
+from ..webhooks import executor
+from ..webhooks import guards
+from ..webhooks import session
+from ..webhooks import settling
+from ..webhooks import targets
 
 logger = logging.getLogger(__name__)
 
+HANDLER = 'hello_world_deal_handler_seconds'
+EVENTS = 'hello_world_deal_events_total'
+metrics.describe(HANDLER, 'Time spent in each stage of the deal handler')
+metrics.describe(EVENTS, 'Deal events by outcome')
+
 
 def deal(worker, body, message):
-    """Summarize your event handlers's functionality here"""
-    logger.info('Received message: {}'.format(body))
+    """Call the configured webhook with every new deal"""
+    with metrics.timer(HANDLER, stage='total'):
+        # Ack and requeue the messages of the calls that have completed on
+        # other threads, since only this thread may touch the channel
+        settler = settling.get_settler()
+        settler.settle()
+        _handle(body, message)
+        settler.settle()
 
-    if lime_config.config.plugins.hello_world.events.call_api:
-        requests.post(lime_config.config.plugins.hello_world.events.api_url,
-                      json=body)
-    else:
+
+def _handle(body, message):
+    # This runs for every event, so leave formatting the body to the
+    # logger, which skips it unless debug logging is on
+    logger.debug('Received message: %s', body)
+
+    body, payload = encoding.decode_message(
+        body, message, settings.current.publish.encoding)
+    events = settings.current.events
+    if not events.call_api:
         logger.info('Calling external api is disabled in config')
+        metrics.count(EVENTS, outcome='disabled')
+        _ack(message)
+    elif _seen(body, events):
+        logger.debug('Event {} was delivered before, dropping it'.format(
+            body['event_id']))
+        metrics.count(EVENTS, outcome='duplicate')
+        _ack(message)
+    elif not events.rules(body):
+        logger.debug('Event matches no rule, dropping it')
+        metrics.count(EVENTS, outcome='dropped')
+        _ack(message)
+    elif events.delivery == 'async':
+        _post_async(body, payload, message, events)
+    elif events.delivery == 'batch':
+        batching.get_batcher(_post_batch,
+                             events.batch_size,
+                             events.batch_linger_ms / 1000).add(
+            (body, message))
+    elif events.delivery == 'outbox':
+        with metrics.timer(HANDLER, stage='store'):
+            _store(body, events)
+        metrics.count(EVENTS, outcome='stored')
+        _remember([body], events)
+        _ack(message)
+    else:
+        try:
+            _call(payload, events)
+        except guards.CircuitOpenError as e:
+            _requeue([message], e)
+            return
+        except Exception:
+            metrics.count(EVENTS, outcome='failed')
+            raise
+        _remember([body], events)
+        _ack(message)
+
+
+def _seen(body, events):
+    # Events are only remembered once they have been delivered, so that an
+    # event that failed is delivered when it comes back. Events published
+    # without an id are never taken for duplicates.
+    seen = dedup.get_seen_set(events)
+    return (seen is not None and isinstance(body, dict) and
+            'event_id' in body and seen.seen(body['event_id']))
+
+
+def _remember(bodies, events):
+    seen = dedup.get_seen_set(events)
+    if seen is None:
+        return
+    for body in bodies:
+        if isinstance(body, dict) and 'event_id' in body:
+            seen.add(body['event_id'])
+
+
+def _ack(message):
+    with metrics.timer(HANDLER, stage='ack'):
+        message.ack()
+
+
+def _call(body, events):
+    # Deliver to all targets at once, so that it takes as long as the
+    # slowest target rather than the sum of them. Every call goes through
+    # the circuit breaker and the rate limiter of its url, so that a
+    # failing or overloaded webhook isn't hammered.
+    with metrics.timer(HANDLER, stage='delivery'):
+        targets.deliver(body, events,
+                        lambda target, body: guards.call(
+                            target.url, events, _post, target, body, events))
+    metrics.count(EVENTS, len(body) if isinstance(body, list) else 1,
+                  outcome='delivered')
+
+
+def _post(target, body, events):
+    with metrics.timer(HANDLER, stage='post'):
+        response = session.post(target.url, body, events,
+                                timeout=target.timeout,
+                                format=target.format)
+    response.raise_for_status()
+    return response
+
+
+def _requeue(messages, error, requeue=None):
+    # When the circuit is open there's no point in getting the messages
+    # back right away, so hold on to them for a while first.
+    if isinstance(error, guards.CircuitOpenError):
+        metrics.count(EVENTS, len(messages), outcome='deferred')
+        time.sleep(min(error.retry_after,
+                       settings.current.events.circuit_defer_max))
+    else:
+        metrics.count(EVENTS, len(messages), outcome='failed')
+        logger.error('Failed to deliver {} events: {}'.format(
+            len(messages), error))
+
+    for message in messages:
+        if requeue is None:
+            message.requeue()
+        else:
+            requeue(message)
 
-    message.ack()
+
+def _post_async(body, payload, message, events):
+    # Hand the call over to the webhook executor and return right away, so
+    # that a slow webhook doesn't hold up the queue. The message is handed
+    # back to be acked on this thread, after the next step of the worker,
+    # once the call has completed. When
+    # `max_in_flight` messages are unsettled, this waits for calls to
+    # complete and no more messages are consumed until there's room again.
+    settler = settling.get_settler()
+    settler.wait(events.max_in_flight)
+    future = executor.get_executor(events.max_workers,
+                                   events.max_in_flight).submit(
+        _call, payload, events)
+    settler.hold()
+    future.add_done_callback(
+        lambda f: _completed(f, body, message, events, settler))
+
+
+def _completed(future, body, message, events, settler):
+    # Runs on the thread that made the call
+    error = future.exception()
+    if error is None:
+        _remember([body], events)
+        settler.ack(message)
+    else:
+        _requeue([message], error, settler.requeue)
+
+
+def _post_batch(batch):
+    # Post all bodies in the batch as one JSON array, and only ack the
+    # messages when the whole batch has been accepted. Batches are flushed
+    # when they're full or by the steps of the worker, so this always runs
+    # on the consumer thread.
+    events = settings.current.events
+    bodies = [body for body, _ in batch]
+    try:
+        _call(bodies, events)
+    except Exception as e:
+        _requeue([message for _, message in batch], e)
+        return
+
+    _remember(bodies, events)
+    for _, message in batch:
+        _ack(message)
+
+
+def _store(body, events):
+    # Write the event to the local outbox and leave the delivery to the
+    # drainer thread of this process, which retries failed calls with
+    # exponential backoff. The queue never waits for the webhook.
+    deals = outbox.get_outbox(events.outbox_path)
+    deals.put(body)
+    _get_drainer(events).wake()
+
+
+def _get_drainer(events):
+    return drainer.get_drainer(outbox.get_outbox(events.outbox_path),
+                               _deliver,
+                               backoff_base=events.outbox_backoff_base,
+                               backoff_max=events.outbox_backoff_max,
+                               max_attempts=events.outbox_max_attempts,
+                               permanent=_permanent)
+
+
+def _deliver(body):
+    _call(body, settings.current.events)
+
+
+def _permanent(error):
+    # A webhook that turned an event down will turn it down again, unless
+    # it timed out or asked to slow down
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return (status is not None and 400 <= status < 500 and
+            status not in (408, 429))
 
 
 def register_event_handlers(worker, config):
+    # Resolve the configuration, compiling the rules deciding which events
+    # to forward. An invalid configuration stops the worker from starting.
+    settings.load()
+
+    # Calls made in async delivery complete on other threads, and batches
+    # linger, so their messages are settled after the steps of the worker
+    settling.settle_after_steps(worker)
+
+    # Deliver what's left in the outbox, e.g. from before a restart, right
+    # away rather than when the next event comes in
+    events = settings.current.events
+    if events.call_api and events.delivery == 'outbox':
+        _get_drainer(events)
+
     worker.register_event_handler(
         handler_func=deal,
         key='hello-world.deal.created',
@@ -2,12 +2,20 @@ import lime_test.core_db.dsl as dsl
 import lime_test.app
 import lime_test.db
 import lime_type
-import lime_event_handler.worker
 import kombu
 import pytest
 import requests
+import time
 import unittest.mock
-import lime_config
+import hello_world.event_handlers.deal
+import hello_world.metrics
+import hello_world.outbox
+import hello_world.settings
+import hello_world.webhooks.dedup
+import hello_world.webhooks.drainer
+import hello_world.webhooks.guards
+import hello_world.webhooks.executor
+import threading
 
 
 @pytest.fixture
@@ -57,12 +65,6 @@ def limeapp(database, limetypes, monkeypatch):
     return app
 
 
-@pytest.fixture
-def message_queue_connection():
-    """A connection to an in-memory message queue"""
-    return kombu.Connection('memory://')
-
-
 @pytest.fixture
 def publisher(limeapp, message_queue_connection):
     """A publisher function that posts to the in-memory queue"""
@@ -83,42 +85,354 @@ def limeapp_with_events(limeapp, publisher):
     return limeapp
 
 
-@pytest.fixture
-def worker(limeapp, message_queue_connection):
-    """A event-handler-worker with plugins loaded, connected to the
-    in-memory queue"""
-    worker = lime_event_handler.worker.Worker(
-        connection=message_queue_connection,
-        applications=[limeapp.identifier])
-    worker.load_plugins(config=lime_config.config)
+def test_calls_external_api_on_deal_created(
+        limeapp_with_events, worker, acme_company, monkeypatch):
+    monkeypatch.setattr('requests.Session.post', unittest.mock.MagicMock())
+
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.call_api',
+        True)
+    hello_world.settings.load()
+
+    message = {'test': True}
+
+    limeapp_with_events.publish(identifier='hello-world.deal.created',
+                                message=message)
     worker.step()
-    return worker
 
+    requests.Session.post.assert_called_once_with(
+        'https://example.com/foo',
+        data=b'{"test": true}',
+        headers={'Content-Type': 'application/json'},
+        timeout=(3.05, 10))
 
-@pytest.fixture
-def acme_company(limeapp):
-    """A company that gets added to `limeapp`"""
-    uow = limeapp.unit_of_work()
-    acme = limeapp.limetypes.company(name='Acme Inc.')
-    acme_idx = uow.add(acme)
-    res = uow.commit()
-    return res.get(acme_idx)
 
+def test_drops_redelivered_deal_events(
+        limeapp_with_events, worker, monkeypatch):
+    monkeypatch.setattr('requests.Session.post', unittest.mock.MagicMock())
+    monkeypatch.setattr(hello_world.webhooks.dedup, '_seen_sets', {})
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.call_api',
+        True)
+    hello_world.settings.load()
+    hello_world.metrics.reset()
 
-def test_calls_external_api_on_deal_created(
+    for _ in range(2):
+        limeapp_with_events.publish(identifier='hello-world.deal.created',
+                                    message={'event_id': 'abc',
+                                             'test': True})
+        worker.step()
+
+    assert requests.Session.post.call_count == 1
+    assert hello_world.metrics.snapshot()['counters'][
+        'hello_world_deal_events_total{outcome="duplicate"}'] == 1
+
+
+def test_times_delivery_of_deal_events(
+        limeapp_with_events, worker, monkeypatch):
+    monkeypatch.setattr('requests.Session.post', unittest.mock.MagicMock())
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.call_api',
+        True)
+    hello_world.settings.load()
+    hello_world.metrics.reset()
+
+    limeapp_with_events.publish(identifier='hello-world.deal.created',
+                                message={'test': True})
+    worker.step()
+
+    snapshot = hello_world.metrics.snapshot()
+    for stage in ('delivery', 'post', 'ack', 'total'):
+        assert snapshot['histograms'][
+            'hello_world_deal_handler_seconds{{stage="{}"}}'.format(stage)
+        ]['count'] == 1
+    assert snapshot['counters'][
+        'hello_world_deal_events_total{outcome="delivered"}'] == 1
+
+
+def test_slow_webhook_does_not_block_queue_in_async_delivery(
         limeapp_with_events, worker, acme_company, monkeypatch):
-    monkeypatch.setattr('requests.post', unittest.mock.MagicMock())
+    delay = 0.2
+    posted = []
 
+    def slow_post(*args, **kwargs):
+        time.sleep(delay)
+        posted.append(kwargs['data'])
+
+    monkeypatch.setattr('requests.Session.post', slow_post)
     monkeypatch.setattr(
         'lime_config.config.plugins.hello_world.events.call_api',
         True)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.delivery',
+        'async')
+    hello_world.settings.load()
 
-    message = {'test': True}
+    messages = 10
+    for i in range(messages):
+        limeapp_with_events.publish(identifier='hello-world.deal.created',
+                                    message={'test': i})
+
+    start = time.monotonic()
+    for i in range(messages):
+        worker.step()
+    elapsed = time.monotonic() - start
+
+    # Consuming the messages takes nowhere near as long as calling the
+    # webhook for each of them one at a time would.
+    assert elapsed < messages * delay / 2
+
+    hello_world.webhooks.executor.get_executor().wait()
+
+    assert len(posted) == messages
+
+
+def test_acks_on_consumer_thread_in_async_delivery(
+        limeapp_with_events, worker, acme_company, monkeypatch):
+    acked = []
+    monkeypatch.setattr('requests.Session.post', unittest.mock.MagicMock())
+    monkeypatch.setattr(
+        'kombu.message.Message.ack',
+        lambda message: acked.append(threading.current_thread()))
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.call_api',
+        True)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.delivery',
+        'async')
+    hello_world.settings.load()
 
     limeapp_with_events.publish(identifier='hello-world.deal.created',
-                                message=message)
+                                message={'test': True})
     worker.step()
 
-    requests.post.assert_called_once_with(
+    # The queue is idle now, but the worker keeps stepping and acks the
+    # message once the call has completed
+    deadline = time.monotonic() + 1
+    while not acked and time.monotonic() < deadline:
+        worker.step()
+
+    assert acked == [threading.current_thread()]
+
+
+def test_posts_batches_of_events_in_batch_delivery(
+        limeapp_with_events, worker, acme_company, monkeypatch):
+    monkeypatch.setattr('requests.Session.post', unittest.mock.MagicMock())
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.call_api',
+        True)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.delivery',
+        'batch')
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.batch_size',
+        3)
+    hello_world.settings.load()
+
+    for i in range(3):
+        limeapp_with_events.publish(identifier='hello-world.deal.created',
+                                    message={'test': i})
+        worker.step()
+
+    requests.Session.post.assert_called_once_with(
+        'https://example.com/foo',
+        data=b'[{"test": 0}, {"test": 1}, {"test": 2}]',
+        headers={'Content-Type': 'application/json'},
+        timeout=(3.05, 10))
+
+
+def test_posts_matching_events_of_batch_to_filtered_target(
+        limeapp_with_events, worker, acme_company, monkeypatch):
+    monkeypatch.setattr('requests.Session.post', unittest.mock.MagicMock())
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.call_api',
+        True)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.delivery',
+        'batch')
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.batch_size',
+        3)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.targets',
+        [{'url': 'https://a.example.com', 'filter': {'test': 1}}])
+    hello_world.settings.load()
+
+    for i in range(3):
+        limeapp_with_events.publish(identifier='hello-world.deal.created',
+                                    message={'test': i})
+        worker.step()
+
+    requests.Session.post.assert_called_once_with(
+        'https://a.example.com',
+        data=b'[{"test": 1}]',
+        headers={'Content-Type': 'application/json'},
+        timeout=(3.05, 10))
+
+
+def test_acks_lingering_batch_on_consumer_thread_in_batch_delivery(
+        limeapp_with_events, worker, acme_company, monkeypatch):
+    acked = []
+    monkeypatch.setattr('requests.Session.post', unittest.mock.MagicMock())
+    monkeypatch.setattr(
+        'kombu.message.Message.ack',
+        lambda message: acked.append(threading.current_thread()))
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.call_api',
+        True)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.delivery',
+        'batch')
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.batch_linger_ms',
+        10)
+    hello_world.settings.load()
+
+    limeapp_with_events.publish(identifier='hello-world.deal.created',
+                                message={'test': True})
+    worker.step()
+
+    assert requests.Session.post.call_count == 0
+
+    # The queue is idle now, but the worker keeps stepping and flushes the
+    # batch once it has lingered
+    time.sleep(0.01)
+    worker.step()
+
+    assert requests.Session.post.call_count == 1
+    assert acked == [threading.current_thread()]
+
+
+def test_stores_events_in_outbox_in_outbox_delivery(
+        limeapp_with_events, worker, acme_company, monkeypatch, tmpdir):
+    def unavailable(*args, **kwargs):
+        raise requests.ConnectionError('Connection refused')
+
+    monkeypatch.setattr('requests.Session.post', unavailable)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.call_api',
+        True)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.delivery',
+        'outbox')
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.outbox_path',
+        str(tmpdir.join('outbox.sqlite3')))
+    hello_world.settings.load()
+
+    limeapp_with_events.publish(identifier='hello-world.deal.created',
+                                message={'test': True})
+    worker.step()
+
+    deals = hello_world.outbox.get_outbox(str(tmpdir.join('outbox.sqlite3')))
+
+    # The message has been acked and the event is kept until the webhook
+    # is available again.
+    assert len(deals) == 1
+
+
+def test_delivers_outbox_left_from_before_when_registered(
+        monkeypatch, tmpdir):
+    monkeypatch.setattr('requests.Session.post', unittest.mock.MagicMock())
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.call_api',
+        True)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.delivery',
+        'outbox')
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.outbox_path',
+        str(tmpdir.join('outbox.sqlite3')))
+    deals = hello_world.outbox.get_outbox(str(tmpdir.join('outbox.sqlite3')))
+    deals.put({'test': True})
+
+    hello_world.event_handlers.deal.register_event_handlers(
+        unittest.mock.MagicMock(), None)
+    deadline = time.monotonic() + 1
+    while len(deals) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    hello_world.webhooks.drainer.get_drainer(deals, None).stop()
+
+    assert requests.Session.post.call_count == 1
+    assert len(deals) == 0
+
+
+def test_requeues_without_calling_api_when_circuit_is_open(
+        limeapp_with_events, worker, acme_company, monkeypatch):
+    monkeypatch.setattr(hello_world.webhooks.guards, '_guards', {})
+    monkeypatch.setattr('requests.Session.post', unittest.mock.MagicMock(
+        side_effect=requests.ConnectionError('Connection refused')))
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.call_api',
+        True)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.'
+        'circuit_failure_threshold',
+        1)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.circuit_defer_max',
+        0)
+    hello_world.settings.load()
+
+    for i in range(3):
+        limeapp_with_events.publish(identifier='hello-world.deal.created',
+                                    message={'test': i})
+    for i in range(3):
+        try:
+            worker.step()
+        except requests.ConnectionError:
+            pass
+
+    stats = hello_world.webhooks.guards.stats()['https://example.com/foo']
+
+    assert requests.Session.post.call_count == 1
+    assert stats['circuit']['state'] == hello_world.webhooks.guards.OPEN
+    assert stats['circuit']['rejected'] >= 2
+
+
+def test_calls_all_targets_on_deal_created(
+        limeapp_with_events, worker, acme_company, monkeypatch):
+    monkeypatch.setattr('requests.Session.post', unittest.mock.MagicMock())
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.call_api',
+        True)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.targets',
+        [{'url': 'https://a.example.com'},
+         {'url': 'https://b.example.com', 'timeout': 1}])
+    hello_world.settings.load()
+
+    limeapp_with_events.publish(identifier='hello-world.deal.created',
+                                message={'test': True})
+    worker.step()
+
+    calls = sorted(requests.Session.post.call_args_list,
+                   key=lambda call: call[0][0])
+
+    assert [(call[0][0], call[1]['timeout']) for call in calls] == [
+        ('https://a.example.com', (3.05, 10)),
+        ('https://b.example.com', (3.05, 1))]
+
+
+def test_only_calls_external_api_for_events_matching_rules(
+        limeapp_with_events, worker, acme_company, monkeypatch):
+    monkeypatch.setattr('requests.Session.post', unittest.mock.MagicMock())
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.call_api',
+        True)
+    monkeypatch.setattr(
+        'lime_config.config.plugins.hello_world.events.rules',
+        ['deal.value > 100000'])
+    rule_set = hello_world.settings.load().events.rules
+
+    for value in (5000, 200000):
+        limeapp_with_events.publish(identifier='hello-world.deal.created',
+                                    message={'deal': {'value': value}})
+        worker.step()
+
+    requests.Session.post.assert_called_once_with(
         'https://example.com/foo',
-        json=message)
+        data=b'{"deal": {"value": 200000}}',
+        headers={'Content-Type': 'application/json'},
+        timeout=(3.05, 10))
+    assert rule_set.stats() == {'matched': 1, 'dropped': 1}
@@ -0,0 +1,153 @@
+import collections
+import logging
+from . import application_identifier
+from .. import cache
+from .. import encoding
+from .. import settings
+from ..webhooks import batching
+from ..webhooks import dedup
+from ..webhooks import settling
+
+logger = logging.getLogger(__name__)
+
+
+def todo(worker, body, message):
+    """Create the follow-up todo of a new deal, when todos are deferred
+
+    Events are collected into batches of `todos.batch_size`, and the todos
+    of a batch are created in one unit of work per application. The
+    messages are acked once their todos are committed. If the commit fails,
+    the todos of the batch are created one at a time, so that an event that
+    can't be handled doesn't hold up the others. A todo that fails is
+    requeued, until it has failed `todos.max_attempts` times.
+
+    Events that were redelivered after their todo was created are acked
+    without creating another one. Full batches are created right here, and
+    lingering ones after a step of the worker, so the todos are always
+    created, and the messages acked, on the consumer thread.
+    """
+    body, _ = encoding.decode_message(body, message,
+                                      settings.current.publish.encoding)
+    if not isinstance(body, dict) or 'todo' not in body:
+        # Todos are created by the endpoint itself
+        message.ack()
+    elif _seen(body):
+        logger.debug('Todo of event {} was created before, dropping '
+                     'it'.format(body['event_id']))
+        message.ack()
+    else:
+        todos = settings.current.todos
+        batching.get_batcher(create_todos,
+                             todos.batch_size,
+                             todos.batch_linger_ms / 1000).add(
+            (worker, application_identifier(message), body, message))
+
+
+def create_todos(batch):
+    """Create the todos of a batch of (worker, application, body, message)
+    tuples
+    """
+    per_application = collections.defaultdict(list)
+    for worker, identifier, body, message in batch:
+        per_application[identifier].append((body, message))
+
+    for identifier, events in per_application.items():
+        application = None
+        try:
+            application = get_application(worker, identifier)
+            _create_todos(application, [body for body, _ in events])
+        except Exception as e:
+            logger.exception('Failed to create {} todos in {}'.format(
+                len(events), identifier))
+            if len(events) == 1 or application is None:
+                for body, message in events:
+                    _failed(identifier, body, message, e)
+            else:
+                for body, message in events:
+                    _create_todo(application, body, message)
+            continue
+
+        for body, message in events:
+            _created(body, message)
+
+
+def _create_todo(application, body, message):
+    try:
+        _create_todos(application, [body])
+    except Exception as e:
+        _failed(application.identifier, body, message, e)
+    else:
+        _created(body, message)
+
+
+def _created(body, message):
+    seen = _get_seen_set()
+    if seen is not None and 'event_id' in body:
+        seen.add(body['event_id'])
+    message.ack()
+
+
+def _seen(body):
+    # Events published without an id are never taken for duplicates
+    seen = _get_seen_set()
+    return (seen is not None and 'event_id' in body and
+            seen.seen(body['event_id']))
+
+
+def _get_seen_set():
+    # The deal event handler sees the same events, so the todos have a set
+    # of their own
+    return dedup.get_seen_set(settings.current.events, name='todo')
+
+
+def _failed(identifier, body, message, error):
+    # Count the attempts per deal, since the broker only tells whether a
+    # message has been delivered before, not how many times
+    attempts = cache.get_cache(identifier, 'todo_attempts')
+    deal_id = body['deal']['id']
+    count = attempts.get(deal_id, 0) + 1
+    if count < settings.current.todos.max_attempts:
+        attempts.put(deal_id, count)
+        message.requeue()
+        return
+
+    logger.error('Giving up on the todo of deal {} in {} after {} '
+                 'attempts: {}'.format(deal_id, identifier, count, error))
+    attempts.invalidate(deal_id)
+    message.ack()
+
+
+def _create_todos(application, bodies):
+    limetypes = application.limetypes
+    uow = application.unit_of_work()
+    for body in bodies:
+        # The deal is only needed for the relation, so it's set by id and
+        # never loaded
+        todo = limetypes.todo(note=body['todo']['note'],
+                              deal=body['deal']['id'])
+        uow.add(todo)
+    uow.commit()
+    logger.debug('Created {} todos in {}'.format(
+        len(bodies), application.identifier))
+
+
+def get_application(worker, identifier):
+    """Get the application with identifier `identifier` from `worker`, with
+    the session and ACL the worker uses for its applications
+    """
+    return worker.get_application(identifier)
+
+
+def register_event_handlers(worker, config):
+    # The queue is only consumed when todos are deferred, so switching
+    # modes takes a restart of the worker as well as the webserver.
+    if settings.current.todos.mode != 'deferred':
+        return
+
+    # Lingering batches are created after the steps of the worker
+    settling.settle_after_steps(worker)
+
+    worker.register_event_handler(
+        handler_func=todo,
+        key='hello-world.deal.created',
+        queue_name='todo')
@@ -0,0 +1,235 @@
+import lime_test.core_db.dsl as dsl
+import lime_test.app
+import lime_test.db
+import lime_type
+import pytest
+import unittest.mock
+import lime_config
+import hello_world.event_handlers.todo
+import hello_world.settings
+import hello_world.webhooks.dedup
+
+
+def make_message(exchange='lime.myapp'):
+    message = unittest.mock.MagicMock()
+    message.delivery_info = {'exchange': exchange}
+    return message
+
+
+def make_worker(applications):
+    worker = unittest.mock.MagicMock()
+    worker.get_application.side_effect = applications.get
+    return worker
+
+
+def make_application(failing=()):
+    """A stub application whose commits fail if they include a todo of any
+    of the deals in `failing`
+    """
+    application = unittest.mock.MagicMock()
+    application.identifier = 'myapp'
+    # A todo stands in for the id of its deal
+    application.limetypes.todo.side_effect = lambda note, deal: deal
+    application.committed = []
+
+    def unit_of_work():
+        added = []
+        uow = unittest.mock.MagicMock()
+        uow.add.side_effect = added.append
+
+        def commit():
+            deals = [item for item in added if isinstance(item, int)]
+            if set(deals) & set(failing):
+                raise RuntimeError('Deal has been deleted')
+            application.committed.append(deals)
+
+        uow.commit.side_effect = commit
+        return uow
+
+    application.unit_of_work.side_effect = unit_of_work
+    return application
+
+
+def make_batch(worker, deal_ids, identifier='myapp'):
+    return [(worker, identifier,
+             {'deal': {'id': deal_id}, 'todo': {'note': 'Call'}},
+             make_message('lime.' + identifier))
+            for deal_id in deal_ids]
+
+
+def test_todo_acks_events_without_todo():
+    message = make_message()
+
+    hello_world.event_handlers.todo.todo(None, {'deal': {'id': 1}}, message)
+
+    message.ack.assert_called_once_with()
+
+
+def test_create_todos_commits_once_per_application():
+    applications = {'myapp': make_application(),
+                    'otherapp': make_application()}
+    worker = make_worker(applications)
+    batch = (make_batch(worker, [1], 'myapp') +
+             make_batch(worker, [2], 'otherapp') +
+             make_batch(worker, [3], 'myapp'))
+
+    hello_world.event_handlers.todo.create_todos(batch)
+
+    assert applications['myapp'].committed == [[1, 3]]
+    assert applications['otherapp'].committed == [[2]]
+    for _, _, _, message in batch:
+        message.ack.assert_called_once_with()
+
+
+def test_create_todos_creates_todos_one_at_a_time_if_commit_fails():
+    application = make_application(failing=[2])
+    batch = make_batch(make_worker({'myapp': application}), [1, 2, 3])
+
+    hello_world.event_handlers.todo.create_todos(batch)
+
+    assert application.committed == [[1], [3]]
+    for _, _, body, message in batch:
+        if body['deal']['id'] == 2:
+            message.requeue.assert_called_once_with()
+            message.ack.assert_not_called()
+        else:
+            message.ack.assert_called_once_with()
+
+
+def test_create_todos_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setitem(lime_config.config['plugins']['hello_world'],
+                        'todos', {'max_attempts': 3})
+    hello_world.settings.load()
+    worker = make_worker({'myapp': make_application(failing=[1])})
+
+    messages = []
+    for _ in range(3):
+        batch = make_batch(worker, [1])
+        hello_world.event_handlers.todo.create_todos(batch)
+        messages.append(batch[0][3])
+
+    for message in messages[:2]:
+        message.requeue.assert_called_once_with()
+        message.ack.assert_not_called()
+    messages[2].ack.assert_called_once_with()
+    messages[2].requeue.assert_not_called()
+
+
+def test_todo_creates_todo_of_redelivered_event_once(monkeypatch):
+    monkeypatch.setattr(hello_world.webhooks.dedup, '_seen_sets', {})
+    monkeypatch.setitem(lime_config.config['plugins']['hello_world'],
+                        'todos', {'mode': 'deferred', 'batch_size': 1})
+    hello_world.settings.load()
+    application = make_application()
+    worker = make_worker({'myapp': application})
+    body = {'event_id': 'abc', 'deal': {'id': 1}, 'todo': {'note': 'Call'}}
+    messages = [make_message(), make_message()]
+
+    for message in messages:
+        hello_world.event_handlers.todo.todo(worker, body, message)
+
+    assert application.committed == [[1]]
+    for message in messages:
+        message.ack.assert_called_once_with()
+
+
+def test_todo_creates_todo_again_if_it_failed(monkeypatch):
+    monkeypatch.setattr(hello_world.webhooks.dedup, '_seen_sets', {})
+    monkeypatch.setitem(lime_config.config['plugins']['hello_world'],
+                        'todos', {'mode': 'deferred', 'batch_size': 1})
+    hello_world.settings.load()
+    worker = make_worker({'myapp': make_application(failing=[1])})
+    body = {'event_id': 'abc', 'deal': {'id': 1}, 'todo': {'note': 'Call'}}
+    messages = [make_message(), make_message()]
+
+    for message in messages:
+        hello_world.event_handlers.todo.todo(worker, body, message)
+
+    for message in messages:
+        message.requeue.assert_called_once_with()
+
+
+def test_creates_todo_of_deal_created_event_eventually(
+        deferred_todos, limeapp_with_events, worker, acme_company):
+    uow = limeapp_with_events.unit_of_work()
+    deal_idx = uow.add(limeapp_with_events.limetypes.deal(name='A good deal'))
+    deal = uow.commit().get(deal_idx)
+
+    limeapp_with_events.publish(
+        identifier='hello-world.deal.created',
+        message={'deal': {'id': deal.id, 'name': 'A good deal'},
+                 'company': {'id': acme_company.id, 'name': 'Acme Inc.'},
+                 'todo': {'note': 'Follow up A good deal with Acme Inc.'}})
+    # One message for the webhook and one for the todo
+    worker.step()
+    worker.step()
+
+    deal = limeapp_with_events.limetypes.deal.get(deal.id)
+    todos = list(deal.properties.todo.fetch())
+
+    assert [todo.properties.note.value for todo in todos] == [
+        'Follow up A good deal with Acme Inc.']
+
+
+@pytest.fixture
+def deferred_todos(monkeypatch):
+    """Defer todos, creating them one at a time"""
+    monkeypatch.setitem(lime_config.config['plugins']['hello_world'],
+                        'todos', {'mode': 'deferred', 'batch_size': 1})
+    hello_world.settings.load()
+
+
+@pytest.fixture
+def lingering_todos(monkeypatch):
+    """Defer todos, creating them in batches that never fill up"""
+    monkeypatch.setitem(lime_config.config['plugins']['hello_world'],
+                        'todos', {'mode': 'deferred', 'batch_size': 10,
+                                  'batch_linger_ms': 0})
+    hello_world.settings.load()
+
+
+@pytest.fixture
+def limetypes():
+    """The limetypes of the core database
+    You can change these, or create your own by twiddling with the YAML based
+    DSL format for limetypes.
+    """
+    return lime_type.create_limetypes_from_dsl(dsl.dsl)
+
+
+@pytest.fixture
+def database(limetypes, monkeypatch):
+    """An in-memory empty Lime database with the core database limetypes"""
+    database = lime_test.db.create_database_with_limetypes(monkeypatch,
+                                                           limetypes=limetypes,
+                                                           limename='myapp',
+                                                           sqlname='myapp')
+    return database
+
+
+@pytest.fixture
+def limeapp(database, limetypes, monkeypatch):
+    """A Lime application"""
+    return lime_test.app.create_app(monkeypatch, database, limetypes)
+
+
+def test_creates_lingering_todos_while_queue_is_idle(
+        lingering_todos, limeapp_with_events, worker, acme_company):
+    uow = limeapp_with_events.unit_of_work()
+    deal_idx = uow.add(limeapp_with_events.limetypes.deal(name='A good deal'))
+    deal = uow.commit().get(deal_idx)
+
+    limeapp_with_events.publish(
+        identifier='hello-world.deal.created',
+        message={'event_id': 'abc',
+                 'deal': {'id': deal.id, 'name': 'A good deal'},
+                 'company': {'id': acme_company.id, 'name': 'Acme Inc.'},
+                 'todo': {'note': 'Follow up A good deal with Acme Inc.'}})
+    # The batch isn't full, but it's created after the steps of the worker
+    # that find the queue idle
+    for _ in range(3):
+        worker.step()
+
+    deal = limeapp_with_events.limetypes.deal.get(deal.id)
+
+    assert len(list(deal.properties.todo.fetch())) == 1
@@ -0,0 +1,265 @@
+"""Run a request only once per idempotency key
+
+Clients that retry requests send the same `Idempotency-Key` header with
+every attempt. `Idempotency.execute` runs the request for the first attempt
+and hands the stored response back for the others. Attempts that come in
+while the first one is still running wait for it, rather than running the
+request again. A key is only used up by a request that succeeds, so a
+failed request can be retried with the same key.
+
+Responses are kept in an in-memory LRU cache per process, or in a SQLite
+database that all processes on the host share when `idempotency.path` is
+set.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from . import cache
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+# Returned by `claim` when another process is running the request
+PENDING = object()
+
+_idempotency = None
+_idempotency_config = None
+_idempotency_lock = threading.Lock()
+
+
+class KeyReusedError(Exception):
+    """The key was used before for a request with another payload"""
+
+    def __init__(self, key):
+        super().__init__('Idempotency key {!r} was used for another '
+                         'request'.format(key))
+        self.key = key
+
+
+class InProgressError(Exception):
+    """The request with the key didn't finish in time"""
+
+    def __init__(self, key):
+        super().__init__('A request with idempotency key {!r} is still in '
+                         'progress'.format(key))
+        self.key = key
+
+
+def fingerprint(payload):
+    """Get a digest of `payload`, to tell if a key is reused for another
+    request
+    """
+    return hashlib.sha256(json.dumps(payload, sort_keys=True,
+                                     default=str).encode('utf-8')).hexdigest()
+
+
+class MemoryStore:
+    """Keeps at most `maxsize` responses for `ttl` seconds in this process"""
+
+    def __init__(self, maxsize=10000, ttl=86400, clock=time.monotonic):
+        self._responses = cache.LruCache(maxsize=maxsize, ttl=ttl,
+                                         clock=clock)
+
+    def claim(self, key, fingerprint):
+        """Get the (fingerprint, response) stored for `key`, or `None` if
+        the caller should run the request
+        """
+        return self._responses.get(key)
+
+    def complete(self, key, fingerprint, response):
+        self._responses.put(key, (fingerprint, response))
+
+    def release(self, key):
+        pass
+
+
+class SqliteStore:
+    """Keeps at most `maxsize` responses for `ttl` seconds in a SQLite
+    database at `path`, shared by all processes using it.
+
+    A claimed key is marked as pending, so that other processes wait for
+    the response instead of running the request too. If the process dies,
+    the claim expires after `lease` seconds.
+    """
+
+    def __init__(self, path, maxsize=10000, ttl=86400, lease=60,
+                 clock=time.time):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lease = lease
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS idempotency ('
+                         'key TEXT PRIMARY KEY, '
+                         'fingerprint TEXT NOT NULL, '
+                         'response TEXT, '
+                         'expires REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS idempotency_expires '
+                         'ON idempotency (expires)')
+
+    def claim(self, key, fingerprint):
+        """Get the (fingerprint, response) stored for `key`, `PENDING` if
+        another process is running the request, or `None` if the caller
+        should run it
+        """
+        key = json.dumps(key)
+        now = self._clock()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    'SELECT fingerprint, response FROM idempotency '
+                    'WHERE key = ? AND expires > ?', (key, now)).fetchone()
+                if row is None:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO idempotency '
+                        '(key, fingerprint, expires) VALUES (?, ?, ?)',
+                        (key, fingerprint, now + self.lease))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+        if row is None:
+            return None
+        if row[1] is None:
+            return PENDING
+        return row[0], json.loads(row[1])
+
+    def complete(self, key, fingerprint, response):
+        now = self._clock()
+        with self._lock:
+            self._db.execute(
+                'UPDATE idempotency SET response = ?, expires = ? '
+                'WHERE key = ?',
+                (json.dumps(response), now + self.ttl, json.dumps(key)))
+            # Keep the table bounded: drop expired responses, and the
+            # oldest ones beyond `maxsize`
+            self._db.execute('DELETE FROM idempotency WHERE expires <= ?',
+                             (now,))
+            self._db.execute(
+                'DELETE FROM idempotency WHERE key IN ('
+                'SELECT key FROM idempotency ORDER BY expires DESC '
+                'LIMIT -1 OFFSET ?)', (self.maxsize,))
+
+    def release(self, key):
+        with self._lock:
+            self._db.execute(
+                'DELETE FROM idempotency WHERE key = ? AND response IS NULL',
+                (json.dumps(key),))
+
+    def __len__(self):
+        with self._lock:
+            cursor = self._db.execute('SELECT COUNT(*) FROM idempotency')
+            return cursor.fetchone()[0]
+
+
+class Idempotency:
+    """Runs requests at most once per key, with responses kept in `store`
+
+    Duplicates wait at most `wait_timeout` seconds for the first attempt.
+    Duplicates in this process are woken up as soon as it's done, others
+    are checked for every `poll_interval` seconds.
+    """
+
+    def __init__(self, store, wait_timeout=10, poll_interval=0.05,
+                 clock=time.monotonic):
+        self.store = store
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._clock = clock
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def execute(self, key, fingerprint, fn):
+        """Call `fn` unless a request with `key` has succeeded before
+
+        Returns (response, replayed), where `response` is what `fn`
+        returned, now or for an earlier request, and `replayed` tells which
+        one it was. `response` must be serializable as JSON.
+
+        Raises `KeyReusedError` if `key` was used for a request with
+        another `fingerprint`, and `InProgressError` if another request
+        with `key` is still running after `wait_timeout` seconds.
+        """
+        deadline = self._clock() + self.wait_timeout
+        while True:
+            with self._lock:
+                running = self._running.get(key)
+                if running is None:
+                    stored = self.store.claim(key, fingerprint)
+                    if stored is None:
+                        done = self._running[key] = threading.Event()
+                        break
+                    if stored is not PENDING:
+                        return self._replay(key, fingerprint, stored), True
+
+            remaining = deadline - self._clock()
+            if remaining <= 0:
+                raise InProgressError(key)
+            if running is not None:
+                running.wait(remaining)
+            else:
+                time.sleep(min(self.poll_interval, remaining))
+
+        try:
+            response = fn()
+        except Exception:
+            self.store.release(key)
+            raise
+        else:
+            self.store.complete(key, fingerprint, response)
+        finally:
+            with self._lock:
+                del self._running[key]
+            done.set()
+        return response, False
+
+    def _replay(self, key, fingerprint, stored):
+        if stored[0] != fingerprint:
+            raise KeyReusedError(key)
+        logger.debug('Replaying response for idempotency key {!r}'.format(
+            key))
+        return stored[1]
+
+
+def get_idempotency():
+    """Get the `Idempotency` for the current settings"""
+    global _idempotency, _idempotency_config
+
+    if _idempotency is None:
+        with _idempotency_lock:
+            if _idempotency is None:
+                _idempotency = _create(settings.current.idempotency)
+                _idempotency_config = vars(settings.current.idempotency)
+    return _idempotency
+
+
+def _create(config):
+    if config.path:
+        logger.info('Keeping idempotency keys in {}'.format(config.path))
+        store = SqliteStore(config.path, maxsize=config.maxsize,
+                            ttl=config.ttl)
+    else:
+        store = MemoryStore(maxsize=config.maxsize, ttl=config.ttl)
+    return Idempotency(store, wait_timeout=config.wait_timeout)
+
+
+def _reset(config):
+    # Keep the stored responses unless the store itself was reconfigured
+    global _idempotency, _idempotency_config
+
+    with _idempotency_lock:
+        if vars(config.idempotency) != _idempotency_config:
+            _idempotency = None
+            _idempotency_config = vars(config.idempotency)
+
+
+settings.subscribe(_reset)
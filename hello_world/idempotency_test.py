@@ -0,0 +1,110 @@
+import hello_world.idempotency
+import pytest
+import threading
+import time
+
+
+@pytest.fixture
+def idempotency():
+    return hello_world.idempotency.Idempotency(
+        hello_world.idempotency.MemoryStore(maxsize=10), wait_timeout=1)
+
+
+@pytest.fixture
+def sqlite_path(tmpdir):
+    return str(tmpdir.join('idempotency.sqlite3'))
+
+
+def test_execute_replays_response_for_same_key(idempotency):
+    calls = []
+
+    def create():
+        calls.append(1)
+        return {'id': len(calls)}
+
+    assert idempotency.execute('key', 'a', create) == ({'id': 1}, False)
+    assert idempotency.execute('key', 'a', create) == ({'id': 1}, True)
+    assert len(calls) == 1
+
+
+def test_execute_runs_request_again_after_failure(idempotency):
+    def fail():
+        raise ValueError('Database is down')
+
+    with pytest.raises(ValueError):
+        idempotency.execute('key', 'a', fail)
+
+    assert idempotency.execute('key', 'a', lambda: 'ok') == ('ok', False)
+
+
+def test_execute_refuses_key_reused_for_other_payload(idempotency):
+    idempotency.execute('key', 'a', lambda: 'ok')
+
+    with pytest.raises(hello_world.idempotency.KeyReusedError):
+        idempotency.execute('key', 'b', lambda: 'ok')
+
+
+def test_concurrent_duplicates_run_request_once(idempotency):
+    calls = []
+    responses = []
+
+    def create():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'created'
+
+    threads = [threading.Thread(target=lambda: responses.append(
+        idempotency.execute('key', 'a', create))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(responses) == [('created', False)] + [('created', True)] * 4
+
+
+def test_sqlite_store_is_shared_between_processes(sqlite_path):
+    first = hello_world.idempotency.Idempotency(
+        hello_world.idempotency.SqliteStore(sqlite_path), wait_timeout=1,
+        poll_interval=0.01)
+    second = hello_world.idempotency.Idempotency(
+        hello_world.idempotency.SqliteStore(sqlite_path), wait_timeout=1,
+        poll_interval=0.01)
+    started = threading.Event()
+
+    def create():
+        started.set()
+        time.sleep(0.1)
+        return ['created', 201]
+
+    thread = threading.Thread(
+        target=lambda: first.execute(('myapp', 'key'), 'a', create))
+    thread.start()
+    started.wait()
+
+    response = second.execute(('myapp', 'key'), 'a', lambda: ['again', 201])
+    thread.join()
+
+    assert response == (['created', 201], True)
+
+
+def test_sqlite_store_times_out_waiting_for_pending_request(sqlite_path):
+    store = hello_world.idempotency.SqliteStore(sqlite_path)
+    store.claim('key', 'a')
+    idempotency = hello_world.idempotency.Idempotency(
+        hello_world.idempotency.SqliteStore(sqlite_path), wait_timeout=0.05,
+        poll_interval=0.01)
+
+    with pytest.raises(hello_world.idempotency.InProgressError):
+        idempotency.execute('key', 'a', lambda: 'ok')
+
+
+def test_sqlite_store_keeps_at_most_maxsize_responses(sqlite_path):
+    store = hello_world.idempotency.SqliteStore(sqlite_path, maxsize=2)
+    for key in ('a', 'b', 'c'):
+        store.claim(key, 'x')
+        store.complete(key, 'x', 'ok')
+
+    assert len(store) == 2
+    assert store.claim('c', 'x') == ('x', 'ok')
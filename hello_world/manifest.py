@@ -0,0 +1,20 @@
+"""The modules of the plugin that register endpoints and event handlers
+
+The webserver only imports the modules in `ENDPOINTS` and the worker only
+imports the modules in `EVENT_HANDLERS`, instead of walking the packages
+and importing everything in them. Add new modules here.
+"""
+
+# Modules in hello_world.endpoints adding resources to the blueprint
+ENDPOINTS = [
+    'deal',
+    'deal_detail',
+    'deal_import',
+    'metrics',
+]
+
+# Modules in hello_world.event_handlers with a `register_event_handlers`
+EVENT_HANDLERS = [
+    'deal',
+    'todo',
+]
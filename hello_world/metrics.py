@@ -0,0 +1,260 @@
+"""Counters and latency histograms for the hot paths of the plugin
+
+Metrics are identified by a name and labels, e.g.
+`timer('hello_world_deal_post_seconds', stage='commit')`, and can be
+exported as Prometheus text with `render_prometheus` or as a dict with
+`snapshot`. Recording is skipped altogether when `metrics.enabled` is off.
+"""
+import bisect
+import logging
+import threading
+import time
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0, 2.5, 5.0, 10.0)
+
+enabled = True
+
+_histograms = {}
+_counters = {}
+_collectors = []
+_help = {}
+_lock = threading.Lock()
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative(self):
+        """Get (upper bound, count) pairs, like Prometheus buckets"""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float('inf'),),
+                                self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class Timer:
+    """Time a block of code into a histogram, if metrics are enabled"""
+
+    __slots__ = ('name', 'labels', '_start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self._start = None
+
+    def __enter__(self):
+        if enabled:
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._start is not None:
+            histogram(self.name, **self.labels).observe(
+                time.perf_counter() - self._start)
+
+
+def _get(metrics, cls, name, labels):
+    key = (name, tuple(sorted(labels.items())))
+    try:
+        return metrics[key]
+    except KeyError:
+        with _lock:
+            return metrics.setdefault(key, cls())
+
+
+def histogram(name, **labels):
+    return _get(_histograms, Histogram, name, labels)
+
+
+def counter(name, **labels):
+    return _get(_counters, Counter, name, labels)
+
+
+def describe(name, help_text):
+    """Set the help text of the metric `name`"""
+    _help[name] = help_text
+
+
+def timer(name, **labels):
+    """Time a `with` block into the histogram `name` with `labels`"""
+    return Timer(name, labels)
+
+
+def count(name, amount=1, **labels):
+    """Add `amount` to the counter `name` with `labels`"""
+    if enabled:
+        counter(name, **labels).inc(amount)
+
+
+def register_collector(collector):
+    """Add gauges computed on export
+
+    `collector` is called on every export and should return an iterable of
+    (name, labels, value) tuples.
+    """
+    _collectors.append(collector)
+
+
+def _gauges():
+    gauges = []
+    for collector in list(_collectors):
+        try:
+            gauges.extend(collector())
+        except Exception:
+            logger.exception('Metrics collector {} failed'.format(collector))
+    return gauges
+
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ''
+    return '{{{}}}'.format(','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"'))
+        for key, value in pairs))
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def render_prometheus():
+    """Render all metrics in the Prometheus text exposition format"""
+    lines = []
+    described = set()
+
+    def header(name, kind):
+        if name not in described:
+            described.add(name)
+            if name in _help:
+                lines.append('# HELP {} {}'.format(name, _help[name]))
+            lines.append('# TYPE {} {}'.format(name, kind))
+
+    for (name, labels), metric in sorted(_counters.items()):
+        header(name, 'counter')
+        lines.append('{}{} {}'.format(name, _format_labels(labels),
+                                      metric.value))
+
+    for (name, labels), metric in sorted(_histograms.items()):
+        header(name, 'histogram')
+        for bound, count_ in metric.cumulative():
+            lines.append('{}_bucket{} {}'.format(
+                name, _format_labels(labels, le=_format_bound(bound)),
+                count_))
+        lines.append('{}_sum{} {}'.format(name, _format_labels(labels),
+                                          metric.sum))
+        lines.append('{}_count{} {}'.format(name, _format_labels(labels),
+                                            metric.count))
+
+    for name, labels, value in sorted(_gauges(), key=lambda g: g[:2]):
+        header(name, 'gauge')
+        lines.append('{}{} {}'.format(
+            name, _format_labels(sorted(labels.items())), value))
+
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot():
+    """Get all metrics as a dict, e.g. for logging them from the worker"""
+    def key(name, labels):
+        return '{}{}'.format(name, _format_labels(labels))
+
+    return {
+        'counters': {key(name, labels): metric.value
+                     for (name, labels), metric in list(_counters.items())},
+        'histograms': {
+            key(name, labels): {
+                'count': metric.count,
+                'sum': metric.sum,
+                'buckets': [(_format_bound(bound), count_)
+                            for bound, count_ in metric.cumulative()],
+            }
+            for (name, labels), metric in list(_histograms.items())},
+        'gauges': {key(name, sorted(labels.items())): value
+                   for name, labels, value in _gauges()},
+    }
+
+
+def reset():
+    """Forget all recorded metrics"""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def _plugin_gauges():
+    # Imported here to avoid an import cycle, since the settings that this
+    # module depends on import the targets.
+    from . import cache
+    from .webhooks import dedup
+    from .webhooks import guards
+    from .webhooks import targets
+
+    for name, stats in cache.stats().items():
+        for key in ('hits', 'misses', 'size'):
+            yield ('hello_world_cache_{}'.format(key), {'cache': name},
+                   stats[key])
+
+    for url, stats in guards.stats().items():
+        yield ('hello_world_webhook_circuit_open', {'url': url},
+               int(stats['circuit']['state'] != guards.CLOSED))
+        for key in ('rejected', 'opened'):
+            yield ('hello_world_webhook_circuit_{}'.format(key),
+                   {'url': url}, stats['circuit'][key])
+        yield ('hello_world_webhook_throttled', {'url': url},
+               stats['rate_limit']['throttled'])
+
+    for url, stats in targets.stats().items():
+        for key in ('successes', 'failures'):
+            yield ('hello_world_webhook_{}'.format(key), {'url': url},
+                   stats[key])
+
+    stats = dedup.stats(settings.current.events)
+    if stats is not None:
+        for key in ('memory_bytes', 'size', 'false_positive_rate',
+                    'duplicates'):
+            yield 'hello_world_dedup_{}'.format(key), {}, stats[key]
+
+    rules = settings.current.events.rules.stats()
+    for key in ('matched', 'dropped'):
+        yield 'hello_world_events_{}'.format(key), {}, rules[key]
+
+
+def _configure(config):
+    global enabled
+    enabled = config.metrics.enabled
+
+
+register_collector(_plugin_gauges)
+settings.subscribe(_configure)
+_configure(settings.current)
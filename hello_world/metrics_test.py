@@ -0,0 +1,73 @@
+import hello_world.metrics as metrics
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def no_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, '_histograms', {})
+    monkeypatch.setattr(metrics, '_counters', {})
+    monkeypatch.setattr(metrics, '_collectors', [])
+    monkeypatch.setattr(metrics, 'enabled', True)
+
+
+def test_timer_observes_duration():
+    with metrics.timer('deal_seconds', stage='commit'):
+        pass
+
+    histogram = metrics.histogram('deal_seconds', stage='commit')
+
+    assert histogram.count == 1
+    assert histogram.cumulative()[-1] == (float('inf'), 1)
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 5):
+        histogram.observe(value)
+
+    assert histogram.cumulative() == [(0.1, 1), (1.0, 3), (float('inf'), 4)]
+    assert histogram.sum == pytest.approx(6.25)
+
+
+def test_nothing_is_recorded_when_disabled(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', False)
+
+    with metrics.timer('deal_seconds', stage='commit'):
+        pass
+    metrics.count('deals_total')
+
+    assert metrics.snapshot() == {'counters': {}, 'histograms': {},
+                                  'gauges': {}}
+
+
+def test_render_prometheus():
+    metrics.describe('deals_total', 'Created deals')
+    metrics.count('deals_total', 2)
+    metrics.histogram('deal_seconds', stage='commit').observe(0.002)
+    metrics.register_collector(lambda: [('cache_hits', {'cache': 'c'}, 3)])
+
+    text = metrics.render_prometheus()
+
+    assert '# HELP deals_total Created deals\n' in text
+    assert '# TYPE deals_total counter\ndeals_total 2\n' in text
+    assert 'deal_seconds_bucket{stage="commit",le="0.001"} 0\n' in text
+    assert 'deal_seconds_bucket{stage="commit",le="0.0025"} 1\n' in text
+    assert 'deal_seconds_bucket{stage="commit",le="+Inf"} 1\n' in text
+    assert 'deal_seconds_count{stage="commit"} 1\n' in text
+    assert '# TYPE cache_hits gauge\ncache_hits{cache="c"} 3\n' in text
+
+
+def test_snapshot():
+    metrics.count('events_total', queue='deal')
+    metrics.histogram('deal_seconds').observe(0.002)
+
+    snapshot = metrics.snapshot()
+
+    assert snapshot['counters'] == {'events_total{queue="deal"}': 1}
+    assert snapshot['histograms']['deal_seconds']['count'] == 1
+
+
+def test_plugin_gauges_include_rule_counters():
+    gauges = list(metrics._plugin_gauges())
+
+    assert ('hello_world_events_matched', {}, 0) in gauges
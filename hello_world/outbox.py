@@ -0,0 +1,156 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_outboxes = {}
+_outboxes_lock = threading.Lock()
+
+
+class Outbox:
+    """A durable queue of JSON payloads, kept in a SQLite database at `path`
+
+    Payloads are claimed with `claim`, and then either removed with `done`,
+    scheduled for another attempt with `retry`, or given up on with `bury`,
+    which moves them to the dead letters. A claim is a lease: if
+    the claimer dies, the payloads become due again when the lease expires,
+    so several processes can share the same outbox.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS outbox ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'payload TEXT NOT NULL, '
+                         'attempts INTEGER NOT NULL DEFAULT 0, '
+                         'due REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS outbox_due '
+                         'ON outbox (due)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS dead_letters ('
+                         'id INTEGER PRIMARY KEY, '
+                         'payload TEXT NOT NULL, '
+                         'attempts INTEGER NOT NULL, '
+                         'error TEXT NOT NULL, '
+                         'buried REAL NOT NULL)')
+
+    def put(self, payload):
+        """Store `payload` and return its id"""
+        with self._lock:
+            cursor = self._db.execute(
+                'INSERT INTO outbox (payload, due) VALUES (?, ?)',
+                (json.dumps(payload), self._clock()))
+            return cursor.lastrowid
+
+    def claim(self, limit=100, lease=60):
+        """Claim at most `limit` due payloads for `lease` seconds
+
+        Returns a list of (id, payload, attempts) tuples, oldest first.
+        """
+        now = self._clock()
+        with self._lock:
+            # Look before taking the write lock, which an idle drainer would
+            # otherwise take every time it checks
+            if self._db.execute('SELECT 1 FROM outbox WHERE due <= ? '
+                                'LIMIT 1', (now,)).fetchone() is None:
+                return []
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._db.execute(
+                    'SELECT id, payload, attempts FROM outbox '
+                    'WHERE due <= ? ORDER BY id LIMIT ?',
+                    (now, limit)).fetchall()
+                self._db.executemany(
+                    'UPDATE outbox SET due = ? WHERE id = ?',
+                    [(now + lease, row[0]) for row in rows])
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+        return [(id_, json.loads(payload), attempts)
+                for id_, payload, attempts in rows]
+
+    def extend(self, ids, lease):
+        """Extend the lease of the claimed payloads with the given ids to
+        `lease` seconds from now
+        """
+        with self._lock:
+            self._db.executemany('UPDATE outbox SET due = ? WHERE id = ?',
+                                 [(self._clock() + lease, id_)
+                                  for id_ in ids])
+
+    def done(self, ids):
+        """Remove the payloads with the given ids"""
+        with self._lock:
+            self._db.executemany('DELETE FROM outbox WHERE id = ?',
+                                 [(id_,) for id_ in ids])
+
+    def retry(self, id_, delay):
+        """Make the payload with id `id_` due again in `delay` seconds"""
+        with self._lock:
+            self._db.execute(
+                'UPDATE outbox SET attempts = attempts + 1, due = ? '
+                'WHERE id = ?',
+                (self._clock() + delay, id_))
+
+    def bury(self, id_, error):
+        """Move the payload with id `id_` to the dead letters, with the
+        `error` that made its last attempt fail
+        """
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute(
+                    'INSERT INTO dead_letters '
+                    '(id, payload, attempts, error, buried) '
+                    'SELECT id, payload, attempts + 1, ?, ? FROM outbox '
+                    'WHERE id = ?',
+                    (str(error), self._clock(), id_))
+                self._db.execute('DELETE FROM outbox WHERE id = ?', (id_,))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def dead_letters(self, limit=100):
+        """Get at most `limit` dead letters, oldest first
+
+        Returns a list of (id, payload, attempts, error) tuples.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT id, payload, attempts, error FROM dead_letters '
+                'ORDER BY id LIMIT ?', (limit,)).fetchall()
+        return [(id_, json.loads(payload), attempts, error)
+                for id_, payload, attempts, error in rows]
+
+    def compact(self):
+        """Give the space of removed payloads back to the file system"""
+        with self._lock:
+            self._db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self._db.execute('VACUUM')
+
+    def __len__(self):
+        with self._lock:
+            cursor = self._db.execute('SELECT COUNT(*) FROM outbox')
+            return cursor.fetchone()[0]
+
+
+def get_outbox(path):
+    """Get the outbox stored at `path`"""
+    try:
+        return _outboxes[path]
+    except KeyError:
+        with _outboxes_lock:
+            if path not in _outboxes:
+                logger.info('Opening outbox {}'.format(path))
+                _outboxes[path] = Outbox(path)
+            return _outboxes[path]
@@ -0,0 +1,86 @@
+import hello_world.outbox
+import pytest
+
+
+@pytest.fixture
+def outbox(tmpdir, clock):
+    return hello_world.outbox.Outbox(str(tmpdir.join('outbox.sqlite3')),
+                                     clock=clock)
+
+
+def test_claim_returns_payloads_in_order(outbox):
+    first = outbox.put({'deal': 1})
+    second = outbox.put({'deal': 2})
+
+    assert outbox.claim() == [(first, {'deal': 1}, 0),
+                              (second, {'deal': 2}, 0)]
+
+
+def test_claimed_payloads_are_due_again_after_lease(outbox, clock):
+    id_ = outbox.put({'deal': 1})
+    outbox.claim(lease=60)
+
+    assert outbox.claim() == []
+
+    clock.now += 60
+
+    assert outbox.claim() == [(id_, {'deal': 1}, 0)]
+
+
+def test_extend_holds_on_to_claimed_payloads(outbox, clock):
+    id_ = outbox.put({'deal': 1})
+    outbox.claim(lease=60)
+    clock.now += 50
+    outbox.extend([id_], 60)
+    clock.now += 50
+
+    assert outbox.claim() == []
+
+    clock.now += 10
+
+    assert outbox.claim() == [(id_, {'deal': 1}, 0)]
+
+
+def test_done_removes_payloads(outbox):
+    id_ = outbox.put({'deal': 1})
+    outbox.claim()
+    outbox.done([id_])
+
+    assert len(outbox) == 0
+
+
+def test_retry_counts_attempts_and_delays(outbox, clock):
+    id_ = outbox.put({'deal': 1})
+    outbox.claim()
+    outbox.retry(id_, 10)
+
+    assert outbox.claim() == []
+
+    clock.now += 10
+
+    assert outbox.claim() == [(id_, {'deal': 1}, 1)]
+
+
+def test_payloads_survive_reopening(tmpdir, clock):
+    path = str(tmpdir.join('outbox.sqlite3'))
+    hello_world.outbox.Outbox(path, clock=clock).put({'deal': 1})
+
+    assert hello_world.outbox.Outbox(path, clock=clock).claim()[0][1] == \
+        {'deal': 1}
+
+
+def test_bury_moves_payload_to_dead_letters(outbox):
+    id_ = outbox.put({'deal': 1})
+    outbox.retry(id_, 0)
+    outbox.bury(id_, ValueError('Bad request'))
+
+    assert len(outbox) == 0
+    assert outbox.dead_letters() == [(id_, {'deal': 1}, 2, 'Bad request')]
+
+
+def test_compact_keeps_pending_payloads(outbox):
+    outbox.done([outbox.put({'deal': i}) for i in range(100)])
+    outbox.put({'deal': 100})
+    outbox.compact()
+
+    assert outbox.claim()[0][1] == {'deal': 100}
@@ -0,0 +1,111 @@
+"""Publish events of the plugin, directly or through an outbox
+
+With `publish.mode` set to `direct`, events are published right away on the
+request thread, as `application.publish` does. With `outbox`, they are
+written to a local SQLite outbox at `publish.outbox_path` instead, and a
+background thread of the process publishes them. It claims them from the
+outbox in batches of `publish.batch_size`, and publishes them one at a time
+with `application.publish`, through an application of its own rather than
+the one of the request. Responses then don't wait for the broker, and
+events that can't be published are kept and retried rather than lost. The
+thread starts with the endpoints, so that events stored by a process that
+has died are published without waiting for new ones.
+
+Events are encoded as `publish.encoding`, JSON or the more compact msgpack.
+"""
+import lime_acl
+import lime_application
+import logging
+import os
+import threading
+from . import encoding
+from . import metrics
+from . import outbox
+from . import settings
+from .webhooks import drainer
+
+logger = logging.getLogger(__name__)
+
+_applications = {}
+_applications_lock = threading.Lock()
+
+
+def publish(application, identifier, message):
+    """Publish the event `identifier` with `message` for `application`"""
+    config = settings.current.publish
+    if config.mode == 'direct':
+        application.publish(identifier=identifier,
+                            message=_encode(message, config))
+        return
+
+    events = outbox.get_outbox(config.outbox_path)
+    events.put({
+        'application': application.identifier,
+        'identifier': identifier,
+        'message': message,
+    })
+    _get_drainer(config).wake()
+
+
+def start():
+    """Start publishing the events in the outbox, if `publish.mode` is
+    `outbox`
+    """
+    config = settings.current.publish
+    if config.mode == 'outbox':
+        _get_drainer(config)
+
+
+def _get_drainer(config):
+    return drainer.get_drainer(outbox.get_outbox(config.outbox_path),
+                               _publish,
+                               batch_size=config.batch_size,
+                               interval=config.interval_ms / 1000)
+
+
+def _publish(event):
+    get_application(event['application']).publish(
+        identifier=event['identifier'],
+        message=_encode(event['message'], settings.current.publish))
+
+
+def get_application(identifier):
+    """Get the application with identifier `identifier` to publish through
+
+    Publishing needs no user, so the application isn't tied to any request.
+    It's loaded once per process, allowed everything, just like in
+    `manage.py console`.
+    """
+    key = (os.getpid(), identifier)
+    try:
+        return _applications[key]
+    except KeyError:
+        with _applications_lock:
+            if key not in _applications:
+                logger.info('Loading {} to publish events'.format(
+                    identifier))
+                _applications[key] = lime_application.get_application(
+                    identifier, acl=lime_acl.AlwaysAllowAcl())
+            return _applications[key]
+
+
+def _encode(message, config):
+    # With `publish.encoding` set to msgpack, the message is published as
+    # msgpack bytes rather than left to the broker to encode as JSON.
+    # `application.publish` has no say in the content type, and kombu sends
+    # bytes as they are, as `application/data`. That's what workers should
+    # get anyway: they refuse `application/x-msgpack` unless they accept
+    # msgpack. The handlers decode raw bodies in `publish.encoding`.
+    if config.encoding == 'json':
+        return message
+    return encoding.encode(message, config.encoding)
+
+
+def _gauges():
+    config = settings.current.publish
+    if config.mode == 'outbox':
+        yield ('hello_world_publish_outbox_size', {},
+               len(outbox.get_outbox(config.outbox_path)))
+
+
+metrics.register_collector(_gauges)
@@ -0,0 +1,174 @@
+import hello_world.encoding
+import hello_world.event_handlers.deal
+import hello_world.event_handlers.todo
+import hello_world.outbox
+import hello_world.publisher
+import hello_world.settings
+import hello_world.webhooks.drainer
+import kombu
+import pytest
+import time
+import unittest.mock
+
+
+class FakeApplication:
+    def __init__(self, identifier='myapp'):
+        self.identifier = identifier
+        self.published = []
+
+    def publish(self, identifier, message):
+        self.published.append((identifier, message))
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    monkeypatch.setattr(hello_world.publisher, '_applications', {})
+    monkeypatch.setattr(hello_world.webhooks.drainer, '_drainers', {})
+    yield
+    for drainer in hello_world.webhooks.drainer._drainers.values():
+        drainer.stop()
+    hello_world.settings.load({})
+
+
+@pytest.fixture
+def outbox_mode(tmpdir):
+    hello_world.settings.load({'publish': {
+        'mode': 'outbox',
+        'outbox_path': str(tmpdir.join('publish.sqlite3')),
+        'interval_ms': 10}})
+
+
+def test_publish_directly_by_default():
+    hello_world.settings.load({})
+    application = FakeApplication()
+
+    hello_world.publisher.publish(application, 'hello-world.deal.created',
+                                  {'deal': {'id': 1}})
+
+    assert application.published == [
+        ('hello-world.deal.created', {'deal': {'id': 1}})]
+
+
+@pytest.fixture
+def applications(monkeypatch):
+    """The applications the background thread publishes through, by
+    identifier
+    """
+    applications = {}
+    monkeypatch.setattr(hello_world.publisher, 'get_application',
+                        applications.__getitem__)
+    return applications
+
+
+def test_publish_through_outbox_in_background(outbox_mode, applications):
+    application = FakeApplication()
+    applications['myapp'] = FakeApplication()
+
+    for i in range(3):
+        hello_world.publisher.publish(application,
+                                      'hello-world.deal.created',
+                                      {'deal': {'id': i}})
+
+    # Not through the application of the request, which is done by then
+    published = applications['myapp'].published
+    assert wait_for(lambda: len(published) == 3)
+    assert published == [
+        ('hello-world.deal.created', {'deal': {'id': i}}) for i in range(3)]
+    assert application.published == []
+
+
+def test_start_publishes_events_left_in_outbox(outbox_mode, applications,
+                                               tmpdir):
+    applications['myapp'] = FakeApplication()
+    hello_world.outbox.get_outbox(str(tmpdir.join('publish.sqlite3'))).put({
+        'application': 'myapp',
+        'identifier': 'hello-world.deal.created',
+        'message': {'deal': {'id': 1}}})
+
+    hello_world.publisher.start()
+
+    assert wait_for(lambda: applications['myapp'].published == [
+        ('hello-world.deal.created', {'deal': {'id': 1}})])
+
+
+def test_publish_through_outbox_with_lime_application(
+        outbox_mode, limeapp, monkeypatch):
+    published = []
+    limeapp._publisher = lambda routing_key, body: published.append(
+        (routing_key, body))
+    monkeypatch.setattr(hello_world.publisher, 'get_application',
+                        {limeapp.identifier: limeapp}.__getitem__)
+
+    hello_world.publisher.publish(limeapp, 'hello-world.deal.created',
+                                  {'deal': {'id': 1}})
+
+    assert wait_for(lambda: len(published) == 1)
+    assert published[0][0] == 'hello-world.deal.created'
+
+
+class KombuApplication(FakeApplication):
+    """An application publishing to an in-memory broker, like a Lime
+    application does, leaving the content type to kombu
+    """
+
+    def __init__(self, connection, identifier='myapp'):
+        super().__init__(identifier)
+        exchange = kombu.Exchange('lime.{}'.format(identifier),
+                                  type='topic')
+        self.producer = kombu.Producer(connection, exchange)
+        self.queue = kombu.Queue('deal', exchange,
+                                 routing_key='hello-world.deal.created')
+        self.queue(connection).declare()
+
+    def publish(self, identifier, message):
+        self.producer.publish(message, identifier)
+
+
+def consume(connection, queue, handler):
+    # Consume like the worker does, accepting JSON only
+    with kombu.Consumer(connection, [queue], accept=['json'],
+                        callbacks=[lambda body, message: handler(
+                            None, body, message)]):
+        connection.drain_events(timeout=1)
+
+
+@pytest.mark.parametrize('handler', [
+    hello_world.event_handlers.deal.deal,
+    hello_world.event_handlers.todo.todo,
+])
+def test_msgpack_events_reach_handlers_through_broker(handler, monkeypatch):
+    pytest.importorskip('msgpack')
+    post = unittest.mock.MagicMock()
+    monkeypatch.setattr('requests.Session.post', post)
+    batcher = unittest.mock.MagicMock()
+    monkeypatch.setattr('hello_world.webhooks.batching.get_batcher',
+                        lambda *args: batcher)
+    hello_world.settings.load({
+        'publish': {'encoding': 'msgpack'},
+        'todos': {'mode': 'deferred'},
+        'events': {'call_api': True, 'format': 'msgpack',
+                   'dedup_window': 0}})
+    connection = kombu.Connection('memory://')
+    application = KombuApplication(connection)
+    event = {'deal': {'id': 1}, 'todo': {'note': 'Follow up'}}
+
+    hello_world.publisher.publish(application, 'hello-world.deal.created',
+                                  event)
+    consume(connection, application.queue, handler)
+
+    if handler is hello_world.event_handlers.deal.deal:
+        # Posted as it was published, without encoding it again
+        assert post.call_args[1]['data'] == \
+            hello_world.encoding.encode(event, 'msgpack')
+        assert post.call_args[1]['headers'] == {
+            'Content-Type': 'application/x-msgpack'}
+    else:
+        (_, _, body, _), = batcher.add.call_args[0]
+        assert body == event
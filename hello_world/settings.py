@@ -0,0 +1,183 @@
+"""The configuration of the plugin, resolved once
+
+`current` holds the settings built from `default_config()` merged with the
+loaded configuration of the plugin, with every key as an attribute, e.g.
+`settings.current.events.call_api`. Hot paths read it instead of looking up
+`lime_config.config` over and over.
+
+`load()` validates the configuration and swaps in new settings in one go,
+so readers see either the old or the new settings, never a mix of them.
+Call it again after the configuration has been reloaded. Functions passed
+to `subscribe` are called with the new settings after every `load()`.
+"""
+import collections.abc
+import logging
+from . import default_config
+from . import encoding
+from . import template
+from .webhooks import rules
+from .webhooks import targets
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_MODES = ('sync', 'async', 'batch', 'outbox')
+TODO_MODES = ('inline', 'deferred')
+PUBLISH_MODES = ('direct', 'outbox')
+
+_POSITIVE_INTEGERS = [
+    ('bulk', 'batch_size'),
+    ('cache', 'maxsize'),
+    ('idempotency', 'maxsize'),
+    ('todos', 'batch_size'),
+    ('todos', 'max_attempts'),
+    ('publish', 'batch_size'),
+    ('events', 'fan_out_workers'),
+    ('events', 'pool_size'),
+    ('events', 'max_workers'),
+    ('events', 'max_in_flight'),
+    ('events', 'batch_size'),
+    ('events', 'outbox_max_attempts'),
+    ('events', 'circuit_failure_threshold'),
+    ('events', 'dedup_capacity'),
+]
+
+_listeners = []
+
+
+class Section:
+    """A read-only section of the settings, with its keys as attributes"""
+
+    def __init__(self, values):
+        self.__dict__.update(values)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Settings are read-only')
+
+    def __repr__(self):
+        return 'Section({!r})'.format(self.__dict__)
+
+
+def build(values):
+    """Build settings from `values`, the configuration of the plugin,
+    merged with `default_config()`.
+
+    The todo note template, the rules and the webhook targets are compiled
+    as well: `todo_template` is a `template.Template`, `events.rules` a
+    `rules.RuleSet` and `events.targets` a list of `targets.Target`.
+
+    Raises `ValueError` if the configuration is invalid.
+    """
+    merged = _merge(default_config(), values, '')
+
+    for section, key in _POSITIVE_INTEGERS:
+        value = merged[section][key]
+        if not isinstance(value, int) or value < 1:
+            raise ValueError('{}.{} must be a positive integer, not '
+                             '{!r}'.format(section, key, value))
+
+    for section, modes in (('todos', TODO_MODES),
+                           ('publish', PUBLISH_MODES)):
+        if merged[section]['mode'] not in modes:
+            raise ValueError('{}.mode must be one of {}, not {!r}'.format(
+                section, ', '.join(modes), merged[section]['mode']))
+
+    events = merged['events']
+    if events['delivery'] not in DELIVERY_MODES:
+        raise ValueError('events.delivery must be one of {}, not {!r}'.format(
+            ', '.join(DELIVERY_MODES), events['delivery']))
+
+    if events['dedup_window'] < 0:
+        raise ValueError('events.dedup_window must not be negative, not '
+                         '{!r}'.format(events['dedup_window']))
+    if not 0 < events['dedup_error_rate'] < 1:
+        raise ValueError('events.dedup_error_rate must be between 0 and 1, '
+                         'not {!r}'.format(events['dedup_error_rate']))
+
+    # Messages that are waiting to be acked count towards the prefetch count
+    # of the worker, which gets no more messages once it's reached
+    prefetch_count = events['prefetch_count']
+    for key in ('max_in_flight', 'batch_size'):
+        if prefetch_count and events[key] >= prefetch_count:
+            raise ValueError('events.{} must be below events.prefetch_count '
+                             '({}), not {!r}'.format(
+                                 key, prefetch_count, events[key]))
+
+    encoding.check(merged['publish']['encoding'], 'publish.encoding')
+    encoding.check(events['format'], 'events.format')
+
+    events['rules'] = rules.RuleSet(events['rules'])
+    events['targets'] = targets.get_targets(
+        events['targets'] or [{'url': events['api_url']}],
+        connect_timeout=events['connect_timeout'],
+        read_timeout=events['read_timeout'],
+        format=events['format'])
+
+    merged['todo_template'] = template.Template(merged['todo_note_text'])
+    return _freeze(merged)
+
+
+def _merge(defaults, values, path):
+    if not isinstance(values, collections.abc.Mapping):
+        raise ValueError('{} must be a mapping, not {!r}'.format(
+            path.rstrip('.') or 'The configuration', values))
+
+    for key in set(values) - set(defaults):
+        logger.warning('Ignoring unknown setting {}{}'.format(path, key))
+
+    merged = {}
+    for key, default in defaults.items():
+        value = values.get(key, default)
+        if isinstance(default, dict):
+            merged[key] = _merge(default, value, '{}{}.'.format(path, key))
+        else:
+            _check_type(path + key, value, default)
+            merged[key] = value
+    return merged
+
+
+def _check_type(name, value, default):
+    if isinstance(default, bool):
+        expected = (bool,)
+    elif isinstance(default, (int, float)):
+        expected = (int, float)
+    elif isinstance(default, (list, tuple)):
+        expected = (list, tuple)
+    else:
+        expected = (type(default),)
+
+    if (not isinstance(value, expected) or
+            (bool not in expected and isinstance(value, bool))):
+        raise ValueError('{} must be of type {}, not {!r}'.format(
+            name, ' or '.join(t.__name__ for t in expected), value))
+
+
+def _freeze(values):
+    return Section({key: _freeze(value) if isinstance(value, dict) else value
+                    for key, value in values.items()})
+
+
+def load(values=None):
+    """Build settings from `values`, or from the loaded configuration of the
+    plugin if left out, and make them the `current` settings.
+
+    Raises `ValueError` if the configuration is invalid, in which case the
+    current settings are kept.
+    """
+    global current
+
+    if values is None:
+        import lime_config
+        values = lime_config.config['plugins']['hello_world']
+
+    current = build(values)
+    for listener in list(_listeners):
+        listener(current)
+    return current
+
+
+def subscribe(listener):
+    """Call `listener` with the new settings whenever they're loaded"""
+    _listeners.append(listener)
+
+
+current = build({})
@@ -0,0 +1,79 @@
+import hello_world.settings
+import pytest
+
+
+def test_build_uses_defaults():
+    settings = hello_world.settings.build({})
+
+    assert settings.events.call_api is False
+    assert settings.bulk.batch_size == 100
+
+
+def test_build_merges_configuration():
+    settings = hello_world.settings.build({'events': {'call_api': True}})
+
+    assert settings.events.call_api is True
+    assert settings.events.api_url == 'https://example.com/foo'
+
+
+def test_build_compiles_template_rules_and_targets():
+    settings = hello_world.settings.build({
+        'events': {'rules': ['deal.value > 100']},
+    })
+
+    assert settings.todo_template.fields['company'] == {'name'}
+    assert settings.events.rules({'deal': {'value': 1000}})
+    assert [t.url for t in settings.events.targets] == \
+        ['https://example.com/foo']
+
+
+@pytest.mark.parametrize('values', [
+    {'events': {'call_api': 'yes'}},
+    {'events': {'delivery': 'carrier pigeon'}},
+    {'todos': {'mode': 'later'}},
+    {'publish': {'mode': 'carrier pigeon'}},
+    {'publish': {'encoding': 'xml'}},
+    {'events': {'targets': [{'url': 'https://example.com',
+                             'format': 'xml'}]}},
+    {'events': {'rules': ['deal.value >']}},
+    {'events': {'targets': [{'timeout': 1}]}},
+    {'bulk': {'batch_size': 0}},
+    {'events': {'dedup_error_rate': 1}},
+    {'events': {'dedup_window': -1}},
+    {'events': {'prefetch_count': 100, 'max_in_flight': 100}},
+    {'events': {'prefetch_count': 200, 'batch_size': 200}},
+    {'cache': 'big'},
+    {'todo_note_text': 'Follow up {deal.name}'},
+])
+def test_build_rejects_invalid_configuration(values):
+    with pytest.raises(ValueError):
+        hello_world.settings.build(values)
+
+
+def test_settings_are_read_only():
+    with pytest.raises(AttributeError):
+        hello_world.settings.build({}).events.call_api = True
+
+
+def test_load_swaps_current_settings_and_notifies(monkeypatch):
+    monkeypatch.setattr(hello_world.settings, 'current',
+                        hello_world.settings.current)
+    monkeypatch.setattr(hello_world.settings, '_listeners', [])
+    loaded = []
+    hello_world.settings.subscribe(loaded.append)
+
+    settings = hello_world.settings.load({'events': {'call_api': True}})
+
+    assert hello_world.settings.current is settings
+    assert loaded == [settings]
+
+
+def test_load_keeps_current_settings_when_invalid(monkeypatch):
+    monkeypatch.setattr(hello_world.settings, 'current',
+                        hello_world.settings.current)
+    current = hello_world.settings.current
+
+    with pytest.raises(ValueError):
+        hello_world.settings.load({'bulk': {'batch_size': -1}})
+
+    assert hello_world.settings.current is current
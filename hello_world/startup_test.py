@@ -0,0 +1,55 @@
+import hello_world.manifest
+import os
+import pkgutil
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_plugin(code='import hello_world'):
+    """Import the plugin in a fresh interpreter and return the cumulative
+    import times in microseconds, keyed by module name.
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=ROOT, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \|\s+(\S+)', line)
+        if match:
+            times[match.group(2)] = int(match.group(1))
+    return times
+
+
+def modules(package):
+    path = os.path.join(ROOT, 'hello_world', package)
+    return sorted(name for _, name, _ in pkgutil.iter_modules([path])
+                  if not name.endswith('_test'))
+
+
+def test_importing_plugin_imports_no_endpoints_or_event_handlers():
+    times = import_plugin()
+
+    assert 'hello_world' in times
+    assert 'hello_world.endpoints' not in times
+    assert 'hello_world.event_handlers' not in times
+
+
+def test_importing_plugin_imports_none_of_its_modules_or_dependencies():
+    times = import_plugin()
+
+    assert [name for name in times if name.startswith('hello_world.')] == []
+    for dependency in ('flask', 'kombu', 'lime_application',
+                       'lime_webserver', 'msgpack', 'requests', 'sqlite3'):
+        assert dependency not in times
+
+
+def test_manifest_lists_all_endpoint_modules():
+    assert sorted(hello_world.manifest.ENDPOINTS) == modules('endpoints')
+
+
+def test_manifest_lists_all_event_handler_modules():
+    assert sorted(hello_world.manifest.EVENT_HANDLERS) == \
+        modules('event_handlers')
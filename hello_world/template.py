@@ -0,0 +1,55 @@
+import operator
+import re
+import string
+
+_FIELD = re.compile(r'^(deal|company)\.(?:properties\.(\w+)\.value|(id))$')
+
+
+class Template:
+    """A todo note template, compiled once
+
+    The template is a `str.format` string referring to properties of the
+    deal and its company, e.g. `{deal.properties.name.value}`, or their
+    ids, e.g. `{company.id}`. `fields` tells which properties of each
+    object the template needs, so only those have to be fetched.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.fields = {'deal': set(), 'company': set()}
+        self._getters = []
+        parts = []
+
+        try:
+            parsed = list(string.Formatter().parse(text))
+        except ValueError as e:
+            raise ValueError('Invalid template {!r}: {}'.format(text, e))
+
+        for literal, field, format_spec, conversion in parsed:
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field is None:
+                continue
+
+            match = _FIELD.match(field)
+            if not match:
+                raise ValueError('Invalid field {!r} in template {!r}'.format(
+                    field, text))
+            root, prop, id_ = match.groups()
+            if prop:
+                self.fields[root].add(prop)
+            self._getters.append(
+                (root, operator.attrgetter(field[len(root) + 1:])))
+
+            parts.append('{{{}{}{}}}'.format(
+                len(self._getters) - 1,
+                '!' + conversion if conversion else '',
+                ':' + format_spec if format_spec else ''))
+
+        self._format = ''.join(parts).format
+
+    def render(self, **objects):
+        """Render the template with `objects`, the deal and the company,
+        e.g. `render(deal=deal, company=company)`
+        """
+        return self._format(*[get(objects[root])
+                              for root, get in self._getters])
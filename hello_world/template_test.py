@@ -0,0 +1,54 @@
+import hello_world.template
+import pytest
+import types
+
+
+def limeobject(id_, **properties):
+    return types.SimpleNamespace(
+        id=id_,
+        properties=types.SimpleNamespace(**{
+            name: types.SimpleNamespace(value=value)
+            for name, value in properties.items()}))
+
+
+def test_render_default_template():
+    template = hello_world.template.Template(
+        'Follow up {deal.properties.name.value} with '
+        '{company.properties.name.value}')
+
+    assert template.render(deal=limeobject(1, name='A good deal'),
+                           company=limeobject(1, name='Acme Inc.')) == \
+        'Follow up A good deal with Acme Inc.'
+
+
+def test_fields_are_the_properties_used():
+    template = hello_world.template.Template(
+        '{deal.properties.name.value} {deal.properties.value.value} '
+        '{company.id}')
+
+    assert template.fields == {'deal': {'name', 'value'}, 'company': set()}
+
+
+def test_render_keeps_format_specs_and_escaped_braces():
+    template = hello_world.template.Template(
+        '{{{deal.properties.value.value:>6}}} {deal.properties.name.value!r}')
+
+    assert template.render(deal=limeobject(1, value=42, name='Deal')) == \
+        "{    42} 'Deal'"
+
+
+def test_render_ids():
+    template = hello_world.template.Template('Deal {deal.id}')
+
+    assert template.render(deal=limeobject(42)) == 'Deal 42'
+
+
+@pytest.mark.parametrize('text', [
+    'Follow up {deal.properties.name}',
+    'Follow up {coworker.properties.name.value}',
+    'Follow up {deal.properties.name.value',
+    'Follow up {}',
+])
+def test_invalid_templates_are_rejected(text):
+    with pytest.raises(ValueError):
+        hello_world.template.Template(text)
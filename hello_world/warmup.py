@@ -0,0 +1,64 @@
+"""Warming up a process before it starts serving
+
+Call `warm_up` in the parent process of a pre-forking server, before the
+children are forked, e.g. from the `when_ready` hook of gunicorn with
+`preload_app` enabled. The children then share the imported modules,
+compiled templates and schemas with the parent, copy-on-write, instead of
+each of them building their own on their first request.
+"""
+import collections
+import importlib
+import logging
+import time
+from . import manifest
+from . import settings
+
+logger = logging.getLogger(__name__)
+
+LIMETYPES = ['deal', 'company', 'coworker', 'todo']
+
+
+def warm_up(application=None, endpoints=True, event_handlers=True):
+    """Do the work a process would otherwise do when handling its first
+    request or event.
+
+    The configuration is resolved, compiling the todo note template and the
+    rules for events. With `endpoints`, the endpoint modules are imported,
+    which builds the schemas of their arguments. With `event_handlers`,
+    the event handler modules are imported. With an `application`, the
+    limetypes the plugin uses are resolved.
+
+    Returns an ordered dict with the number of seconds each step took.
+    """
+    steps = [('settings', settings.load)]
+    if endpoints:
+        steps.append(('endpoints', _import_endpoints))
+    if event_handlers:
+        steps.append(('event_handlers', _import_event_handlers))
+    if application is not None:
+        steps.append(('limetypes', lambda: _resolve_limetypes(application)))
+
+    timings = collections.OrderedDict()
+    for name, step in steps:
+        start = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - start
+        logger.info('Warm-up step {} took {:.1f} ms'.format(
+            name, timings[name] * 1000))
+
+    return timings
+
+
+def _import_endpoints():
+    for module_name in manifest.ENDPOINTS:
+        importlib.import_module('hello_world.endpoints.' + module_name)
+
+
+def _import_event_handlers():
+    for module_name in manifest.EVENT_HANDLERS:
+        importlib.import_module('hello_world.event_handlers.' + module_name)
+
+
+def _resolve_limetypes(application):
+    for name in LIMETYPES:
+        getattr(application.limetypes, name)
@@ -0,0 +1,28 @@
+import hello_world.settings
+import hello_world.warmup
+import types
+
+
+def test_warm_up_reports_time_of_each_step():
+    timings = hello_world.warmup.warm_up(endpoints=False,
+                                         event_handlers=False)
+
+    assert list(timings) == ['settings']
+    assert timings['settings'] >= 0
+
+
+def test_warm_up_resolves_limetypes(monkeypatch):
+    monkeypatch.setattr(hello_world.settings, 'load', lambda: None)
+    resolved = []
+
+    class Limetypes:
+        def __getattr__(self, name):
+            resolved.append(name)
+
+    application = types.SimpleNamespace(limetypes=Limetypes())
+
+    timings = hello_world.warmup.warm_up(application, endpoints=False,
+                                         event_handlers=False)
+
+    assert list(timings) == ['settings', 'limetypes']
+    assert resolved == ['deal', 'company', 'coworker', 'todo']
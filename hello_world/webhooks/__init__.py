@@ -0,0 +1 @@
+"""Delivery of events to external webhooks"""
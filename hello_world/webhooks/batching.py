@@ -0,0 +1,94 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+class Batcher:
+    """Collect items and pass them on to `flush` as lists of at most
+    `max_size` items.
+
+    A batch is flushed as soon as it's full, on the thread that adds the
+    last item, or by `poll` once its first item has waited for `linger`
+    seconds, whichever comes first. Nothing flushes a lingering batch on
+    its own, so that batches are flushed on the threads that poll.
+    """
+
+    def __init__(self, flush, max_size, linger, clock=time.monotonic):
+        self.max_size = max_size
+        self.linger = linger
+        self._flush = flush
+        self._clock = clock
+        self._items = []
+        self._since = None
+        self._lock = threading.Lock()
+
+    def add(self, item):
+        with self._lock:
+            if not self._items:
+                self._since = self._clock()
+            self._items.append(item)
+            if len(self._items) >= self.max_size:
+                batch = self._take()
+            else:
+                batch = None
+
+        if batch:
+            self._flush(batch)
+
+    def poll(self):
+        """Flush the pending items if the first of them has waited for
+        `linger` seconds
+        """
+        with self._lock:
+            if (self._items and
+                    self._clock() - self._since >= self.linger):
+                batch = self._take()
+            else:
+                batch = None
+
+        if batch:
+            self._flush(batch)
+
+    def flush(self):
+        """Flush the pending items right away"""
+        with self._lock:
+            batch = self._take()
+
+        if batch:
+            self._flush(batch)
+
+    def _take(self):
+        batch, self._items = self._items, []
+        self._since = None
+        return batch
+
+    def __len__(self):
+        return len(self._items)
+
+
+def get_batcher(flush, max_size, linger):
+    """Get the batcher of this process that flushes to `flush`"""
+    key = (os.getpid(), flush, max_size, linger)
+    try:
+        return _batchers[key]
+    except KeyError:
+        with _batchers_lock:
+            if key not in _batchers:
+                logger.info('Batching webhook calls in batches of {} items '
+                            'or {} seconds'.format(max_size, linger))
+                _batchers[key] = Batcher(flush, max_size, linger)
+            return _batchers[key]
+
+
+def poll():
+    """Flush the batches of this process that have lingered long enough"""
+    pid = os.getpid()
+    for key, batcher in list(_batchers.items()):
+        if key[0] == pid:
+            batcher.poll()
@@ -0,0 +1,54 @@
+import hello_world.webhooks.batching
+
+
+def test_flushes_when_batch_is_full():
+    batches = []
+    batcher = hello_world.webhooks.batching.Batcher(batches.append, 3, 60)
+
+    for i in range(7):
+        batcher.add(i)
+
+    assert batches == [[0, 1, 2], [3, 4, 5]]
+    assert len(batcher) == 1
+
+
+def test_poll_flushes_after_linger():
+    now = [0]
+    batches = []
+    batcher = hello_world.webhooks.batching.Batcher(
+        batches.append, 10, 5, clock=lambda: now[0])
+
+    batcher.add(1)
+    now[0] = 3
+    batcher.add(2)
+    batcher.poll()
+
+    assert batches == []
+
+    now[0] = 5
+    batcher.poll()
+    batcher.poll()
+
+    assert batches == [[1, 2]]
+
+
+def test_poll_flushes_lingering_batches_of_this_process(monkeypatch):
+    monkeypatch.setattr(hello_world.webhooks.batching, '_batchers', {})
+    batches = []
+    batcher = hello_world.webhooks.batching.get_batcher(batches.append, 10, 0)
+
+    batcher.add(1)
+    hello_world.webhooks.batching.poll()
+
+    assert batches == [[1]]
+
+
+def test_flush_sends_pending_items():
+    batches = []
+    batcher = hello_world.webhooks.batching.Batcher(batches.append, 10, 60)
+
+    batcher.add(1)
+    batcher.flush()
+    batcher.flush()
+
+    assert batches == [[1]]
@@ -0,0 +1,214 @@
+"""Drop events that have been delivered before
+
+Brokers deliver a message again when the worker died or failed to ack it,
+so the same event can come in more than once. `SeenSet` remembers the ids of
+delivered events for a while in a fixed amount of memory, by keeping them in
+Bloom filters that are swapped out every `window` seconds.
+
+A Bloom filter can mistake an event it hasn't seen for one that it has, but
+never the other way around. The chance of that is at most `error_rate` as
+long as no more than `capacity` events are delivered per window, and the
+memory needed grows with the log of 1 / `error_rate`.
+"""
+import atexit
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_seen_sets = {}
+_seen_sets_lock = threading.Lock()
+
+
+class BloomFilter:
+    """A set of at most `capacity` keys with a false positive rate of at
+    most `error_rate`, that can be added to and checked but not listed
+    """
+
+    def __init__(self, capacity, error_rate, bits=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = -int(capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        if bits is None:
+            self.bits = bytearray((self.size + 7) // 8)
+            self.count = 0
+        else:
+            # Estimate how many keys were added from the bits that are set
+            self.bits = bits
+            ones = bin(int.from_bytes(bits, 'little')).count('1')
+            self.count = round(-self.size / self.hashes *
+                               math.log(1 - min(ones, self.size - 1) /
+                                        self.size))
+
+    def _positions(self, key):
+        # Two 64-bit halves of one digest give all the positions, as
+        # h1 + i * h2, which is as good as `hashes` independent hashes
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7))
+                   for p in self._positions(key))
+
+    def add(self, key):
+        for p in self._positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    @property
+    def false_positive_rate(self):
+        """The estimated chance of a false positive with what's been added
+        so far
+        """
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** \
+            self.hashes
+
+
+class SeenSet:
+    """Remembers keys for at least `window` and at most twice `window`
+    seconds, in two Bloom filters of `capacity` keys each.
+
+    Keys are added to the current filter, and checked against both the
+    current and the previous one. Every `window` seconds the previous
+    filter is dropped and the current one takes its place.
+    """
+
+    def __init__(self, window, capacity, error_rate, clock=time.monotonic):
+        self.window = window
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.duplicates = 0
+        self.rotations = 0
+        self._current = BloomFilter(capacity, error_rate)
+        self._previous = BloomFilter(capacity, error_rate)
+        self._clock = clock
+        self._started = clock()
+        self._lock = threading.Lock()
+
+    def _rotate(self):
+        elapsed = self._clock() - self._started
+        if elapsed < self.window:
+            return
+        if elapsed < 2 * self.window:
+            self._previous = self._current
+        else:
+            self._previous = BloomFilter(self.capacity, self.error_rate)
+        self._current = BloomFilter(self.capacity, self.error_rate)
+        self._started = self._clock()
+        self.rotations += 1
+
+    def seen(self, key):
+        """Tell whether `key` has been added, counting it as a duplicate if
+        it has
+        """
+        with self._lock:
+            self._rotate()
+            if key in self._current or key in self._previous:
+                self.duplicates += 1
+                return True
+            return False
+
+    def add(self, key):
+        with self._lock:
+            self._rotate()
+            self._current.add(key)
+
+    def save(self, path):
+        """Write the filters to `path`, replacing it atomically"""
+        with self._lock:
+            temporary = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temporary, 'wb') as f:
+                f.write(bytes(self._previous.bits))
+                f.write(bytes(self._current.bits))
+            os.replace(temporary, path)
+
+    def load(self, path):
+        """Read the filters saved to `path`, if they have the same size
+
+        Both are merged into the current filter, since there's no telling
+        how long ago they were saved, so events from before are remembered
+        for at least another window.
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        length = len(self._current.bits)
+        if len(data) != 2 * length:
+            logger.warning('Ignoring seen events in {}, saved with other '
+                           'settings'.format(path))
+            return
+        with self._lock:
+            self._current = BloomFilter(
+                self.capacity, self.error_rate,
+                bits=bytearray(a | b for a, b in zip(data[:length],
+                                                     data[length:])))
+
+    def stats(self):
+        return {
+            'window': self.window,
+            'capacity': self.capacity,
+            'error_rate': self.error_rate,
+            'false_positive_rate': max(
+                self._current.false_positive_rate,
+                self._previous.false_positive_rate),
+            'memory_bytes': len(self._current.bits) +
+            len(self._previous.bits),
+            'size': self._current.count + self._previous.count,
+            'duplicates': self.duplicates,
+            'rotations': self.rotations,
+        }
+
+
+def _key(config, name):
+    return (os.getpid(), name, config.dedup_window, config.dedup_capacity,
+            config.dedup_error_rate, config.dedup_path)
+
+
+def get_seen_set(config, name=None):
+    """Get the `SeenSet` of this process for `config`, the `events` settings
+    of the plugin, or `None` if de-duplication is off
+
+    Handlers that see the same events, but need to remember them on their
+    own, get sets of their own by `name`.
+
+    With `dedup_path` set, the seen events are read from it when the set is
+    created and written to it when the process exits, so that they survive
+    restarts. Named sets are kept next to it, with the name as suffix.
+    """
+    if not config.dedup_window:
+        return None
+    key = _key(config, name)
+    try:
+        return _seen_sets[key]
+    except KeyError:
+        with _seen_sets_lock:
+            if key not in _seen_sets:
+                seen = SeenSet(config.dedup_window, config.dedup_capacity,
+                               config.dedup_error_rate)
+                logger.info('Remembering delivered events for {}s in {} '
+                            'bytes'.format(config.dedup_window,
+                                           seen.stats()['memory_bytes']))
+                if config.dedup_path:
+                    path = (config.dedup_path if name is None else
+                            '{}.{}'.format(config.dedup_path, name))
+                    seen.load(path)
+                    atexit.register(seen.save, path)
+                _seen_sets[key] = seen
+            return _seen_sets[key]
+
+
+def stats(config, name=None):
+    """Get the stats of the `SeenSet` of this process for `config` and
+    `name`, or `None` if no events have been checked against it
+    """
+    seen = _seen_sets.get(_key(config, name))
+    return seen.stats() if seen is not None else None
@@ -0,0 +1,101 @@
+import hello_world.webhooks.dedup as dedup
+import pytest
+import types
+
+
+@pytest.fixture
+def seen(clock):
+    return dedup.SeenSet(window=60, capacity=1000, error_rate=0.001,
+                         clock=clock)
+
+
+@pytest.fixture(autouse=True)
+def no_seen_sets(monkeypatch):
+    monkeypatch.setattr(dedup, '_seen_sets', {})
+
+
+def config(**values):
+    return types.SimpleNamespace(**dict({
+        'dedup_window': 60,
+        'dedup_capacity': 1000,
+        'dedup_error_rate': 0.001,
+        'dedup_path': ''}, **values))
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = dedup.BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(str(i))
+
+    assert all(str(i) in bloom for i in range(1000))
+
+
+def test_bloom_filter_keeps_to_error_rate():
+    bloom = dedup.BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(str(i))
+
+    false_positives = sum(str(i) in bloom for i in range(1000, 11000))
+
+    assert false_positives < 200
+    assert bloom.false_positive_rate == pytest.approx(0.01, rel=0.1)
+
+
+def test_memory_grows_with_lower_error_rate():
+    assert len(dedup.BloomFilter(1000, 0.0001).bits) > \
+        len(dedup.BloomFilter(1000, 0.01).bits)
+
+
+def test_seen_set_counts_duplicates(seen):
+    assert not seen.seen('a')
+    seen.add('a')
+
+    assert seen.seen('a')
+    assert seen.stats()['duplicates'] == 1
+
+
+def test_seen_set_remembers_keys_for_at_least_a_window(seen, clock):
+    seen.add('a')
+    clock.now = 90
+
+    assert seen.seen('a')
+
+    clock.now = 150
+
+    assert not seen.seen('a')
+    assert seen.stats()['rotations'] == 2
+
+
+def test_seen_set_survives_restart(seen, tmpdir):
+    path = str(tmpdir.join('seen'))
+    seen.add('a')
+    seen.save(path)
+
+    restarted = dedup.SeenSet(window=60, capacity=1000, error_rate=0.001)
+    restarted.load(path)
+
+    assert restarted.seen('a')
+    assert restarted.stats()['size'] == 1
+
+
+def test_seen_set_ignores_file_saved_with_other_settings(seen, tmpdir):
+    path = str(tmpdir.join('seen'))
+    seen.add('a')
+    seen.save(path)
+
+    restarted = dedup.SeenSet(window=60, capacity=10, error_rate=0.001)
+    restarted.load(path)
+
+    assert not restarted.seen('a')
+
+
+def test_get_seen_set_is_off_without_window():
+    assert dedup.get_seen_set(config(dedup_window=0)) is None
+
+
+def test_get_seen_set_reuses_seen_set():
+    seen = dedup.get_seen_set(config())
+
+    assert dedup.get_seen_set(config()) is seen
+    assert dedup.stats(config())['memory_bytes'] == 2 * len(
+        dedup.BloomFilter(1000, 0.001).bits)
@@ -0,0 +1,164 @@
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_drainers = {}
+_drainers_lock = threading.Lock()
+
+
+def backoff(attempts, base, cap, rand=random.random):
+    """The number of seconds to wait before attempt number `attempts` + 1
+
+    The delay doubles with every attempt, up to `cap` seconds, and half of
+    it is random so that failed payloads don't all come back at once.
+    """
+    delay = min(cap, base * 2 ** attempts)
+    return delay / 2 + rand() * delay / 2
+
+
+class Drainer(threading.Thread):
+    """A background thread delivering the payloads of `outbox` with
+    `deliver`, retrying failed ones with exponential backoff.
+
+    When no payloads are due, the outbox is checked again after `interval`
+    seconds, and then less and less often, up to every `idle_max` seconds,
+    until payloads are due again or `wake` is called.
+
+    Payloads are claimed for `lease` seconds, and the lease of a batch is
+    extended whenever half of it has passed, so that a batch of slow calls
+    isn't claimed again by another process while it's being delivered. A
+    single delivery must take less than half of `lease`.
+
+    Payloads that have failed `max_attempts` times, or with an error for
+    which `permanent` returns true, are moved to the dead letters of the
+    outbox instead of being retried. By default payloads are retried for
+    as long as it takes.
+
+    The outbox is compacted after every `compact_every` delivered payloads.
+    """
+
+    def __init__(self, outbox, deliver, batch_size=100, interval=1,
+                 backoff_base=1, backoff_max=300, compact_every=10000,
+                 lease=60, idle_max=5, max_attempts=None, permanent=None,
+                 clock=time.monotonic):
+        super().__init__(name='hello-world-outbox-drainer', daemon=True)
+        self.outbox = outbox
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.interval = interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.compact_every = compact_every
+        self.lease = lease
+        self.idle_max = max(idle_max, interval)
+        self.max_attempts = max_attempts
+        self.permanent = permanent
+        self._clock = clock
+        self.delivered = 0
+        self.failed = 0
+        self.buried = 0
+        self._stopped = threading.Event()
+        self._woken = threading.Event()
+
+    def run(self):
+        delay = self.interval
+        while not self._stopped.is_set():
+            self._woken.clear()
+            try:
+                drained = self.drain()
+            except Exception:
+                logger.exception('Failed to drain {}'.format(
+                    self.outbox.path))
+                drained = 0
+
+            if drained:
+                delay = self.interval
+            elif self._woken.wait(delay):
+                delay = self.interval
+            else:
+                # Checking an empty outbox takes a write lock on it, so
+                # back off while it stays empty
+                delay = min(delay * 2, self.idle_max)
+
+    def drain(self):
+        """Try to deliver one batch of due payloads
+
+        Returns the number of payloads that were due.
+        """
+        payloads = self.outbox.claim(self.batch_size, lease=self.lease)
+        renew_at = self._clock() + self.lease / 2
+        delivered = []
+
+        for i, (id_, payload, attempts) in enumerate(payloads):
+            if self._clock() >= renew_at:
+                # Delivered payloads are only removed at the end, so they
+                # are held on to as well as the ones still to deliver
+                self.outbox.extend(delivered + [row[0]
+                                                for row in payloads[i:]],
+                                   self.lease)
+                renew_at = self._clock() + self.lease / 2
+            try:
+                self.deliver(payload)
+            except Exception as e:
+                self.failed += 1
+                if self._gives_up(attempts + 1, e):
+                    logger.error('Failed to deliver payload {} after {} '
+                                 'attempts, moving it to the dead letters: '
+                                 '{}'.format(id_, attempts + 1, e))
+                    self.outbox.bury(id_, e)
+                    self.buried += 1
+                    continue
+                # Errors may tell how long to wait, like an open circuit
+                # does, in which case there's no point in trying earlier.
+                delay = max(backoff(attempts, self.backoff_base,
+                                    self.backoff_max),
+                            getattr(e, 'retry_after', 0))
+                logger.warning('Failed to deliver payload {}, attempt {}. '
+                               'Retrying in {:.1f}s: {}'.format(
+                                   id_, attempts + 1, delay, e))
+                self.outbox.retry(id_, delay)
+            else:
+                delivered.append(id_)
+
+        if delivered:
+            self.outbox.done(delivered)
+            before = self.delivered // self.compact_every
+            self.delivered += len(delivered)
+            if self.delivered // self.compact_every > before:
+                self.outbox.compact()
+
+        return len(payloads)
+
+    def _gives_up(self, attempts, error):
+        return ((self.max_attempts is not None and
+                 attempts >= self.max_attempts) or
+                (self.permanent is not None and self.permanent(error)))
+
+    def wake(self):
+        """Check for due payloads right away, e.g. after putting one"""
+        self._woken.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._woken.set()
+
+
+def get_drainer(outbox, deliver, **options):
+    """Get the drainer of `outbox` in this process, starting it if it isn't
+    running already.
+    """
+    key = (os.getpid(), outbox.path)
+    drainer = _drainers.get(key)
+    if drainer is None or not drainer.is_alive():
+        with _drainers_lock:
+            drainer = _drainers.get(key)
+            if drainer is None or not drainer.is_alive():
+                logger.info('Starting drainer of {}'.format(outbox.path))
+                drainer = Drainer(outbox, deliver, **options)
+                drainer.start()
+                _drainers[key] = drainer
+    return drainer
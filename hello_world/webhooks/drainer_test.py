@@ -0,0 +1,150 @@
+import hello_world.outbox
+import hello_world.webhooks.drainer
+import pytest
+import time
+
+
+@pytest.fixture
+def outbox(tmpdir):
+    return hello_world.outbox.Outbox(str(tmpdir.join('outbox.sqlite3')))
+
+
+def test_backoff_doubles_up_to_cap():
+    def backoff(attempts):
+        return hello_world.webhooks.drainer.backoff(attempts, 1, 30,
+                                                    rand=lambda: 1)
+
+    assert [backoff(i) for i in range(7)] == [1, 2, 4, 8, 16, 30, 30]
+
+
+def test_backoff_is_jittered():
+    assert hello_world.webhooks.drainer.backoff(3, 1, 30,
+                                                rand=lambda: 0) == 4
+
+
+def test_drain_delivers_and_removes_payloads(outbox):
+    delivered = []
+    drainer = hello_world.webhooks.drainer.Drainer(outbox, delivered.append)
+    outbox.put({'deal': 1})
+    outbox.put({'deal': 2})
+
+    assert drainer.drain() == 2
+    assert delivered == [{'deal': 1}, {'deal': 2}]
+    assert len(outbox) == 0
+
+
+def test_drain_retries_failed_payloads_later(outbox):
+    def deliver(payload):
+        raise ConnectionError('Connection refused')
+
+    drainer = hello_world.webhooks.drainer.Drainer(outbox, deliver,
+                                                   backoff_base=60)
+    outbox.put({'deal': 1})
+
+    assert drainer.drain() == 1
+    assert drainer.drain() == 0
+    assert len(outbox) == 1
+    assert drainer.failed == 1
+
+
+def test_drain_buries_payloads_after_max_attempts(outbox):
+    def deliver(payload):
+        raise ConnectionError('Connection refused')
+
+    drainer = hello_world.webhooks.drainer.Drainer(
+        outbox, deliver, backoff_base=0, max_attempts=2)
+    outbox.put({'deal': 1})
+
+    drainer.drain()
+    assert len(outbox) == 1
+
+    drainer.drain()
+    assert len(outbox) == 0
+    assert [row[1:3] for row in outbox.dead_letters()] == [({'deal': 1}, 2)]
+    assert drainer.buried == 1
+
+
+def test_drain_buries_permanent_failures_right_away(outbox):
+    def deliver(payload):
+        raise ValueError('Bad request')
+
+    drainer = hello_world.webhooks.drainer.Drainer(
+        outbox, deliver,
+        permanent=lambda error: isinstance(error, ValueError))
+    outbox.put({'deal': 1})
+
+    assert drainer.drain() == 1
+    assert len(outbox) == 0
+    assert outbox.dead_letters()[0][3] == 'Bad request'
+
+
+def test_drain_extends_lease_of_slow_batch(tmpdir):
+    now = [1000]
+    outbox = hello_world.outbox.Outbox(str(tmpdir.join('outbox.sqlite3')),
+                                       clock=lambda: now[0])
+    claimed = []
+
+    def deliver(payload):
+        # Another process looks for due payloads during every call
+        claimed.extend(outbox.claim())
+        now[0] += 40
+
+    drainer = hello_world.webhooks.drainer.Drainer(
+        outbox, deliver, lease=60, clock=lambda: now[0])
+    for i in range(3):
+        outbox.put({'deal': i})
+
+    assert drainer.drain() == 3
+    assert claimed == []
+    assert len(outbox) == 0
+
+
+def test_get_drainer_starts_drainer_thread(outbox):
+    delivered = []
+    drainer = hello_world.webhooks.drainer.get_drainer(
+        outbox, delivered.append, interval=0.01)
+    outbox.put({'deal': 1})
+
+    try:
+        drainer.join(timeout=0.2)
+        assert delivered == [{'deal': 1}]
+    finally:
+        drainer.stop()
+
+
+def test_drainer_backs_off_while_outbox_is_empty(outbox, monkeypatch):
+    claims = []
+    claim = outbox.claim
+    monkeypatch.setattr(outbox, 'claim',
+                        lambda *args, **kwargs: claims.append(1) or
+                        claim(*args, **kwargs))
+    drainer = hello_world.webhooks.drainer.Drainer(
+        outbox, lambda payload: None, interval=0.01, idle_max=0.1)
+
+    drainer.start()
+    try:
+        time.sleep(0.5)
+    finally:
+        drainer.stop()
+
+    # Checking every 10 ms would have been 50 claims
+    assert len(claims) < 15
+
+
+def test_wake_delivers_right_away(outbox):
+    delivered = []
+    drainer = hello_world.webhooks.drainer.Drainer(
+        outbox, delivered.append, interval=10)
+
+    drainer.start()
+    try:
+        time.sleep(0.05)
+        outbox.put({'deal': 1})
+        drainer.wake()
+        deadline = time.monotonic() + 1
+        while not delivered and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        drainer.stop()
+
+    assert delivered == [{'deal': 1}]
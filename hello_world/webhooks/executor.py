@@ -0,0 +1,60 @@
+import concurrent.futures
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class BoundedExecutor:
+    """Run calls on a pool of `max_workers` threads, with at most
+    `max_in_flight` calls queued or running at a time.
+
+    `submit` blocks while the limit is reached, which holds back whoever is
+    submitting, e.g. the consumer of a queue, until calls have completed.
+    """
+
+    def __init__(self, max_workers, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='hello-world-webhook')
+
+    def submit(self, fn, *args, **kwargs):
+        self._slots.acquire()
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def wait(self):
+        """Block until all submitted calls have completed"""
+        for _ in range(self.max_in_flight):
+            self._slots.acquire()
+        for _ in range(self.max_in_flight):
+            self._slots.release()
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+def get_executor(max_workers=10, max_in_flight=100):
+    """Get the executor for webhook calls of this process"""
+    key = (os.getpid(), max_workers, max_in_flight)
+    try:
+        return _executors[key]
+    except KeyError:
+        with _executors_lock:
+            if key not in _executors:
+                logger.info('Creating webhook executor with {} threads and '
+                            'at most {} calls in flight'.format(
+                                max_workers, max_in_flight))
+                _executors[key] = BoundedExecutor(max_workers, max_in_flight)
+            return _executors[key]
@@ -0,0 +1,45 @@
+import hello_world.webhooks.executor
+import threading
+import time
+
+
+def test_submit_runs_call():
+    executor = hello_world.webhooks.executor.BoundedExecutor(2, 2)
+
+    future = executor.submit(lambda x: x * 2, 21)
+
+    assert future.result(timeout=1) == 42
+
+
+def test_submit_blocks_when_max_in_flight_is_reached():
+    executor = hello_world.webhooks.executor.BoundedExecutor(2, 2)
+    release = threading.Event()
+    submitted = []
+
+    def submit_third():
+        executor.submit(release.wait)
+        submitted.append(True)
+
+    executor.submit(release.wait)
+    executor.submit(release.wait)
+    submitter = threading.Thread(target=submit_third)
+    submitter.start()
+    time.sleep(0.05)
+
+    assert submitted == []
+
+    release.set()
+    submitter.join(timeout=1)
+
+    assert submitted == [True]
+
+
+def test_wait_blocks_until_calls_complete():
+    executor = hello_world.webhooks.executor.BoundedExecutor(2, 4)
+    done = []
+
+    for i in range(4):
+        executor.submit(lambda i=i: (time.sleep(0.01), done.append(i)))
+    executor.wait()
+
+    assert sorted(done) == [0, 1, 2, 3]
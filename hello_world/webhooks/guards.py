@@ -0,0 +1,189 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a webhook whose circuit is open"""
+
+    def __init__(self, url, retry_after):
+        super().__init__('Circuit for {} is open, retry in {:.1f}s'.format(
+            url, retry_after))
+        self.url = url
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stop calling a failing webhook for a while
+
+    After `failure_threshold` consecutive failures the circuit opens and all
+    calls are rejected for `reset_timeout` seconds. Then it's half-open and
+    lets a single trial call through: if it succeeds the circuit closes
+    again, otherwise it opens for another `reset_timeout` seconds.
+    """
+
+    def __init__(self, url, failure_threshold=5, reset_timeout=30,
+                 clock=time.monotonic):
+        self.url = url
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.successes = 0
+        self.rejected = 0
+        self.opened = 0
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise `CircuitOpenError` if the call isn't allowed"""
+        with self._lock:
+            if self.state == OPEN:
+                elapsed = self._clock() - self._opened_at
+                if elapsed < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.url,
+                                           self.reset_timeout - elapsed)
+                self.state = HALF_OPEN
+                self._trial = False
+
+            if self.state == HALF_OPEN:
+                if self._trial:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.url, 0)
+                self._trial = True
+
+    def success(self):
+        with self._lock:
+            self.successes += 1
+            self._consecutive_failures = 0
+            self.state = CLOSED
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._consecutive_failures += 1
+            if (self.state == HALF_OPEN or
+                    self._consecutive_failures >= self.failure_threshold):
+                if self.state != OPEN:
+                    logger.warning('Opening circuit for {}'.format(self.url))
+                    self.opened += 1
+                self.state = OPEN
+                self._opened_at = self._clock()
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'successes': self.successes,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'opened': self.opened,
+        }
+
+
+class TokenBucket:
+    """Limit calls to `rate` per second on average, allowing bursts of up to
+    `capacity` calls.
+
+    A `rate` of 0 means no limit.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.granted = 0
+        self.throttled = 0
+        self.waited = 0.0
+        self._tokens = capacity
+        self._updated = clock()
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available"""
+        if not self.rate:
+            self.granted += 1
+            return
+
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._updated) *
+                               self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            self.granted += 1
+            if wait:
+                self.throttled += 1
+                self.waited += wait
+
+        # Tokens are taken in advance, so callers that have to wait are
+        # served in order without holding the lock while sleeping.
+        if wait:
+            self._sleep(wait)
+
+    def stats(self):
+        return {
+            'rate': self.rate,
+            'granted': self.granted,
+            'throttled': self.throttled,
+            'waited': self.waited,
+        }
+
+
+def get_guards(url, config):
+    """Get the circuit breaker and the rate limiter for calls to `url`
+
+    `config` is the `events` settings of the plugin.
+    """
+    try:
+        return _guards[url]
+    except KeyError:
+        with _guards_lock:
+            if url not in _guards:
+                _guards[url] = (
+                    CircuitBreaker(
+                        url,
+                        failure_threshold=config.circuit_failure_threshold,
+                        reset_timeout=config.circuit_reset_timeout),
+                    TokenBucket(config.rate_limit, config.rate_burst))
+            return _guards[url]
+
+
+def call(url, config, fn, *args, **kwargs):
+    """Call `fn` unless the circuit for `url` is open, waiting for the rate
+    limit of `url` first.
+
+    Any exception raised by `fn` counts as a failure.
+    """
+    breaker, bucket = get_guards(url, config)
+    breaker.before_call()
+    bucket.acquire()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception:
+        breaker.failure()
+        raise
+    breaker.success()
+    return result
+
+
+def stats():
+    """Get the state and the counters of the guards of every url"""
+    return {url: {'circuit': breaker.stats(), 'rate_limit': bucket.stats()}
+            for url, (breaker, bucket) in list(_guards.items())}
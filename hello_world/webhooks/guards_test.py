@@ -0,0 +1,103 @@
+import hello_world.webhooks.guards as guards
+import pytest
+import types
+
+
+@pytest.fixture
+def breaker(clock):
+    return guards.CircuitBreaker('https://example.com/foo',
+                                 failure_threshold=2, reset_timeout=30,
+                                 clock=clock)
+
+
+def test_circuit_opens_after_consecutive_failures(breaker):
+    breaker.before_call()
+    breaker.failure()
+    breaker.before_call()
+    breaker.failure()
+
+    with pytest.raises(guards.CircuitOpenError) as e:
+        breaker.before_call()
+
+    assert e.value.retry_after == 30
+    assert breaker.stats()['state'] == guards.OPEN
+
+
+def test_success_resets_consecutive_failures(breaker):
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+
+    breaker.before_call()
+    assert breaker.state == guards.CLOSED
+
+
+def test_circuit_lets_one_trial_call_through_after_timeout(breaker, clock):
+    breaker.failure()
+    breaker.failure()
+    clock.now = 30
+
+    breaker.before_call()
+
+    assert breaker.state == guards.HALF_OPEN
+    with pytest.raises(guards.CircuitOpenError):
+        breaker.before_call()
+
+    breaker.success()
+
+    assert breaker.state == guards.CLOSED
+
+
+def test_failed_trial_call_opens_circuit_again(breaker, clock):
+    breaker.failure()
+    breaker.failure()
+    clock.now = 30
+    breaker.before_call()
+    breaker.failure()
+
+    assert breaker.state == guards.OPEN
+    assert breaker.stats()['opened'] == 2
+
+
+def test_token_bucket_allows_bursts(clock):
+    bucket = guards.TokenBucket(1, 3, clock=clock, sleep=clock.sleep)
+
+    for _ in range(3):
+        bucket.acquire()
+
+    assert clock.now == 0
+
+
+def test_token_bucket_waits_for_tokens(clock):
+    bucket = guards.TokenBucket(2, 1, clock=clock, sleep=clock.sleep)
+
+    for _ in range(3):
+        bucket.acquire()
+
+    assert clock.now == 1
+    assert bucket.stats()['throttled'] == 2
+
+
+def test_call_counts_failures(monkeypatch):
+    monkeypatch.setattr(guards, '_guards', {})
+    config = types.SimpleNamespace(
+        circuit_failure_threshold=1,
+        circuit_reset_timeout=30,
+        rate_limit=0,
+        rate_burst=10)
+
+    def fail():
+        raise ConnectionError('Connection refused')
+
+    with pytest.raises(ConnectionError):
+        guards.call('https://example.com/foo', config, fail)
+    with pytest.raises(guards.CircuitOpenError):
+        guards.call('https://example.com/foo', config, fail)
+
+    assert guards.stats()['https://example.com/foo']['circuit'] == {
+        'state': guards.OPEN,
+        'successes': 0,
+        'failures': 1,
+        'rejected': 1,
+        'opened': 1,
+    }
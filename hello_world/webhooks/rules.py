@@ -0,0 +1,89 @@
+import ast
+import operator
+import re
+
+_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>=': operator.ge,
+    '<=': operator.le,
+    '>': operator.gt,
+    '<': operator.lt,
+}
+
+_RULE = re.compile(r'^\s*([\w.]+)\s*(==|!=|>=|<=|>|<|matches)\s*(.+?)\s*$')
+
+
+class RuleSet:
+    """Decide which events to forward, by a list of rules compiled once
+
+    A rule compares a dotted path into the event body to a Python literal,
+    e.g. `deal.value > 100000`, or matches it against a regular expression,
+    e.g. `company.name matches '^Acme'`. Events matching any of the rules
+    are forwarded. Without rules, all events are forwarded.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.matched = 0
+        self.dropped = 0
+        self._predicates = [compile_rule(rule) for rule in self.rules]
+
+    def __call__(self, body):
+        if not self._predicates or any(predicate(body)
+                                       for predicate in self._predicates):
+            self.matched += 1
+            return True
+
+        self.dropped += 1
+        return False
+
+    def stats(self):
+        return {'matched': self.matched, 'dropped': self.dropped}
+
+
+def compile_rule(rule):
+    """Compile `rule` into a function telling if an event body matches it
+
+    Raises `ValueError` if the rule is invalid.
+    """
+    match = _RULE.match(rule)
+    if not match:
+        raise ValueError('Invalid rule {!r}'.format(rule))
+
+    path, op, literal = match.groups()
+    keys = path.split('.')
+    try:
+        value = ast.literal_eval(literal)
+    except (ValueError, SyntaxError):
+        raise ValueError('Invalid value in rule {!r}'.format(rule))
+
+    if op == 'matches':
+        if not isinstance(value, str):
+            raise ValueError('Invalid pattern in rule {!r}'.format(rule))
+        try:
+            search = re.compile(value).search
+        except re.error as e:
+            raise ValueError('Invalid pattern in rule {!r}: {}'.format(
+                rule, e))
+
+        def compare(actual):
+            return isinstance(actual, str) and search(actual) is not None
+    else:
+        compare_op = _OPERATORS[op]
+
+        def compare(actual):
+            try:
+                return compare_op(actual, value)
+            except TypeError:
+                return False
+
+    def predicate(body):
+        actual = body
+        for key in keys:
+            if not isinstance(actual, dict):
+                return False
+            actual = actual.get(key)
+        return actual is not None and compare(actual)
+
+    return predicate
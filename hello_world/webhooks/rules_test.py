@@ -0,0 +1,49 @@
+import hello_world.webhooks.rules as rules
+import pytest
+
+
+def deal(value=0, company='Acme Inc.'):
+    return {'deal': {'id': 1, 'name': 'A good deal', 'value': value},
+            'company': {'id': 1, 'name': company}}
+
+
+@pytest.mark.parametrize('rule,body,expected', [
+    ('deal.value > 100000', deal(value=200000), True),
+    ('deal.value > 100000', deal(value=100000), False),
+    ('deal.value >= 100000', deal(value=100000), True),
+    ('deal.value == 5', deal(value=5), True),
+    ('deal.value != 5', deal(value=5), False),
+    ("company.name == 'Acme Inc.'", deal(), True),
+    ("company.name matches '^Acme'", deal(), True),
+    ("company.name matches '^Acme'", deal(company='Globex'), False),
+    ('deal.value > 100000', {}, False),
+    ("deal.value > 'a lot'", deal(value=200000), False),
+])
+def test_compile_rule(rule, body, expected):
+    assert rules.compile_rule(rule)(body) is expected
+
+
+@pytest.mark.parametrize('rule', [
+    'deal.value',
+    'deal.value > ',
+    'deal.value > some value',
+    'company.name matches 1',
+    "company.name matches '('",
+])
+def test_compile_rule_rejects_invalid_rules(rule):
+    with pytest.raises(ValueError):
+        rules.compile_rule(rule)
+
+
+def test_rule_set_forwards_events_matching_any_rule():
+    rule_set = rules.RuleSet(['deal.value > 100000',
+                              "company.name matches '^Acme'"])
+
+    assert rule_set(deal(value=200000, company='Globex'))
+    assert rule_set(deal(value=0, company='Acme Inc.'))
+    assert not rule_set(deal(value=0, company='Globex'))
+    assert rule_set.stats() == {'matched': 2, 'dropped': 1}
+
+
+def test_empty_rule_set_forwards_all_events():
+    assert rules.RuleSet([])(deal())
@@ -0,0 +1,65 @@
+import gzip
+import logging
+import os
+import threading
+import requests
+import requests.adapters
+from .. import encoding
+
+logger = logging.getLogger(__name__)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(pool_size=10):
+    """Get the HTTP session of this process
+
+    The session keeps up to `pool_size` connections per host alive, so that
+    consecutive calls don't have to set up a new TCP and TLS connection.
+    Sessions are never shared between processes, since a forked child can't
+    reuse the connections of its parent.
+    """
+    key = (os.getpid(), pool_size)
+    try:
+        return _sessions[key]
+    except KeyError:
+        with _sessions_lock:
+            if key not in _sessions:
+                logger.info('Creating HTTP session with a pool of {} '
+                            'connections'.format(pool_size))
+                _sessions[key] = _create_session(pool_size)
+            return _sessions[key]
+
+
+def _create_session(pool_size):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def post(url, body, config, timeout=None, format='json'):
+    """POST `body` to `url` using the pooled session, encoded in `format`,
+    JSON or msgpack
+
+    `body` may be an `encoding.Encoded` payload, which is sent as it is if
+    it's already in `format`. `config` is the `events` settings of the
+    plugin, which holds the pool size, the connect and read timeouts in
+    seconds and whether to gzip the request body. `timeout` is a (connect,
+    read) tuple overriding the timeouts of `config`.
+    """
+    data = encoding.encode(body, format)
+    headers = {'Content-Type': encoding.CONTENT_TYPES[format]}
+    if config.compress:
+        data = gzip.compress(data)
+        headers['Content-Encoding'] = 'gzip'
+
+    session = get_session(config.pool_size)
+    return session.post(url,
+                        data=data,
+                        headers=headers,
+                        timeout=timeout or (config.connect_timeout,
+                                            config.read_timeout))
@@ -0,0 +1,64 @@
+import gzip
+import hello_world.encoding
+import hello_world.webhooks.session
+import json
+import pytest
+import requests
+import types
+import unittest.mock
+
+
+@pytest.fixture
+def config():
+    return types.SimpleNamespace(
+        pool_size=4,
+        connect_timeout=1.5,
+        read_timeout=5,
+        compress=False)
+
+
+@pytest.fixture
+def session_post(monkeypatch):
+    monkeypatch.setattr(hello_world.webhooks.session, '_sessions', {})
+    monkeypatch.setattr('requests.Session.post', unittest.mock.MagicMock())
+    return requests.Session.post
+
+
+def test_get_session_reuses_session():
+    session = hello_world.webhooks.session.get_session(4)
+
+    assert hello_world.webhooks.session.get_session(4) is session
+
+
+def test_post_sends_json_with_timeouts(config, session_post):
+    hello_world.webhooks.session.post('https://example.com/foo',
+                                      {'test': True}, config)
+
+    session_post.assert_called_once_with(
+        'https://example.com/foo',
+        data=b'{"test": true}',
+        headers={'Content-Type': 'application/json'},
+        timeout=(1.5, 5))
+
+
+def test_post_sends_encoded_body_as_it_is(config, session_post):
+    body = hello_world.encoding.Encoded(b'{"test":true}', 'json',
+                                        {'test': True})
+
+    hello_world.webhooks.session.post('https://example.com/foo', body,
+                                      config)
+
+    _, kwargs = session_post.call_args
+    assert kwargs['data'] == b'{"test":true}'
+
+
+def test_post_compresses_body(config, session_post):
+    config.compress = True
+
+    hello_world.webhooks.session.post('https://example.com/foo',
+                                      {'test': True}, config)
+
+    _, kwargs = session_post.call_args
+    assert kwargs['headers']['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(kwargs['data']).decode('utf-8')) == \
+        {'test': True}
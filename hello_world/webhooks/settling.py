@@ -0,0 +1,128 @@
+"""Ack and requeue messages on the consumer thread
+
+Channels aren't thread safe, so a message must be acked or requeued on the
+thread that consumes it. Webhook calls that complete elsewhere, on the
+threads of the webhook executor, hand their messages over to the `Settler`
+of the process instead. The consumer thread settles them after every step
+of the worker, including the steps that find the queue idle, and while it
+waits for room for more calls. Batches that have lingered long enough are
+flushed after every step as well, so they're settled on the consumer
+thread too.
+"""
+import logging
+import os
+import queue
+import threading
+from . import batching
+
+logger = logging.getLogger(__name__)
+
+_settlers = {}
+_settlers_lock = threading.Lock()
+
+
+class Settler:
+    """Messages to ack or requeue on the consumer thread
+
+    `outstanding` counts the messages that have been handed off with
+    `hold` and haven't been settled yet.
+    """
+
+    def __init__(self):
+        self.outstanding = 0
+        self._settled = queue.Queue()
+        self._lock = threading.Lock()
+
+    def hold(self, count=1):
+        """Count `count` messages as handed off, to be settled later"""
+        with self._lock:
+            self.outstanding += count
+
+    def ack(self, message):
+        """Have `message` acked on the consumer thread
+
+        Safe to call from any thread.
+        """
+        self._settled.put((message, True))
+
+    def requeue(self, message):
+        """Have `message` requeued on the consumer thread
+
+        Safe to call from any thread.
+        """
+        self._settled.put((message, False))
+
+    def settle(self, timeout=0):
+        """Ack and requeue the messages handed over so far
+
+        Must be called on the consumer thread. If there are none, waits at
+        most `timeout` seconds for one, or for as long as it takes if
+        `timeout` is `None`. Returns the number of messages settled.
+        """
+        settled = 0
+        wait = timeout != 0
+        while True:
+            try:
+                message, ack = self._settled.get(block=wait,
+                                                 timeout=timeout)
+            except queue.Empty:
+                break
+            wait = False
+            if ack:
+                message.ack()
+            else:
+                message.requeue()
+            settled += 1
+
+        with self._lock:
+            self.outstanding -= settled
+        return settled
+
+    def wait(self, limit):
+        """Settle messages, waiting for them if need be, until fewer than
+        `limit` are outstanding
+        """
+        while self.outstanding >= limit:
+            self.settle(timeout=None)
+
+
+def settle_after_steps(worker):
+    """Settle the messages handed over after every step of `worker`
+
+    The worker consumes messages, and runs the handlers of the plugin, in
+    its `step`, which also returns when no message arrived in time. So this
+    settles messages on the consumer thread, soon after their calls
+    complete, even when no more messages arrive.
+    """
+    step = worker.step
+    if getattr(step, 'settles', False):
+        return
+
+    def settling_step(*args, **kwargs):
+        try:
+            return step(*args, **kwargs)
+        finally:
+            tick()
+
+    settling_step.settles = True
+    worker.step = settling_step
+
+
+def tick():
+    """Flush lingering batches and settle the messages handed over so far,
+    on the consumer thread
+    """
+    batching.poll()
+    get_settler().settle()
+
+
+def get_settler():
+    """Get the settler of this process"""
+    key = os.getpid()
+    try:
+        return _settlers[key]
+    except KeyError:
+        with _settlers_lock:
+            if key not in _settlers:
+                _settlers[key] = Settler()
+            return _settlers[key]
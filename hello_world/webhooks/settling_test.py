@@ -0,0 +1,68 @@
+import hello_world.webhooks.settling
+import threading
+import types
+import unittest.mock
+
+
+def test_settle_acks_and_requeues_on_calling_thread():
+    settler = hello_world.webhooks.settling.Settler()
+    settled = []
+    acked = unittest.mock.MagicMock()
+    acked.ack.side_effect = lambda: settled.append(
+        ('ack', threading.current_thread()))
+    requeued = unittest.mock.MagicMock()
+    requeued.requeue.side_effect = lambda: settled.append(
+        ('requeue', threading.current_thread()))
+    settler.hold(2)
+
+    handing = threading.Thread(target=lambda: (settler.ack(acked),
+                                               settler.requeue(requeued)))
+    handing.start()
+    handing.join(timeout=1)
+
+    assert settled == []
+    assert settler.settle() == 2
+    assert settled == [('ack', threading.current_thread()),
+                       ('requeue', threading.current_thread())]
+    assert settler.outstanding == 0
+
+
+def test_settle_returns_right_away_if_nothing_was_handed_over():
+    settler = hello_world.webhooks.settling.Settler()
+
+    assert settler.settle() == 0
+
+
+def test_wait_settles_until_below_limit():
+    settler = hello_world.webhooks.settling.Settler()
+    messages = [unittest.mock.MagicMock() for _ in range(3)]
+    settler.hold(len(messages))
+
+    def complete():
+        for message in messages:
+            settler.ack(message)
+
+    timer = threading.Timer(0.05, complete)
+    timer.start()
+    settler.wait(1)
+    timer.join()
+
+    assert settler.outstanding == 0
+    for message in messages:
+        message.ack.assert_called_once_with()
+
+
+def test_settles_after_every_step_of_worker():
+    settler = hello_world.webhooks.settling.Settler()
+    message = unittest.mock.MagicMock()
+    worker = types.SimpleNamespace(step=lambda: settler.ack(message))
+    settler.hold()
+
+    with unittest.mock.patch.object(hello_world.webhooks.settling,
+                                    'get_settler', lambda: settler):
+        hello_world.webhooks.settling.settle_after_steps(worker)
+        hello_world.webhooks.settling.settle_after_steps(worker)
+        worker.step()
+
+    message.ack.assert_called_once_with()
+    assert settler.outstanding == 0
@@ -0,0 +1,148 @@
+import concurrent.futures
+import logging
+import os
+import threading
+from .. import encoding
+
+logger = logging.getLogger(__name__)
+
+_targets = {}
+_pools = {}
+_lock = threading.Lock()
+
+
+class Target:
+    """A webhook that events are delivered to
+
+    `filter` is a dict of dotted paths into the event body and the values
+    they must have for the event to be delivered to this target, e.g.
+    `{'company.name': 'Acme Inc.'}`. Failing to deliver to a target that
+    isn't `required` doesn't fail the delivery of the event. `format` is
+    how events are encoded for the webhook, `json` or `msgpack`.
+    """
+
+    def __init__(self, url, timeout, required=True, filter=None,
+                 format='json'):
+        self.url = url
+        self.timeout = timeout
+        self.required = required
+        self.filter = filter or {}
+        self.format = format
+        self.successes = 0
+        self.failures = 0
+
+    def matches(self, body):
+        return all(_lookup(body, path) == value
+                   for path, value in self.filter.items())
+
+    def stats(self):
+        return {
+            'required': self.required,
+            'successes': self.successes,
+            'failures': self.failures,
+        }
+
+
+def _lookup(body, path):
+    for key in path.split('.'):
+        if not isinstance(body, dict):
+            return None
+        body = body.get(key)
+    return body
+
+
+def get_targets(configured, connect_timeout, read_timeout, format='json'):
+    """Get the targets for `configured`, a list of dicts with a `url` and
+    optionally a `timeout` overriding `read_timeout`, whether the target is
+    `required`, a `filter` and a `format` overriding `format`.
+
+    Raises `ValueError` if a target has no url or an unusable format.
+    """
+    targets = []
+    for target_config in configured:
+        if not target_config.get('url'):
+            raise ValueError('Webhook target {!r} has no url'.format(
+                target_config))
+        target_format = target_config.get('format', format)
+        encoding.check(target_format, 'The format of webhook target '
+                       '{}'.format(target_config['url']))
+
+        timeout = (connect_timeout,
+                   target_config.get('timeout', read_timeout))
+        key = (target_config['url'], timeout,
+               target_config.get('required', True),
+               repr(target_config.get('filter')), target_format)
+        if key not in _targets:
+            with _lock:
+                _targets.setdefault(key, Target(
+                    target_config['url'],
+                    timeout,
+                    required=target_config.get('required', True),
+                    filter=target_config.get('filter'),
+                    format=target_format))
+        targets.append(_targets[key])
+    return targets
+
+
+def _get_pool(max_workers):
+    key = (os.getpid(), max_workers)
+    if key not in _pools:
+        with _lock:
+            if key not in _pools:
+                _pools[key] = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    thread_name_prefix='hello-world-fan-out')
+    return _pools[key]
+
+
+def deliver(body, config, call):
+    """Deliver `body` to all targets in `config`, the `events` settings,
+    whose filter matches it, by calling `call(target, body)` for each of
+    them concurrently. `body` may be an `encoding.Encoded` payload.
+
+    When `body` is a batch, a list of events, each target is called with
+    the events of the batch that match its filter, if any.
+
+    Raises the error of the first required target that failed, if any.
+    """
+    value = body.value if isinstance(body, encoding.Encoded) else body
+    calls = []
+    for target in config.targets:
+        if not isinstance(value, list):
+            if target.matches(value):
+                calls.append((target, body))
+            continue
+        matching = [item for item in value if target.matches(item)]
+        if len(matching) == len(value):
+            calls.append((target, body))
+        elif matching:
+            calls.append((target, matching))
+
+    if len(calls) == 1:
+        errors = [_deliver_to(calls[0][0], calls[0][1], call)]
+    else:
+        pool = _get_pool(config.fan_out_workers)
+        errors = list(pool.map(lambda c: _deliver_to(c[0], c[1], call),
+                               calls))
+
+    for (target, _), error in zip(calls, errors):
+        if error is not None and target.required:
+            raise error
+        if error is not None:
+            logger.warning('Failed to deliver to optional target {}: '
+                           '{}'.format(target.url, error))
+
+
+def _deliver_to(target, body, call):
+    try:
+        call(target, body)
+    except Exception as e:
+        target.failures += 1
+        return e
+    target.successes += 1
+
+
+def stats():
+    """Get the counters of every target, keyed by url"""
+    return {target.url: target.stats()
+            for target in list(_targets.values())}
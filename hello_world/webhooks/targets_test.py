@@ -0,0 +1,132 @@
+import hello_world.encoding as encoding
+import hello_world.webhooks.targets as targets
+import pytest
+import threading
+import types
+
+
+@pytest.fixture(autouse=True)
+def no_targets(monkeypatch):
+    monkeypatch.setattr(targets, '_targets', {})
+
+
+def config(*configured):
+    return types.SimpleNamespace(
+        targets=targets.get_targets(configured, 3, 10),
+        fan_out_workers=4)
+
+
+def test_targets_have_their_own_timeouts():
+    assert [t.timeout for t in targets.get_targets(
+        [{'url': 'https://a.example.com', 'timeout': 1},
+         {'url': 'https://b.example.com'}], 3, 10)] == [(3, 1), (3, 10)]
+
+
+def test_targets_must_have_urls():
+    with pytest.raises(ValueError):
+        targets.get_targets([{'timeout': 1}], 3, 10)
+
+
+def test_targets_use_default_format_unless_configured():
+    assert [t.format for t in targets.get_targets(
+        [{'url': 'https://a.example.com', 'format': 'json'},
+         {'url': 'https://b.example.com'}], 3, 10,
+        format='json')] == ['json', 'json']
+
+
+def test_filter_matches_dotted_paths():
+    target = targets.Target('https://example.com', (3, 10),
+                            filter={'company.name': 'Acme Inc.'})
+
+    assert target.matches({'company': {'name': 'Acme Inc.'}})
+    assert not target.matches({'company': {'name': 'Globex'}})
+    assert not target.matches({})
+
+
+def test_deliver_calls_targets_concurrently():
+    barrier = threading.Barrier(2, timeout=1)
+    delivered = []
+
+    def call(target, body):
+        barrier.wait()
+        delivered.append(target.url)
+
+    targets.deliver({'test': True},
+                    config({'url': 'https://a.example.com'},
+                           {'url': 'https://b.example.com'}),
+                    call)
+
+    assert sorted(delivered) == ['https://a.example.com',
+                                 'https://b.example.com']
+
+
+def test_deliver_skips_targets_that_do_not_match():
+    delivered = []
+
+    targets.deliver({'deal': {'value': 1}},
+                    config({'url': 'https://a.example.com'},
+                           {'url': 'https://b.example.com',
+                            'filter': {'deal.value': 100}}),
+                    lambda target, body: delivered.append(target.url))
+
+    assert delivered == ['https://a.example.com']
+
+
+def test_deliver_filters_batches_per_event():
+    delivered = {}
+    batch = [{'deal': {'value': 1}}, {'deal': {'value': 100}}]
+
+    targets.deliver(batch,
+                    config({'url': 'https://a.example.com'},
+                           {'url': 'https://b.example.com',
+                            'filter': {'deal.value': 100}},
+                           {'url': 'https://c.example.com',
+                            'filter': {'deal.value': 5}}),
+                    lambda target, body: delivered.update(
+                        {target.url: body}))
+
+    assert delivered == {'https://a.example.com': batch,
+                         'https://b.example.com': [{'deal': {'value': 100}}]}
+
+
+def test_deliver_matches_filters_against_encoded_value():
+    delivered = []
+
+    targets.deliver(encoding.Encoded(b'{"deal": {"value": 100}}', 'json',
+                                     {'deal': {'value': 100}}),
+                    config({'url': 'https://a.example.com',
+                            'filter': {'deal.value': 100}}),
+                    lambda target, body: delivered.append(body.data))
+
+    assert delivered == [b'{"deal": {"value": 100}}']
+
+
+def test_deliver_fails_when_required_target_fails():
+    def call(target, body):
+        if target.url == 'https://b.example.com':
+            raise ConnectionError('Connection refused')
+
+    with pytest.raises(ConnectionError):
+        targets.deliver({'test': True},
+                        config({'url': 'https://a.example.com'},
+                               {'url': 'https://b.example.com'}),
+                        call)
+
+    assert targets.stats() == {
+        'https://a.example.com': {
+            'required': True, 'successes': 1, 'failures': 0},
+        'https://b.example.com': {
+            'required': True, 'successes': 0, 'failures': 1},
+    }
+
+
+def test_deliver_ignores_failing_optional_targets():
+    def call(target, body):
+        if target.url == 'https://b.example.com':
+            raise ConnectionError('Connection refused')
+
+    targets.deliver({'test': True},
+                    config({'url': 'https://a.example.com'},
+                           {'url': 'https://b.example.com',
+                            'required': False}),
+                    call)
@@ -1,5 +1,5 @@
 #!/usr/bin/env python
-from contextlib import contextmanager
+from contextlib import contextmanager, ExitStack
 import os.path
 import shutil
 import sys
@@ -57,6 +57,36 @@ def test_coverage():
     browse_to('.htmlcov/index.html')
 
 
+@test.command(name='bench', help="Run benchmarks and compare the results "
+              "to an earlier run")
+@click.option('--iterations', '-n', default=500, show_default=True,
+              help='Requests or messages per benchmark')
+@click.option('--output', '-o', default='benchmark-results.json',
+              show_default=True, help='Where to write the results')
+@click.option('--compare', '-c', 'baseline', type=click.Path(exists=True),
+              help='Results of an earlier run to compare to')
+@click.option('--threshold', default=0.1, show_default=True,
+              help='Fail if anything got worse by more than this, '
+              'e.g. 0.1 for 10%')
+def test_bench(iterations, output, baseline=None, threshold=0.1):
+    from benchmarks import harness
+
+    env = dict(os.environ,
+               HELLO_WORLD_BENCH_ITERATIONS=str(iterations),
+               HELLO_WORLD_BENCH_RESULTS=output)
+    check_call(['py.test', '-q', '-s', 'benchmarks/deal_bench.py'], env=env)
+
+    if baseline:
+        regressions, lines = harness.compare(harness.read_results(baseline),
+                                             harness.read_results(output),
+                                             threshold=threshold)
+        for line in lines:
+            print(line)
+        if regressions:
+            raise Exception('{} benchmarks got worse by more than '
+                            '{:.0%}'.format(len(regressions), threshold))
+
+
 @test.command(help="Check for PEP8 violations")
 def flake():
     check_call(['flake8', abspath(dirname(__file__))])
@@ -131,6 +161,126 @@ You might add additional configuration at "{configpath}".
     IPython.embed(argv=[], user_ns={'app': app}, banner1=banner)
 
 
+@cli.command(help="Create synthetic deals at a steady rate and report the "
+             "throughput, latencies, errors and memory use over time")
+@click.option('--url', help='The deal endpoint of a running webserver, e.g. '
+              'http://localhost:5000/myapp/hello-world/deal/. Leave out to '
+              'run against an in-memory application.')
+@click.option('--concurrency', '-c', default=10, show_default=True,
+              type=click.IntRange(1), help='Number of concurrent clients')
+@click.option('--rate', '-r', default=0.0, show_default=True,
+              help='Requests per second in total, 0 for no limit')
+@click.option('--duration', '-d', default=60.0, show_default=True,
+              help='Seconds to run for')
+@click.option('--interval', '-i', default=5.0, show_default=True,
+              help='Seconds between reports')
+@click.option('--companies', default=100, show_default=True,
+              type=click.IntRange(1),
+              help='Synthetic companies to create in memory')
+@click.option('--coworkers', default=10, show_default=True,
+              type=click.IntRange(1),
+              help='Synthetic coworkers to create in memory')
+@click.option('--company-id', 'company_ids', multiple=True, type=int,
+              help='Existing company to create deals for, with --url')
+@click.option('--coworker-id', 'coworker_ids', multiple=True, type=int,
+              help='Existing coworker to create deals for, with --url')
+@click.option('--header', '-H', 'headers', multiple=True,
+              help='Header to send with --url, e.g. "x-api-key: secret"')
+@click.option('--worker', '-w', is_flag=True, default=False,
+              help='Run the deal events through an event handler worker '
+              'and a stub webhook as well, in memory only')
+@click.option('--output', '-o', help='Write the results as JSON to this '
+              'file')
+def loadtest(url, concurrency, rate, duration, interval, companies,
+             coworkers, company_ids, coworker_ids, headers, worker,
+             output=None):
+    from benchmarks import harness
+    from benchmarks import loadtest as load
+
+    def report(current):
+        print(load.format_interval(current))
+
+    with ExitStack() as stack:
+        if url:
+            if worker:
+                raise click.UsageError('--worker only works in memory')
+            if not company_ids or not coworker_ids:
+                raise click.UsageError(
+                    '--url needs --company-id and --coworker-id')
+            make_send = load.remote(
+                url, list(company_ids), list(coworker_ids),
+                headers=dict((name.strip(), value.strip()) for name, value
+                             in (h.split(':', 1) for h in headers)))
+            events = None
+        else:
+            make_send, events = stack.enter_context(load.in_process(
+                companies=companies, coworkers=coworkers, worker=worker))
+
+        intervals, summary = load.run(
+            make_send, concurrency=concurrency, rate=rate,
+            duration=duration, interval=interval, report=report,
+            events=events)
+
+    if not summary['count']:
+        raise Exception('No requests completed')
+
+    print('{count} requests, {per_second:.1f}/s, {errors} errors, '
+          'p50 {p50_ms:.2f} ms, p95 {p95_ms:.2f} ms, p99 {p99_ms:.2f} ms, '
+          'memory {memory_mb:.1f} MB ({memory_growth_mb:+.1f} MB)'.format(
+              **summary))
+    if output:
+        summary['intervals'] = [i._asdict() for i in intervals]
+        harness.write_results(output, {'loadtest': summary})
+
+
+@cli.group(help='Profile time and memory of the deal flows')
+def profile():
+    pass
+
+
+@profile.command(name='run', help="Run the deal flows under cProfile and "
+                 "tracemalloc and write hotspot and allocation reports")
+@click.option('--scenario', '-s', 'scenarios', multiple=True,
+              type=click.Choice(['deal', 'handler']),
+              help='Flow to profile, deal creation or the event handler. '
+              'Defaults to both.')
+@click.option('--iterations', '-n', default=200, show_default=True,
+              help='Iterations of each flow')
+@click.option('--output', '-o', default='profiles', show_default=True,
+              help='Directory to save the profiles and reports in')
+@click.option('--top', default=30, show_default=True,
+              help='Number of entries in the reports')
+@click.option('--frames', default=1, show_default=True,
+              help='Stack frames to keep per allocation')
+def profile_run(scenarios, iterations, output, top, frames):
+    from benchmarks import profiling
+
+    for scenario in scenarios or profiling.SCENARIOS:
+        for path in profiling.profile(scenario, iterations, output,
+                                      top=top, frames=frames):
+            print('Wrote {}'.format(path))
+
+
+@profile.command(name='diff', help="Compare profiles saved by 'profile run' "
+                 "in two directories")
+@click.argument('before', type=click.Path(exists=True, file_okay=False))
+@click.argument('after', type=click.Path(exists=True, file_okay=False))
+@click.option('--scenario', '-s', 'scenarios', multiple=True,
+              type=click.Choice(['deal', 'handler']),
+              help='Flow to compare. Defaults to those in both directories.')
+@click.option('--top', default=30, show_default=True,
+              help='Number of entries in the report')
+def profile_diff(before, after, scenarios, top):
+    from benchmarks import profiling
+
+    if not scenarios:
+        scenarios = [s for s in profiling.SCENARIOS
+                     if os.path.isfile(os.path.join(before, s + '.prof')) and
+                     os.path.isfile(os.path.join(after, s + '.prof'))]
+    for scenario in scenarios:
+        print(profiling.diff(before, after, scenario, top=top))
+
+
 @cli.command(help="Build wheel and upload to internal pypi server")
 @click.option('--force', '-f', default=False, is_flag=True, help="Force")
 @click.option('--username', '-u', help='Username for uploading to internal '